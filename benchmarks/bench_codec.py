@@ -0,0 +1,54 @@
+"""Decode time of hot websocket messages with each installed json codec.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/bench_codec.py [count]
+"""
+import json
+import sys
+import timeit
+
+import quantrt.api.codec as codec
+
+from quantrt.common.fixed import ProductScale, Scale
+
+
+SCALE = ProductScale("BTC-USD", Scale("0.01"), Scale("0.00000001"))
+
+FRAMES = {
+    "l2update": '{"type":"l2update","product_id":"BTC-USD","changes":[["buy","10101.80000000","0.162567"],'
+                '["sell","10102.55","0.0"]],"time":"2019-08-14T20:42:27.265Z"}',
+    "match": '{"type":"match","trade_id":10,"sequence":50,"maker_order_id":"ac928c66-ca53-498f-9c13-a110027a60e8",'
+             '"taker_order_id":"132fb6ae-456b-4654-b4e0-d681ac05cea1","time":"2014-11-07T08:19:27.028459Z",'
+             '"product_id":"BTC-USD","size":"5.23512","price":"400.23","side":"sell"}',
+    "ticker": '{"type":"ticker","sequence":37475248783,"product_id":"BTC-USD","price":"1285.22","open_24h":"1310.79",'
+              '"volume_24h":"245532.79269678","low_24h":"1280.52","high_24h":"1313.8","volume_30d":"9788783.60117027",'
+              '"best_bid":"1285.04","best_ask":"1285.27","side":"buy","time":"2022-10-19T23:28:22.061769Z",'
+              '"trade_id":370843401,"last_size":"11.4396987"}',
+}
+
+
+def baseline(frame: str):
+    """The previous path: stdlib json and `Decimal` conversion of every price and size."""
+    message = json.loads(frame)
+    if message["type"] == "l2update":
+        return [(side, SCALE.price.to_ticks(price), SCALE.size.to_ticks(size)) for side, price, size in message["changes"]]
+    if message["type"] == "match":
+        return SCALE.price.to_ticks(message["price"]), SCALE.size.to_ticks(message["size"])
+    return SCALE.price.to_ticks(message["price"]), SCALE.price.to_ticks(message["best_bid"])
+
+
+def main(count: int):
+    print("{:<24}{:>12}{:>16}".format("decoder", "message", "us/message"))
+    for kind, frame in FRAMES.items():
+        elapsed = min(timeit.repeat(lambda: baseline(frame), number=count, repeat=3))
+        print("{:<24}{:>12}{:>16.2f}".format("json + Decimal", kind, elapsed / count * 1e6))
+    for name in codec.CODECS:
+        codec.use(name)
+        decoder = codec.MessageDecoder({"BTC-USD": SCALE})
+        for kind, frame in FRAMES.items():
+            elapsed = min(timeit.repeat(lambda: decoder.decode(frame), number=count, repeat=3))
+            print("{:<24}{:>12}{:>16.2f}".format("MessageDecoder/" + name, kind, elapsed / count * 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,83 @@
+"""Import time of the app's CLI, checked against a budget.
+
+Imports `app` in fresh interpreters with `python -X importtime`, prints the slowest modules of the
+best run, and fails if the import takes longer than the budget or loads one of the heavy
+dependencies that should only be imported when they are used.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/bench_import.py [--budget MS] [--repeat N] [--top N]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+
+""" Packages that must not be imported by `import app`. """
+LAZY = ("pandas", "coinbasepro", "requests", "exchange_calendars", "pytz", "talib", "statsmodels")
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def importtime(module: str):
+    """Import the module in a fresh interpreter.
+    :return: (module, self microseconds, cumulative microseconds, depth) of every import, in order.
+    """
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    # run outside the repository, so nothing depends on the working directory, e.g. `logs/`
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                                cwd=cwd, env=env, capture_output=True, text=True)
+        created = os.listdir(cwd)
+    if result.returncode != 0:
+        sys.exit("import {} failed:\n{}".format(module, result.stderr[-2000:]))
+    if created:
+        sys.exit("import {} created {} in the working directory".format(module, created))
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is not None:
+            imports.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app", help="The module to import.")
+    parser.add_argument("--budget", type=float, default=400.0, help="The import time budget in milliseconds.")
+    parser.add_argument("--repeat", type=int, default=5, help="Imports to take the best of.")
+    parser.add_argument("--top", type=int, default=15, help="The number of slowest modules to print.")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.repeat):
+        imports = importtime(args.module)
+        runs.append((next(cumulative for name, _, cumulative, depth in imports
+                          if name == args.module and depth == 0), imports))
+    total, best = min(runs, key=lambda run: run[0])
+    elapsed = total / 1000
+
+    print("{:>10} {:>10}  module".format("self ms", "total ms"))
+    for name, own, cumulative, depth in sorted(best, key=lambda imp: imp[2], reverse=True)[:args.top]:
+        print("{:>10.1f} {:>10.1f}  {}{}".format(own / 1000, cumulative / 1000, "  " * depth, name))
+
+    failures = []
+    loaded = sorted({name.split(".")[0] for name, *_ in best} & set(LAZY))
+    if loaded:
+        failures.append("imported {}".format(", ".join(loaded)))
+    if elapsed > args.budget:
+        failures.append("took {:.1f}ms, over the budget of {:.0f}ms".format(elapsed, args.budget))
+    print("\nimport {}: best {:.1f}ms of {} runs, budget {:.0f}ms".format(
+        args.module, elapsed, args.repeat, args.budget))
+    if failures:
+        print("FAIL: import {} {}".format(args.module, "; ".join(failures)))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
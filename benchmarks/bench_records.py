@@ -0,0 +1,71 @@
+"""Memory and attribute access benchmark of the model records and batch containers.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/bench_records.py [count]
+"""
+import datetime
+import sys
+import timeit
+import tracemalloc
+
+from decimal import Decimal
+
+from quantrt.common.timescale import Timescale
+from quantrt.models.candle import Candle, SlottedCandle, FrozenCandle, CandleBatch
+from quantrt.models.order import Order, SlottedOrder, FrozenOrder, OrderBatch, OrderStatus
+
+
+def measure(build):
+    """Return (bytes allocated, seconds) to build and hold the result of `build()`."""
+    tracemalloc.start()
+    start = timeit.default_timer()
+    held = build()
+    elapsed = timeit.default_timer() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size, elapsed
+
+
+def candles(cls, count):
+    tstamp = datetime.datetime(2021, 1, 1)
+    step = datetime.timedelta(minutes=1)
+    return [cls("BTC-USD", tstamp + i * step, Timescale.Minute, 1.0, 2.0, 0.5, 1.5, 10.0) for i in range(count)]
+
+
+def orders(cls, count):
+    tstamp = datetime.datetime(2021, 1, 1)
+    return [cls(str(i), "BTC-USD", tstamp, OrderStatus.Open, "buy", Decimal("0.1"), Decimal("100.0"))
+            for i in range(count)]
+
+
+def attribute_time(records):
+    return timeit.timeit(lambda: [record.close for record in records], number=5)
+
+
+def main(count: int):
+    print("{:<24}{:>16}{:>16}{:>16}".format("container", "bytes/record", "build (s)", "read (s)"))
+
+    for name, build in [
+        ("Candle", lambda: candles(Candle, count)),
+        ("SlottedCandle", lambda: candles(SlottedCandle, count)),
+        ("FrozenCandle", lambda: candles(FrozenCandle, count)),
+        ("CandleBatch", lambda: CandleBatch.from_candles("BTC-USD", Timescale.Minute, candles(SlottedCandle, count))),
+    ]:
+        size, elapsed = measure(build)
+        held = build()
+        read = timeit.timeit(lambda: held.close.sum(), number=5) if isinstance(held, CandleBatch) else attribute_time(held)
+        print("{:<24}{:>16.1f}{:>16.4f}{:>16.4f}".format(name, size / count, elapsed, read))
+
+    for name, build in [
+        ("Order", lambda: orders(Order, count)),
+        ("SlottedOrder", lambda: orders(SlottedOrder, count)),
+        ("FrozenOrder", lambda: orders(FrozenOrder, count)),
+        ("OrderBatch", lambda: OrderBatch.from_orders(orders(SlottedOrder, count))),
+    ]:
+        size, elapsed = measure(build)
+        print("{:<24}{:>16.1f}{:>16.4f}{:>16}".format(name, size / count, elapsed, "-"))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
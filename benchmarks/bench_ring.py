@@ -0,0 +1,55 @@
+"""Cross-process throughput of `SharedRing` for each batch size and wait strategy.
+
+A producer process writes `count` trade records in batches and this process reads them.
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/bench_ring.py [count]
+"""
+import multiprocessing
+import numpy as np
+import sys
+import time
+
+from quantrt.util.ring import TRADE_DTYPE, EventFdWait, SharedRing, SleepWait, SpinWait
+
+
+def produce(name: str, capacity: int, wait, count: int, batch_size: int):
+    ring = SharedRing(TRADE_DTYPE, capacity, name=name, wait=wait)
+    batch = np.zeros(batch_size, dtype=TRADE_DTYPE)
+    batch["price"] = np.arange(batch_size)
+    sent = 0
+    while sent < count:
+        sent += ring.write(batch[:min(batch_size, count - sent)])
+    ring.close()
+
+
+def run(count: int, batch_size: int, wait) -> float:
+    ring = SharedRing(TRADE_DTYPE, 1 << 16, wait=wait)
+    out = np.empty(4096, dtype=TRADE_DTYPE)
+    producer = multiprocessing.get_context("spawn").Process(
+        target=produce, args=(ring.name, ring.capacity, wait, count, batch_size))
+    producer.start()
+    # wait for the first record so process start up is not timed
+    received = len(ring.read_wait(timeout=30.0))
+    start = time.perf_counter()
+    while received < count:
+        read = ring.read_into(out)
+        if read:
+            received += read
+        else:
+            received += len(ring.read_wait(timeout=1.0))
+    elapsed = time.perf_counter() - start
+    producer.join()
+    ring.close()
+    return (count - 1) / elapsed
+
+
+def main(count: int):
+    print("{:<16}{:>12}{:>16}".format("wait", "batch", "msgs/sec"))
+    for wait_name, wait in [("spin", SpinWait()), ("sleep", SleepWait()), ("eventfd", EventFdWait())]:
+        for batch_size in [1, 64, 1024]:
+            n = count if batch_size > 1 else count // 10
+            print("{:<16}{:>12}{:>16,.0f}".format(wait_name, batch_size, run(n, batch_size, wait)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
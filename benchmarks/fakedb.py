@@ -0,0 +1,119 @@
+"""An in-process stand-in for the asyncpg pool, so the database paths can be benchmarked without Postgres.
+
+It implements only what the models call: `pool.acquire()`, `conn.prepare(sql)` and the
+prepared statement's `fetch`, `fetchrow` and `executemany`. Rows live in memory per table,
+keyed by their conflict columns, so a benchmark measures quantrt's encoding and decoding of
+rows rather than a server round trip.
+"""
+import bisect
+import re
+
+from typing import Any, Dict, List, Tuple
+
+
+_INSERT = re.compile(r"INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_CONFLICT = re.compile(r"ON\s+CONFLICT\s*\(([^)]*)\)", re.IGNORECASE)
+_SELECT = re.compile(r"SELECT\s+\*\s+FROM\s+(\w+)", re.IGNORECASE)
+
+
+def _tstamp(row: Dict[str, Any]):
+    return row["tstamp"]
+
+
+class FakeStatement:
+
+    def __init__(self, pool: "FakePool", sql: str):
+        self.pool = pool
+        insert = _INSERT.search(sql)
+        if insert is not None:
+            self.table = insert.group(1)
+            self.columns = [column.strip() for column in insert.group(2).split(",")]
+            conflict = _CONFLICT.search(sql)
+            keys = [column.strip() for column in conflict.group(1).split(",")] if conflict else self.columns
+            self.keys = [self.columns.index(key) for key in keys]
+            self.select = False
+        else:
+            self.table = _SELECT.search(sql).group(1)
+            self.select = True
+
+
+    async def executemany(self, rows):
+        table = self.pool.tables.setdefault(self.table, {})
+        columns, keys = self.columns, self.keys
+        for row in rows:
+            table[tuple(row[i] for i in keys)] = dict(zip(columns, row))
+
+
+    async def fetch(self, product: str, *args) -> List[Dict[str, Any]]:
+        """Rows of the product, between the two timestamps of a range query or at the one timestamp.
+        Tables are expected to hold one timescale.
+        """
+        rows = self.pool.rows(self.table, product)
+        start, stop = (args[0], args[1]) if len(args) >= 3 and not isinstance(args[1], str) else (args[0], args[0])
+        lo = bisect.bisect_left(rows, start, key=_tstamp)
+        hi = bisect.bisect_right(rows, stop, lo=lo, key=_tstamp)
+        return rows[lo:hi]
+
+
+    async def fetchrow(self, product: str, *args) -> Dict[str, Any]:
+        rows = await self.fetch(product, *args)
+        return rows[0] if rows else None
+
+
+class FakeConnection:
+
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+
+    async def prepare(self, sql: str) -> FakeStatement:
+        return FakeStatement(self.pool, sql)
+
+
+class _Acquire:
+
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+
+    async def __aenter__(self) -> FakeConnection:
+        return FakeConnection(self.pool)
+
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePool:
+    """Tables of rows, seeded with `load` or written by `executemany`."""
+
+    def __init__(self):
+        # table -> key columns -> row
+        self.tables: Dict[str, Dict[Tuple, Dict[str, Any]]] = {}
+        # (table, product) -> rows ordered by tstamp, rebuilt after writes
+        self._sorted: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._versions: Dict[str, int] = {}
+
+
+    def acquire(self) -> _Acquire:
+        return _Acquire(self)
+
+
+    def load(self, table: str, rows: List[Dict[str, Any]], keys: Tuple[str, ...] = ("product", "tstamp", "timescale")):
+        stored = self.tables.setdefault(table, {})
+        for row in rows:
+            stored[tuple(row[key] for key in keys)] = row
+        self._sorted.clear()
+
+
+    def rows(self, table: str, product: str) -> List[Dict[str, Any]]:
+        version = len(self.tables.get(table, ()))
+        if self._versions.get(table) != version:
+            self._sorted = {key: rows for key, rows in self._sorted.items() if key[0] != table}
+            self._versions[table] = version
+        rows = self._sorted.get((table, product))
+        if rows is None:
+            rows = self._sorted[(table, product)] = sorted(
+                (row for row in self.tables.get(table, {}).values() if row["product"] == product),
+                key=_tstamp)
+        return rows
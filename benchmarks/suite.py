@@ -0,0 +1,379 @@
+"""Benchmark suite of the quantrt hot paths, with stored results compared across commits.
+
+Every benchmark runs on seeded synthetic data from `synthetic.py`, and the database paths run
+against the in-process pool of `fakedb.py`, so results depend only on the code and the machine.
+A run stores the best and median time of each benchmark with the machine's metadata under
+`benchmarks/results/`, named by commit, and `compare` reports the change of each benchmark
+between two stored runs, failing on regressions past the threshold.
+
+Run from the repository root:
+    PYTHONPATH=src python benchmarks/suite.py run [-k NAME] [--repeat N] [--no-save] [--compare BASE]
+    PYTHONPATH=src python benchmarks/suite.py compare BASE [HEAD] [--threshold 0.1]
+    PYTHONPATH=src python benchmarks/suite.py list
+BASE and HEAD are result files or commit prefixes of stored results. HEAD defaults to the latest run.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import glob
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakedb
+import synthetic
+
+import quantrt.common.config as config
+import quantrt.models.candle as candletools
+import quantrt.models.indicator as indicatortools
+import quantrt.trading.engine as enginetools
+import quantrt.trading.ledger as ledgertools
+import quantrt.trading.simulator as simtools
+import quantrt.util.driver as drivertools
+import quantrt.util.schedule as schedtools
+import quantrt.util.time as timetools
+
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from quantrt.api.codec import MessageDecoder
+from quantrt.common.clock import SimulatedClock
+from quantrt.common.lru import LRU
+from quantrt.common.timescale import Timescale
+from quantrt.common.types import LimitBuy, LimitSell
+from quantrt.market.book import OrderBook
+from quantrt.models.candle import CandleBatch
+from quantrt.models.indicator import Indicator
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+""" name -> setup, which returns the callable to time and the operations one call performs. """
+BENCHMARKS: Dict[str, Callable[[], Tuple[Callable[[], object], int]]] = collections.OrderedDict()
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def run_async(factory: Callable[[], object]) -> Callable[[], object]:
+    """A callable running the coroutine `factory()` on a dedicated event loop."""
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(factory())
+
+
+def use_fake_database(pool: fakedb.FakePool):
+    config.db_conn_pool = pool
+    config.prepared_sql = collections.OrderedDict()
+    config.candle_cache = None
+
+
+@benchmark("candle.fetch_batch")
+def bench_fetch_batch():
+    pool = fakedb.FakePool()
+    pool.load("candle", synthetic.candle_rows(10_000))
+    use_fake_database(pool)
+    stop = synthetic.START + 9_999 * Timescale.Minute.timedelta
+    return run_async(lambda: candletools.fetch_batch(synthetic.PRODUCT, synthetic.START, stop, Timescale.Minute)), 10_000
+
+
+@benchmark("candle.fetch_batch/as_batch")
+def bench_fetch_batch_array():
+    pool = fakedb.FakePool()
+    pool.load("candle", synthetic.candle_rows(10_000))
+    use_fake_database(pool)
+    stop = synthetic.START + 9_999 * Timescale.Minute.timedelta
+    return run_async(lambda: candletools.fetch_batch(synthetic.PRODUCT, synthetic.START, stop, Timescale.Minute,
+                                                     as_batch=True)), 10_000
+
+
+@benchmark("candle.save_batch")
+def bench_save_batch():
+    use_fake_database(fakedb.FakePool())
+    candles = synthetic.candles(10_000)
+    return run_async(lambda: candletools.save_batch(candles)), 10_000
+
+
+@benchmark("candle.save_batch/CandleBatch")
+def bench_save_candle_batch():
+    use_fake_database(fakedb.FakePool())
+    batch = CandleBatch.from_candles(synthetic.PRODUCT, Timescale.Minute, synthetic.candles(10_000))
+    return run_async(lambda: candletools.save_batch(batch)), 10_000
+
+
+@benchmark("time.datetime_floor")
+def bench_datetime_floor():
+    datetimes = synthetic.datetimes(10_000)
+    floor = timetools.datetime_floor
+
+    def run():
+        for dt in datetimes:
+            floor(dt, Timescale.FifteenMinute)
+    return run, len(datetimes)
+
+
+@benchmark("lru.lookup")
+def bench_lru():
+    cache = LRU(128)
+    keys = np.random.default_rng(0).integers(0, 160, 10_000).tolist()
+    check = int.__eq__
+    loader = str
+
+    def run():
+        for key in keys:
+            cache(key, check, loader)
+    return run, len(keys)
+
+
+@benchmark("schedule.run_pending/10k")
+def bench_run_pending():
+    clock = SimulatedClock(synthetic.START)
+    scheduler = schedtools.Scheduler(clock=clock)
+    for i in range(10_000):
+        scheduler.every(1 + i % 60).seconds.do(int)
+    step = datetime.timedelta(seconds=1)
+
+    def run():
+        for _ in range(60):
+            clock.advance(step)
+            scheduler.run_pending()
+    # the job runs in a minute of simulated time
+    return run, sum(60 // (1 + i % 60) for i in range(10_000))
+
+
+@benchmark("book.update")
+def bench_book_update():
+    book = OrderBook(synthetic.SCALE)
+    bids, asks = synthetic.book_levels(500)
+    book.snapshot(bids, asks)
+    updates = synthetic.level_updates(10_000, 500)
+    update = book.update
+
+    def run():
+        for side, price, size in updates:
+            update(side, price, size)
+    return run, len(updates)
+
+
+@benchmark("codec.decode")
+def bench_decode():
+    decoder = MessageDecoder({synthetic.PRODUCT: synthetic.SCALE})
+    frames = synthetic.frames(10_000)
+    decode = decoder.decode
+
+    def run():
+        for frame in frames:
+            decode(frame)
+    return run, len(frames)
+
+
+@benchmark("indicator.compute")
+def bench_indicators():
+    closes = synthetic.random_walk(10_000)
+
+    def run():
+        # a 20 period moving average and a 14 period RSI, the typical shape of strategy indicators
+        sums = np.cumsum(np.insert(closes, 0, 0.0))
+        sma = (sums[20:] - sums[:-20]) / 20
+        deltas = np.diff(closes)
+        gains = np.convolve(np.clip(deltas, 0, None), np.ones(14) / 14, "valid")
+        losses = np.convolve(np.clip(-deltas, 0, None), np.ones(14) / 14, "valid")
+        rsi = 100 - 100 / (1 + gains / np.where(losses == 0, 1e-12, losses))
+        return sma, rsi
+    return run, len(closes)
+
+
+@benchmark("indicator.save_batch")
+def bench_indicator_save():
+    use_fake_database(fakedb.FakePool())
+    closes = synthetic.random_walk(10_000)
+    step = Timescale.Minute.timedelta
+    indicators = [Indicator(synthetic.PRODUCT, synthetic.START + i * step, Timescale.Minute, "sma20",
+                            {"value": float(close)}) for i, close in enumerate(closes)]
+    return run_async(lambda: indicatortools.save_batch(indicators)), len(indicators)
+
+
+@benchmark("backtest.steps")
+def bench_backtest():
+    minutes = 1440
+    pool = fakedb.FakePool()
+    pool.load("candle", synthetic.candle_rows(minutes + 1))
+
+    async def backtest():
+        use_fake_database(pool)
+        stop = synthetic.START + minutes * Timescale.Minute.timedelta
+        config.clock = SimulatedClock(synthetic.START)
+        exchange = simtools.SimulatedExchange({"USD": Decimal(10 ** 9), "BTC": Decimal(10 ** 3)})
+        ledger = ledgertools.Ledger(exchange, reconcile_interval=None).attach(exchange)
+        engine = enginetools.ExecutionEngine(exchange, persist_interval=None).attach(exchange)
+        await ledger.load()
+        closes = collections.deque(maxlen=20)
+
+        async def on_candle(tstamp: datetime.datetime):
+            # a mean reversion strategy quoting around the 20 candle average
+            await exchange.step(tstamp, Timescale.Minute)
+            start = tstamp - Timescale.Minute.timedelta
+            for candle in await candletools.fetch_batch(synthetic.PRODUCT, start, start, Timescale.Minute):
+                closes.append(candle.close)
+            if len(closes) < closes.maxlen:
+                return
+            mean = Decimal(str(round(sum(closes) / len(closes), 2)))
+            await engine.requote([LimitBuy(synthetic.PRODUCT, Decimal("0.01"), mean - 5),
+                                       LimitSell(synthetic.PRODUCT, Decimal("0.01"), mean + 5)])
+
+        driver = drivertools.BacktestDriver(stop, scheduler=schedtools.Scheduler(clock=config.clock),
+                                            clock=config.clock, timescale=Timescale.Minute, on_candle=on_candle)
+        return await driver.run_async()
+    return run_async(backtest), minutes
+
+
+def machine() -> Dict[str, object]:
+    """The metadata results are only comparable under."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as fno:
+            cpu = next((line.split(":", 1)[1].strip() for line in fno if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "cpu": cpu,
+        "cpus": os.cpu_count(),
+        "python": "{} {}".format(platform.python_implementation(), platform.python_version()),
+        "numpy": np.__version__,
+    }
+
+
+def revision() -> Tuple[str, bool]:
+    """The commit of the working tree and whether it has uncommitted changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def run(names: List[str], repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    print("{:<32}{:>14}{:>14}{:>16}".format("benchmark", "best (ms)", "median (ms)", "ops/sec"))
+    for name in names:
+        func, operations = BENCHMARKS[name]()
+        func()
+        times = timeit.repeat(func, number=1, repeat=repeat)
+        best, median = min(times), statistics.median(times)
+        results[name] = {"best": best, "median": median, "operations": operations, "ops_per_sec": operations / best}
+        print("{:<32}{:>14.3f}{:>14.3f}{:>16,.0f}".format(name, best * 1e3, median * 1e3, operations / best))
+    return results
+
+
+def save(results: Dict[str, Dict[str, float]], repeat: int) -> str:
+    commit, dirty = revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "machine": machine(),
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "{}{}-{}.json".format(
+        commit[:12], "-dirty" if dirty else "", datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+    with open(path, "w") as fno:
+        json.dump(report, fno, indent=2)
+    print("Saved the results to {}".format(path))
+    return path
+
+
+def resolve(ref: Optional[str], exclude: Optional[str] = None) -> str:
+    """The result file of a path or commit prefix, the latest run if None."""
+    if ref is not None and os.path.exists(ref):
+        return ref
+    paths = sorted((path for path in glob.glob(os.path.join(RESULTS_DIR, "{}*.json".format(ref or "")))
+                    if path != exclude), key=os.path.getmtime)
+    if not paths:
+        raise SystemExit("No stored results match {}.".format(ref))
+    return paths[-1]
+
+
+def compare(base_ref: str, head_ref: Optional[str], threshold: float) -> int:
+    """Print the change of every benchmark from base to head.
+    :return: The number of benchmarks that got slower by more than `threshold`.
+    """
+    head_path = resolve(head_ref)
+    with open(resolve(base_ref, exclude=head_path)) as fno:
+        base = json.load(fno)
+    with open(head_path) as fno:
+        head = json.load(fno)
+    if base["machine"] != head["machine"]:
+        print("Warning: the runs were on different machines, the comparison is not meaningful.")
+        for key in sorted(set(base["machine"]) | set(head["machine"])):
+            if base["machine"].get(key) != head["machine"].get(key):
+                print("  {}: {} -> {}".format(key, base["machine"].get(key), head["machine"].get(key)))
+    print("{} -> {}".format(base["commit"][:12], head["commit"][:12] + ("-dirty" if head["dirty"] else "")))
+    print("{:<32}{:>14}{:>14}{:>10}".format("benchmark", "base (ms)", "head (ms)", "change"))
+    regressions = 0
+    for name, result in head["results"].items():
+        before = base["results"].get(name)
+        if before is None:
+            print("{:<32}{:>14}{:>14.3f}{:>10}".format(name, "-", result["best"] * 1e3, "new"))
+            continue
+        change = result["best"] / before["best"] - 1
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print("{:<32}{:>14.3f}{:>14.3f}{:>+9.1%}{}".format(name, before["best"] * 1e3, result["best"] * 1e3, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks and store the results.")
+    run_parser.add_argument("-k", dest="filter", default=None, help="Run only the benchmarks whose name contains this.")
+    run_parser.add_argument("--repeat", type=int, default=7, help="Timed runs of each benchmark, the best is kept.")
+    run_parser.add_argument("--no-save", action="store_true", help="Do not store the results.")
+    run_parser.add_argument("--compare", dest="base", default=None, help="Compare the run with stored results.")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="The slowdown reported as a regression.")
+    compare_parser = commands.add_parser("compare", help="Compare two stored runs.")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head", nargs="?", default=None)
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="The slowdown reported as a regression.")
+    commands.add_parser("list", help="List the benchmarks.")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print("\n".join(BENCHMARKS))
+        return 0
+    if args.command == "compare":
+        return 1 if compare(args.base, args.head, args.threshold) else 0
+
+    names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+    results = run(names, args.repeat)
+    if args.no_save:
+        return 0
+    path = save(results, args.repeat)
+    if args.base is not None:
+        return 1 if compare(args.base, path, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Synthetic, seeded market data for the benchmarks.
+
+Every generator takes a seed, so a benchmark sees the same data on every run and machine.
+"""
+import datetime
+import json
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from quantrt.common.fixed import ProductScale, Scale
+from quantrt.common.timescale import Timescale
+from quantrt.models.candle import Candle
+
+
+PRODUCT = "BTC-USD"
+SCALE = ProductScale(PRODUCT, Scale("0.01"), Scale("0.00000001"))
+START = datetime.datetime(2021, 1, 1)
+
+
+def random_walk(count: int, start: float = 30000.0, volatility: float = 0.001, seed: int = 0) -> np.ndarray:
+    """Prices of a geometric random walk."""
+    steps = np.random.default_rng(seed).normal(0.0, volatility, count)
+    return start * np.exp(np.cumsum(steps))
+
+
+def candle_rows(count: int, product: str = PRODUCT, timescale: Timescale = Timescale.Minute,
+                start: datetime.datetime = START, seed: int = 0) -> List[Dict]:
+    """Candle rows shaped like the records asyncpg returns for `SELECT * FROM candle`."""
+    closes = random_walk(count, seed=seed)
+    opens = np.concatenate([[closes[0]], closes[:-1]])
+    spread = np.abs(np.random.default_rng(seed + 1).normal(0.0, 0.0005, count)) * closes
+    volumes = np.random.default_rng(seed + 2).gamma(2.0, 5.0, count)
+    step = timescale.timedelta
+    return [{
+        "product": product,
+        "tstamp": start + i * step,
+        # the `granularity` enum of the schema holds the values
+        "timescale": timescale.value,
+        "open": float(opens[i]),
+        "high": float(max(opens[i], closes[i]) + spread[i]),
+        "low": float(min(opens[i], closes[i]) - spread[i]),
+        "close": float(closes[i]),
+        "volume": float(volumes[i]),
+    } for i in range(count)]
+
+
+def candles(count: int, product: str = PRODUCT, timescale: Timescale = Timescale.Minute,
+            start: datetime.datetime = START, seed: int = 0) -> List[Candle]:
+    return [Candle(product=row["product"], tstamp=row["tstamp"], timescale=timescale, open=row["open"],
+                   high=row["high"], low=row["low"], close=row["close"], volume=row["volume"])
+            for row in candle_rows(count, product, timescale, start, seed)]
+
+
+def datetimes(count: int, seed: int = 0) -> List[datetime.datetime]:
+    """Datetimes at random microseconds over a year."""
+    offsets = np.random.default_rng(seed).integers(0, 365 * 86400 * 10 ** 6, count)
+    return [START + datetime.timedelta(microseconds=int(offset)) for offset in offsets]
+
+
+def book_levels(levels: int, mid: float = 30000.0, tick: float = 0.01, seed: int = 0) -> Tuple[List, List]:
+    """The bids and asks of a level 2 snapshot, as strings like the feed sends them."""
+    sizes = np.random.default_rng(seed).gamma(2.0, 0.5, 2 * levels)
+    bids = [["{:.2f}".format(mid - (i + 1) * tick), "{:.8f}".format(sizes[i])] for i in range(levels)]
+    asks = [["{:.2f}".format(mid + (i + 1) * tick), "{:.8f}".format(sizes[levels + i])] for i in range(levels)]
+    return bids, asks
+
+
+def level_updates(count: int, levels: int, mid: float = 30000.0, tick: float = 0.01,
+                  seed: int = 0) -> List[Tuple[str, int, int]]:
+    """(side, price ticks, size ticks) level changes near the top of a book of `levels` levels a side,
+    a tenth of them removing the level."""
+    rng = np.random.default_rng(seed)
+    depth = rng.geometric(0.05, count).clip(1, levels)
+    sides = rng.integers(0, 2, count)
+    sizes = rng.gamma(2.0, 0.5, count)
+    sizes[rng.random(count) < 0.1] = 0.0
+    mid_ticks = SCALE.price.to_ticks("{:.2f}".format(mid))
+    tick_ticks = SCALE.price.to_ticks("{:.2f}".format(tick))
+    return [("buy" if side == 0 else "sell",
+             mid_ticks - int(offset) * tick_ticks if side == 0 else mid_ticks + int(offset) * tick_ticks,
+             SCALE.size.to_ticks("{:.8f}".format(size)))
+            for side, offset, size in zip(sides, depth, sizes)]
+
+
+def frames(count: int, seed: int = 0) -> List[str]:
+    """Websocket frames in the feed's mix: mostly l2updates, some matches and tickers."""
+    rng = np.random.default_rng(seed)
+    prices = random_walk(count, seed=seed)
+    result = []
+    for i, kind in enumerate(rng.choice(["l2update", "match", "ticker"], count, p=[0.85, 0.1, 0.05])):
+        price = "{:.2f}".format(prices[i])
+        time = (START + datetime.timedelta(milliseconds=i)).isoformat() + "Z"
+        if kind == "l2update":
+            message = {"type": "l2update", "product_id": PRODUCT, "time": time,
+                       "changes": [["buy" if rng.random() < 0.5 else "sell", price, "{:.8f}".format(rng.random())]]}
+        elif kind == "match":
+            message = {"type": "match", "trade_id": i, "sequence": i, "maker_order_id": "m{}".format(i),
+                       "taker_order_id": "t{}".format(i), "time": time, "product_id": PRODUCT,
+                       "size": "{:.8f}".format(rng.random()), "price": price, "side": "sell"}
+        else:
+            message = {"type": "ticker", "sequence": i, "product_id": PRODUCT, "price": price,
+                       "best_bid": price, "best_ask": price, "side": "buy", "time": time, "trade_id": i,
+                       "last_size": "{:.8f}".format(rng.random())}
+        result.append(json.dumps(message))
+    return result
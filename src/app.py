@@ -1,33 +1,53 @@
 import asyncio
 import argparse
-import coinbasepro
 import collections
 import importlib.util
 import json
+import os
+import time
 
 import quantrt.api.auth as auth
+import quantrt.api.feed as feedtools
 import quantrt.api.rest as rest
+import quantrt.api.shards as shardtools
+import quantrt.api.ws as ws
 import quantrt.common.config as config
+import quantrt.common.fixed as fixed
+import quantrt.market.bus as bustools
+import quantrt.market.capture as capturetools
+import quantrt.trading.engine as enginetools
+import quantrt.trading.ledger as ledgertools
+import quantrt.trading.risk as risktools
+import quantrt.trading.simulator as simtools
+import quantrt.util.cache as cachetools
 import quantrt.util.database as dbtools
+import quantrt.util.driver as drivertools
+import quantrt.util.latency as latencytools
+import quantrt.util.metrics as metricstools
+import quantrt.util.profiling as proftools
 import quantrt.util.schedule as schedtools
 import quantrt.util.time as timetools
+import quantrt.util.workers as workertools
 
 from argparse import ArgumentError
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Callable
+from decimal import Decimal
+from typing import List
 
+from quantrt.common.clock import SimulatedClock
+from quantrt.common.timescale import Timescale
 from quantrt.common.types import *
 from quantrt.common.log import *
 from quantrt.strategy.base import *
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument("command", type=str, choices=["backtest", "live"], action="store", dest="command",
+parser.add_argument("command", type=str, choices=["backtest", "live"], action="store",
                     help="The command to run on the app. `mine` collects market data. "
                          "`backtest` runs a backtesting strategy on stored data. "
                          "`live` runs a live strategy on realtime websocket feeds. ")
-parser.add_argument("credentials", type=str, action="store", dest="credentials",
+parser.add_argument("credentials", type=str, action="store",
                     help="The credentials file to use to connect to Coinbase Pro. "
                          "The credentials file is a json file with the keys "
                          "`key`, `secret`, and `passphrase`.")
@@ -35,6 +55,37 @@ parser.add_argument("--start-timestamp", type=lambda s: datetime.fromisoformat(s
                     help="The starting time to use for a backtester or miner in isoformat.")
 parser.add_argument("--end-timestamp", type=lambda s: datetime.fromisoformat(s), dest="end_tstamp", default=datetime.now(),
                     help="The ending tme to use for a backtester or miner in isoformat. Defaults to ")
+parser.add_argument("--balance", action="extend", nargs="+", dest="balances", default=[],
+                    help="A starting `CURRENCY:AMOUNT` balance of the simulated exchange of a backtest.")
+parser.add_argument("--risk-limits", type=str, dest="risk_limits", default=None,
+                    help="A json file of pre-trade risk limits by product, each an object with any of "
+                         "`max_position`, `max_notional`, `price_band`, `max_order_rate` and "
+                         "`prevent_self_trade`. The limits under `default` apply to every other product.")
+parser.add_argument("--latency-interval", type=float, dest="latency_interval", default=None,
+                    help="Measure the latency of each stage from websocket frame to order acknowledgement "
+                         "and log the histograms every this many seconds.")
+parser.add_argument("--log-json", action="store_true", dest="log_json",
+                    help="Write the log as json lines instead of text.")
+parser.add_argument("--metrics-port", type=int, dest="metrics_port", default=None,
+                    help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics while running.")
+parser.add_argument("--profile", action="store_true", dest="profile",
+                    help="Measure the wall and CPU time of each strategy's `scan` and `act` in a backtest "
+                         "and write a report of the run to the profile directory.")
+parser.add_argument("--profile-memory", action="store_true", dest="profile_memory",
+                    help="Trace allocations with tracemalloc and report them by strategy. Implies `--profile`.")
+parser.add_argument("--profile-window", action="extend", nargs="+", dest="profile_windows", default=[],
+                    help="A `START/END` range of simulated isoformat times to capture with the call profiler "
+                         "in a backtest. Implies `--profile`.")
+parser.add_argument("--profiler", type=str, choices=proftools.PROFILERS, dest="profiler", default="cprofile",
+                    help="The call profiler of the profile windows. `pyinstrument` must be installed to use it.")
+parser.add_argument("--profile-dir", type=str, dest="profile_dir", default="logs",
+                    help="The directory the profile reports are written to. Defaults to the log directory.")
+parser.add_argument("--capture-dir", type=str, dest="capture_dir", default=None,
+                    help="Record the raw websocket frames of a live run to compressed capture files in this directory, "
+                         "so the session can be replayed later.")
+parser.add_argument("--feed-shards", type=int, dest="feed_shards", default=None,
+                    help="Read the level2, matches, ticker and heartbeat channels of a live run through this many "
+                         "worker processes and merge their events into the strategies' event bus.")
 parser.add_argument("--strategy", action="extend", nargs="+", dest="strategies",
                     help="Add a `Strategy` module file to the execution runtime.")
 parser.add_argument("--scrpipt", action="extend", nargs="+", dest="scripts",
@@ -42,19 +93,23 @@ parser.add_argument("--scrpipt", action="extend", nargs="+", dest="scripts",
 
 
 strategies: List[Strategy] = []
-scripts: List[Callable] = []
+# The script files, run by path in worker processes
+scripts: List[str] = []
 
 
 async def initialize(args):
     # Label the build as `script`, `backtest`, or `live`
     config.build_label = args.command
+    if args.log_json:
+        QuantrtLog.configure(json_lines=True)
     # Initialize curtime to be the start time from the the backtest
     if config.build_label == "backtest":
-        if not args.start_timestamp:
+        if not args.start_tstamp:
             raise ArgumentError("User did not provide a starting timestamp required "
                              "for the the build {}".format(config.build_label))
         config.curtime = args.start_tstamp
         config.stoptime = args.end_tstamp
+        config.clock = SimulatedClock(args.start_tstamp)
     
     if not args.credentials.endswith(".json"):
         raise ArgumentError("User did not provide a JSON credentials file. "
@@ -66,9 +121,22 @@ async def initialize(args):
         config.secret_key = credentials.get("secret", "")
         config.passphrase = credentials.get("passphrase", "")
 
-    # Create the authenticated REST client
+    # Create the authenticated REST client. coinbasepro and requests are only imported here, so that
+    # the CLI and the script workers start without them
+    import coinbasepro
+    import requests.adapters
     config.rest_client = coinbasepro.AuthenticatedClient(
         key=config.api_key, secret=config.secret_key, passphrase=config.passphrase)
+    # Keep a keep-alive connection per concurrent request instead of reconnecting past requests' default of 10
+    config.rest_client.session.mount("https://", requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=config.rest_workers))
+
+    # Initialize the executor for submitting async requests to the api. Requests are I/O bound and
+    # share the client's session and rate limiters, so they run on threads rather than processes.
+    config.executor = ThreadPoolExecutor(max_workers=config.rest_workers, thread_name_prefix="quantrt-rest")
+
+    # Load the fixed-point price and size scales of every product
+    config.product_scales = fixed.load_product_scales(await rest.get_products())
 
     # Initialize the db connection pool
     QuantrtLog.info("Creating connection to database...")
@@ -78,43 +146,203 @@ async def initialize(args):
     # Initialize the prepared_sql statement cache
     config.prepared_sql = collections.OrderedDict()
 
-    # Initialize the executor for submitting async requests to the api.
-    config.executor = ProcessPoolExecutor()
-    
+    # Backtests read immutable candle history through the local on-disk cache
+    if config.build_label == "backtest":
+        config.candle_cache = cachetools.CandleCache()
+
+    # Measure tick-to-trade latency
+    if args.latency_interval:
+        config.latency = latencytools.LatencyTracker(args.latency_interval)
+
+    # Profile the strategies of a backtest
+    if config.build_label == "backtest" and (args.profile or args.profile_memory or args.profile_windows):
+        windows = [tuple(datetime.fromisoformat(part) for part in window.split("/"))
+                   for window in args.profile_windows]
+        config.profiler = proftools.StrategyProfiler(
+            args.profile_dir, memory=args.profile_memory, windows=windows, tool=args.profiler)
+
+    # Load the pre-trade risk limits
+    if args.risk_limits:
+        with open(args.risk_limits) as fno:
+            config.risk_limits = risktools.load_limits(json.load(fno))
+
     # Initialize strategies
     for name_file_pair in args.strategies:
         name, file = name_file_pair.split(":")
         spec = importlib.util.spec_from_file_location("module.name", file)
         module = importlib.util.module_from_spec(spec)
-        spec.loader(module)
+        spec.loader.exec_module(module)
         CustomStrategy = getattr(module, name)
         if not issubclass(CustomStrategy, Strategy):
             raise ArgumentError("The `Strategy` {} from {} is not a subclass of `Strategy`".format(name, file))
         strategies.append(CustomStrategy(name))
+        if config.profiler is not None:
+            config.profiler.add_strategy(strategies[-1])
 
-    # Initialize scripts
-    for file in args.scripts:
-        spec = importlib.util.spec_from_file_location("module.name", file)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader(module)
-        main_func = getattr(module, "main")
-        if not isinstance(main_func, Callable):
-            raise ArgumentError("The `main` function of the script {} is not callable.".format(file))
-        scripts.append(main_func)
+    # Initialize scripts. They are loaded by the workers that run them, not by the app
+    for file in args.scripts or []:
+        if not os.path.isfile(file):
+            raise ValueError("The script {} does not exist.".format(file))
+        scripts.append(file)
 
     QuantrtLog.info("App resources are initialized")
 
 
 async def run_scripts():
-    if config.executor:
-        return await asyncio.gather(*[config.executor.submit(main_func) for main_func in scripts])
-    for main_func in scripts:
-        main_func()
+    if not scripts:
+        return
+    with workertools.script_executor() as executor:
+        return await asyncio.gather(*[asyncio.wrap_future(executor.submit(workertools.run_script, file))
+                                      for file in scripts])
     
 
-async def backtest():
-    pass
+async def timed_stage(stage: str, strategy: Strategy, awaitable):
+    start = time.perf_counter()
+    if config.profiler is not None:
+        awaitable = config.profiler.measure(stage, strategy.name, awaitable)
+    try:
+        return await latencytools.timed(stage, strategy.name, awaitable)
+    finally:
+        STRATEGY_SECONDS.labels(strategy.name, stage).observe(time.perf_counter() - start)
+
+
+async def step_strategies(tstamp: datetime):
+    if config.profiler is not None:
+        config.profiler.step(tstamp)
+    # Fill the resting orders against the candle that just closed before the strategies see it
+    if isinstance(config.execution_engine.exchange, simtools.SimulatedExchange):
+        await config.execution_engine.exchange.step(tstamp, Timescale.Minute)
+    await asyncio.gather(*[timed_stage("scan", strategy, strategy.scan(tstamp)) for strategy in strategies])
+    await asyncio.gather(*[timed_stage("act", strategy, strategy.act(tstamp)) for strategy in strategies])
+
+
+def register_metrics(risk: risktools.RiskEngine):
+    # Risk, balances and latency quantiles are read from their owners at scrape time
+    registry = metricstools.default_registry
+    registry.collect("quantrt_risk_checks_total", "Pre-trade risk checks.", "counter",
+                     lambda: [("quantrt_risk_checks_total", {}, risk.checked)])
+    registry.collect("quantrt_risk_rejections_total", "Orders rejected by each pre-trade risk rule.", "counter",
+                     lambda: [("quantrt_risk_rejections_total", {"rule": rule}, count)
+                              for rule, count in risk.rejections.items()])
+    registry.collect("quantrt_balance", "Ledger balance of each currency.", "gauge",
+                     lambda: [("quantrt_balance", {"currency": currency}, float(balance))
+                              for currency, balance in list(config.ledger.balances.items())])
+    registry.collect("quantrt_latency_seconds", "Tick-to-trade latency quantiles by stage and key.", "gauge",
+                     lambda: [("quantrt_latency_seconds", {"stage": stage, "key": key, "quantile": quantile},
+                               summary[field] / 1e9)
+                              for stage, keys in (config.latency.snapshot() if config.latency else {}).items()
+                              for key, summary in keys.items()
+                              for quantile, field in (("0.5", "p50"), ("0.99", "p99"), ("0.999", "p999"))])
+
+
+async def backtest(args):
+    # Orders are matched by a simulated exchange, which drives the execution engine and ledger
+    # through the same user channel messages as live.
+    balances = {currency: Decimal(amount) for currency, amount in (pair.split(":") for pair in args.balances)}
+    exchange = simtools.SimulatedExchange(balances)
+    config.ledger = ledgertools.Ledger(exchange, reconcile_interval=None).attach(exchange)
+    risk = risktools.RiskEngine(config.risk_limits, config.risk_limits.get("default"), ledger=config.ledger,
+                                last_price=exchange.last_price, clock=lambda: config.clock.now().timestamp())
+    config.execution_engine = enginetools.ExecutionEngine(exchange, persist_interval=None, risk=risk).attach(exchange)
+    register_metrics(risk)
+    await config.ledger.load()
+
+    # Jump the simulated clock from deadline to deadline, stepping the strategies on every
+    # candle and running the scheduled jobs exactly as they run live.
+    driver = drivertools.BacktestDriver(
+        config.stoptime, scheduler=schedtools.default_scheduler,
+        timescale=Timescale.Minute, on_candle=step_strategies)
+    if config.profiler is not None:
+        config.profiler.start()
+    try:
+        steps = await driver.run_async()
+    finally:
+        if config.profiler is not None:
+            config.profiler.finish()
+    QuantrtLog.info("Backtest finished after %s steps at %s", steps, timetools.now())
+    QuantrtLog.info("Risk checks: %s", risk.stats())
+    if config.latency is not None:
+        config.latency.log()
+
+
+async def live(args):
+    # Route the websocket feed to the strategies through the event bus. Each strategy reads its
+    # own queue, so a slow one never holds up the others or the order book updates.
+    topics = {topic for strategy in strategies for topic in strategy.topics}
+    products = sorted({product for _, product in topics if product is not None})
+    channels = sorted({channel for channel, _ in topics}, key=lambda channel: channel.value)
+    if not products or not channels:
+        QuantrtLog.warning("No strategy subscribes to any market data.")
+        return
+
+    # With shards, the market channels they support are read by worker processes and merged into
+    # the bus, and the rest are read on the main connection.
+    sharded = None
+    if args.feed_shards:
+        market = [channel for channel in channels if channel in shardtools.SHARDED_CHANNELS]
+        channels = [channel for channel in channels if channel not in shardtools.SHARDED_CHANNELS]
+        if market:
+            sharded = shardtools.ShardedFeed(products, market, shards=args.feed_shards)
+
+    # The execution engine and ledger follow the orders and fills of the authenticated user channel.
+    if ws.ChannelType.User not in channels:
+        channels.append(ws.ChannelType.User)
+    request = ws.subscription().to_channels_and_products([(channel, products) for channel in channels])
+    request.authenticate(config.secret_key, config.api_key, config.passphrase)
+    feed = feedtools.FeedManager(request)
+    bus = bustools.EventBus().attach(feed)
+    if sharded is not None:
+        bus.attach_sharded(sharded)
+    recorder = capturetools.Recorder(args.capture_dir).attach(feed) if args.capture_dir else None
+    config.ledger = ledgertools.Ledger().attach(feed)
+    risk = risktools.RiskEngine(config.risk_limits, config.risk_limits.get("default"), ledger=config.ledger,
+                                books=sharded.books if sharded is not None else feed.books)
+    config.execution_engine = enginetools.ExecutionEngine(risk=risk).attach(feed)
+    register_metrics(risk)
+    bus.register_metrics()
+    await asyncio.gather(config.execution_engine.sync(), config.ledger.load())
+    config.execution_engine.start()
+    config.ledger.start()
+    if config.latency is not None:
+        config.latency.start()
+    listeners = [asyncio.create_task(strategy.listen(bus)) for strategy in strategies]
+    if sharded is not None:
+        sharded.start()
+    try:
+        if sharded is not None:
+            await asyncio.gather(feed.run(), sharded.run())
+        else:
+            await feed.run()
+    finally:
+        for listener in listeners:
+            listener.cancel()
+        if sharded is not None:
+            sharded.stop()
+        config.ledger.stop()
+        await config.execution_engine.stop()
+        if config.latency is not None:
+            config.latency.stop()
+            config.latency.log()
+        if recorder is not None:
+            recorder.close()
+            QuantrtLog.info("Recorded %s frames to %s, %s dropped", recorder.frames, args.capture_dir, recorder.dropped)
+
+
+async def main(args):
+    await initialize(args)
+    server = metricstools.MetricsServer(port=args.metrics_port) if args.metrics_port else None
+    if server is not None:
+        await server.start()
+    try:
+        await run_scripts()
+        if args.command == "backtest":
+            await backtest(args)
+        else:
+            await live(args)
+    finally:
+        if server is not None:
+            await server.stop()
 
 
-async def live():
-    pass
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
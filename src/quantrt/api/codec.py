@@ -0,0 +1,249 @@
+import collections
+import datetime
+import json
+
+import quantrt.common.config
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from quantrt.common.fixed import ProductScale, Scale
+
+
+__all__ = ["name", "loads", "dumps", "use", "L2Update", "Match", "Ticker", "MessageDecoder", "RecentTrades",
+           "parse_time_ns", "is_user_message"]
+
+
+def _codecs() -> Dict[str, Tuple[Callable[[Union[str, bytes]], Any], Callable[[Any], str]]]:
+    codecs = {}
+    try:
+        import orjson
+        codecs["orjson"] = (orjson.loads, lambda obj: orjson.dumps(obj).decode("utf-8"))
+    except ImportError:
+        pass
+    try:
+        import ujson
+        codecs["ujson"] = (ujson.loads, ujson.dumps)
+    except ImportError:
+        pass
+    codecs["json"] = (json.loads, json.dumps)
+    return codecs
+
+
+""" The installed json codecs, fastest first. """
+CODECS = _codecs()
+
+
+""" The name of the codec in use. """
+name: str = next(iter(CODECS))
+
+
+""" Decode a json document with the codec in use. """
+loads: Callable[[Union[str, bytes]], Any] = CODECS[name][0]
+
+
+""" Encode an object as a json string with the codec in use. """
+dumps: Callable[[Any], str] = CODECS[name][1]
+
+
+def use(codec: str):
+    """Switch the json codec, one of `orjson`, `ujson` or `json`.
+    Callers must look up `codec.loads` and `codec.dumps` on the module for the switch to apply.
+    """
+    global name, loads, dumps
+    if codec not in CODECS:
+        raise ValueError("The json codec {} is not installed. Choose one of {}.".format(codec, list(CODECS)))
+    name = codec
+    loads, dumps = CODECS[codec]
+
+
+@dataclass
+class L2Update:
+    __slots__ = ("product", "time", "sides", "prices", "sizes")
+    product: str
+    # exchange time in epoch nanoseconds
+    time: int
+    # `buy` or `sell` of each change
+    sides: List[str]
+    # price and new total size of each change in ticks
+    prices: List[int]
+    sizes: List[int]
+
+
+@dataclass
+class Match:
+    __slots__ = ("product", "time", "sequence", "trade_id", "side", "price", "size", "maker_order_id", "taker_order_id")
+    product: str
+    time: int
+    sequence: int
+    trade_id: int
+    # the maker side
+    side: str
+    price: int
+    size: int
+    maker_order_id: str
+    taker_order_id: str
+
+
+@dataclass
+class Ticker:
+    __slots__ = ("product", "time", "sequence", "trade_id", "side", "price", "last_size", "best_bid", "best_ask")
+    product: str
+    time: int
+    sequence: int
+    trade_id: int
+    # the taker side
+    side: str
+    price: int
+    last_size: int
+    best_bid: int
+    best_ask: int
+
+
+def is_user_message(message: Union[Dict, Any]) -> bool:
+    """Whether a decoded message came from the authenticated user channel."""
+    return type(message) is dict and "user_id" in message
+
+
+class RecentTrades:
+    """The (product, trade id) pairs of the latest fills, to apply a fill delivered twice only once.
+    :param maxsize: How many trades are remembered.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize: int = maxsize
+        self._trades: "collections.OrderedDict[Tuple[str, int], None]" = collections.OrderedDict()
+
+
+    def add(self, product: str, trade_id: int) -> bool:
+        """Remember a trade.
+        :return: Whether the trade was not seen before.
+        """
+        key = (product, trade_id)
+        if key in self._trades:
+            return False
+        self._trades[key] = None
+        if len(self._trades) > self.maxsize:
+            self._trades.popitem(last=False)
+        return True
+
+
+_POWERS = [10 ** i for i in range(10)]
+# the last whole second parsed by `parse_time_ns`, consecutive messages usually share it
+_second: Tuple[str, int] = ("", 0)
+
+
+def parse_time_ns(text: str) -> int:
+    """Parse an exchange timestamp such as `2021-09-01T12:30:00.123456Z` to epoch nanoseconds."""
+    global _second
+    key, second_ns = _second
+    if text[:19] != key:
+        key = text[:19]
+        second_ns = (datetime.datetime.fromisoformat(key) - _EPOCH) // _SECOND * 1_000_000_000
+        _second = (key, second_ns)
+    frac = text[20:-1]
+    return second_ns + int(frac) * _POWERS[9 - len(frac)] if frac else second_ns
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+
+def _parser(scale: Scale) -> Callable[[str], int]:
+    """A `Scale.parse` specialized to the non-negative decimal strings of the feed."""
+    unit, step, decimals = scale.unit, scale.step, scale.decimals
+
+    def parse(text: str) -> int:
+        whole, _, frac = text.partition(".")
+        units = int(whole or "0") * unit
+        if decimals:
+            units += int(frac[:decimals].ljust(decimals, "0"))
+        return units // step
+    return parse
+
+
+class MessageDecoder:
+    """Decodes websocket frames, with fast paths for the high volume message types.
+
+    Frames are decoded with the codec in use. `l2update`, `match` and `ticker` messages of
+    products with a known `ProductScale` are then turned into `L2Update`, `Match` and `Ticker`
+    records, reading only the fields they need and parsing prices and sizes straight to ticks
+    without constructing a `Decimal`. Every other message is returned as the decoded dict,
+    including the matches of the user channel, which keep the `user_id` and fee rate that the
+    `Match` record has no room for.
+    :param scales: The product scales. Defaults to `config.product_scales`, read at decode time.
+    """
+
+    def __init__(self, scales: Optional[Dict[str, ProductScale]] = None):
+        self.scales = scales
+        self._parsers: Dict[str, Tuple[Callable[[str], int], Callable[[str], int]]] = {}
+        self._decoders: Dict[str, Callable] = {
+            "l2update": self._l2update,
+            "match": self._match,
+            "last_match": self._match,
+            "ticker": self._ticker,
+        }
+
+
+    def decode(self, frame: Union[str, bytes]) -> Union[L2Update, Match, Ticker, Dict]:
+        message = loads(frame)
+        decoder = self._decoders.get(message.get("type"))
+        if decoder is not None:
+            product = message["product_id"]
+            parsers = self._parsers.get(product) or self._load_parsers(product)
+            if parsers is not None:
+                return decoder(message, product, parsers)
+        return message
+
+
+    def _load_parsers(self, product: str) -> Optional[Tuple[Callable[[str], int], Callable[[str], int]]]:
+        scales = self.scales if self.scales is not None else quantrt.common.config.product_scales
+        scale = scales.get(product)
+        if scale is None:
+            return None
+        parsers = self._parsers[product] = (_parser(scale.price), _parser(scale.size))
+        return parsers
+
+
+    def _l2update(self, message: Dict, product: str, parsers) -> L2Update:
+        price, size = parsers
+        changes = message["changes"]
+        return L2Update(
+            product,
+            parse_time_ns(message["time"]),
+            [change[0] for change in changes],
+            [price(change[1]) for change in changes],
+            [size(change[2]) for change in changes])
+
+
+    def _match(self, message: Dict, product: str, parsers) -> Union[Match, Dict]:
+        if "user_id" in message:
+            return message
+        price, size = parsers
+        return Match(
+            product,
+            parse_time_ns(message["time"]),
+            message["sequence"],
+            message["trade_id"],
+            message["side"],
+            price(message["price"]),
+            size(message["size"]),
+            message["maker_order_id"],
+            message["taker_order_id"])
+
+
+    def _ticker(self, message: Dict, product: str, parsers) -> Ticker:
+        price, size = parsers
+        # the first ticker after subscribing has no trade
+        time = message.get("time")
+        last_size = message.get("last_size")
+        return Ticker(
+            product,
+            parse_time_ns(time) if time else 0,
+            message["sequence"],
+            message.get("trade_id", 0),
+            message.get("side", ""),
+            price(message["price"]),
+            size(last_size) if last_size else 0,
+            price(message["best_bid"]),
+            price(message["best_ask"]))
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+import websockets
+
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.util.metrics
+
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from quantrt.api.codec import L2Update, Match, MessageDecoder, Ticker
+from quantrt.api.ws import subscription
+from quantrt.market.book import OrderBook
+
+
+__all__ = ["FeedManager"]
+
+
+Frame = Union[str, bytes]
+Message = Union[L2Update, Match, Ticker, Dict]
+
+
+class FeedManager:
+    """Reads the coinbase pro websocket feed and dispatches its messages.
+
+    Raw frames are passed to the frame listeners before they are decoded, so they can be
+    recorded exactly as received. Frames are decoded by a `MessageDecoder`, so handlers receive
+    `L2Update`, `Match` and `Ticker` records for the hot message types and dicts for the rest.
+    Level 2 messages are applied to an `OrderBook` per product before the handlers are called.
+    The same pipeline is driven by `feed`, so a replayed capture looks the same as live.
+    A frame that fails to decode or apply, and a listener or handler that raises, are logged and
+    counted in `errors` without stopping the feed or the other handlers.
+    :param request: The subscription to send when connecting.
+    :param url: The websocket endpoint. Defaults to `config.ws_url`.
+    :param reconnect_delay: Seconds to wait before reconnecting a dropped connection.
+    :param decoder: The frame decoder. Defaults to a `MessageDecoder` of `config.product_scales`.
+    :param keep_books: Whether to maintain `books` from level 2 messages.
+    """
+
+    def __init__(self, request: Optional[subscription] = None, url: Optional[str] = None, reconnect_delay: float = 1.0,
+                 decoder: Optional[MessageDecoder] = None, keep_books: bool = True):
+        self.request: Optional[subscription] = request
+        self.url: str = url or quantrt.common.config.ws_url
+        self.reconnect_delay: float = reconnect_delay
+        self.decoder: MessageDecoder = decoder or MessageDecoder()
+        self.keep_books: bool = keep_books
+        self.books: Dict[str, OrderBook] = {}
+        # number of frames fed through the pipeline
+        self.frames: int = 0
+        # number of times the connection dropped and was reopened
+        self.reconnects: int = 0
+        # number of frames that failed to decode or apply, and of listener and handler calls that raised
+        self.errors: int = 0
+        self._frame_listeners: List[Callable[[Frame, int], Any]] = []
+        self._handlers: List[Callable[[Message], Any]] = []
+        self._running: bool = False
+
+
+    def on_frame(self, listener: Callable[[Frame, int], Any]) -> Callable[[Frame, int], Any]:
+        """Register a listener called with every raw frame and its receive time in epoch nanoseconds."""
+        self._frame_listeners.append(listener)
+        return listener
+
+
+    def on_message(self, handler: Callable[[Message], Any]) -> Callable[[Message], Any]:
+        """Register a handler called with every decoded message, after the order books are updated."""
+        self._handlers.append(handler)
+        return handler
+
+
+    def book(self, product: str) -> Optional[OrderBook]:
+        """The order book of a product, created on first use if the product's scale is known."""
+        if not self.keep_books:
+            return None
+        book = self.books.get(product)
+        if book is None:
+            scale = quantrt.common.config.product_scales.get(product)
+            if scale is None:
+                return None
+            book = self.books[product] = OrderBook(scale)
+        return book
+
+
+    def feed(self, frame: Frame, received_ns: Optional[int] = None):
+        """Push one raw frame through the pipeline.
+        :param frame: The websocket frame, a json encoded message.
+        :param received_ns: The receive time in epoch nanoseconds. Defaults to now.
+        """
+        if received_ns is None:
+            received_ns = time.time_ns()
+        self.frames += 1
+        for listener in self._frame_listeners:
+            try:
+                listener(frame, received_ns)
+            except Exception as err:
+                self._failed("feed.listener", "Frame listener %r failed: %r", listener, err)
+        tracker = quantrt.common.config.latency
+        if tracker is None:
+            try:
+                message = self.decoder.decode(frame)
+            except Exception as err:
+                self._failed("feed.decode", "Could not decode the frame %.200r: %r", frame, err)
+                return
+            self.dispatch(message)
+            return
+
+        start = time.monotonic_ns()
+        try:
+            message = self.decoder.decode(frame)
+        except Exception as err:
+            self._failed("feed.decode", "Could not decode the frame %.200r: %r", frame, err)
+            return
+        decoded = time.monotonic_ns()
+        self._apply(message)
+        applied = time.monotonic_ns()
+        self._handle(message)
+        dispatched = time.monotonic_ns()
+        product = message.get("product_id") if type(message) is dict else message.product
+        if product is not None:
+            tracker.record_frame(product, start, decoded, applied, dispatched)
+
+
+    def dispatch(self, message: Message):
+        """Push one decoded message through the order books and the message handlers."""
+        self._apply(message)
+        self._handle(message)
+
+
+    def apply(self, message: Message):
+        """Apply a decoded message to the order books."""
+        if type(message) is L2Update:
+            book = self.book(message.product)
+            if book is not None:
+                book.apply_update(message)
+        elif type(message) is dict and message.get("type") in ("l2update", "snapshot"):
+            book = self.book(message["product_id"])
+            if book is not None:
+                book.apply(message)
+
+
+    def _apply(self, message: Message):
+        try:
+            self.apply(message)
+        except Exception as err:
+            self._failed("feed.apply", "Could not apply a %s message to the order book: %r", _kind(message), err)
+
+
+    def _handle(self, message: Message):
+        for handler in self._handlers:
+            try:
+                handler(message)
+            except Exception as err:
+                self._failed("feed.handler", "Handler %r failed on a %s message: %r", handler, _kind(message), err)
+
+
+    def _failed(self, key: str, message: str, *args: Any):
+        self.errors += 1
+        quantrt.common.log.QuantrtLog.throttled(key, 1.0, logging.ERROR, message, *args)
+
+
+    async def run(self):
+        """Connect, subscribe and feed frames until `stop` is called, reconnecting on errors."""
+        if self.request is None:
+            raise ValueError("Cannot connect to the feed without a subscription.")
+        self._running = True
+        self.register_metrics()
+        while self._running:
+            try:
+                async with websockets.connect(self.url, max_size=None) as socket:
+                    await socket.send(self.request.build())
+                    quantrt.common.log.QuantrtLog.info("Subscribed to the websocket feed at %s", self.url)
+                    async for frame in socket:
+                        self.feed(frame)
+                        if not self._running:
+                            break
+            except (websockets.ConnectionClosed, OSError) as err:
+                if not self._running:
+                    break
+                quantrt.common.log.QuantrtLog.warning(
+                    "Websocket feed disconnected: %s. Reconnecting in %s seconds.", err, self.reconnect_delay)
+                self.reconnects += 1
+                await asyncio.sleep(self.reconnect_delay)
+
+
+    def register_metrics(self, registry: Optional[quantrt.util.metrics.Registry] = None):
+        """Expose the frame and reconnect counts and the book depths, read at scrape time."""
+        registry = registry or quantrt.util.metrics.default_registry
+        registry.collect("quantrt_feed_frames_total", "Websocket frames fed through the pipeline.", "counter",
+                         lambda: [("quantrt_feed_frames_total", {}, self.frames)])
+        registry.collect("quantrt_feed_reconnects_total", "Websocket reconnects after a dropped connection.",
+                         "counter", lambda: [("quantrt_feed_reconnects_total", {}, self.reconnects)])
+        registry.collect("quantrt_feed_errors_total", "Frames that failed to decode or apply, and handlers that raised.",
+                         "counter", lambda: [("quantrt_feed_errors_total", {}, self.errors)])
+        registry.collect("quantrt_book_levels", "Price levels of each order book by side.", "gauge",
+                         lambda: [("quantrt_book_levels", {"product": product, "side": side}, depth)
+                                  for product, book in list(self.books.items())
+                                  for side, depth in (("bid", len(book.bids)), ("ask", len(book.asks)))])
+
+
+    def stop(self):
+        """Stop `run` after the frame being processed."""
+        self._running = False
+
+
+def _kind(message: Message) -> str:
+    return message.get("type") if type(message) is dict else type(message).__name__
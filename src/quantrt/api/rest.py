@@ -1,7 +1,12 @@
+import asyncio
+import functools
+import time
+
 import quantrt.common.config as config
+import quantrt.util.metrics as metrics
 
 from decimal import Decimal
-from typing import Iterator, Optional, Union, Dict, List
+from typing import Iterable, Iterator, Optional, Union, Dict, List
 
 from quantrt.common.log import *
 
@@ -9,7 +14,8 @@ from quantrt.common.log import *
 __all__ = [
     "get_account", "get_accounts", "get_account_history",
     "get_account_holds", "place_order", "place_limit_order",
-    "place_market_order", "cancel_order", "get_order", "get_orders",
+    "place_market_order", "place_orders", "cancel_order", "cancel_orders",
+    "cancel_all", "cancel_products", "get_order", "get_orders",
     "get_fills", "deposit", "deposit_from_coinbase", "withdraw",
     "withdraw_to_coinbase", "withdraw_to_crypto", "get_payment_methods",
     "get_coinbase_accounts", "create_report", "get_report",
@@ -19,12 +25,35 @@ __all__ = [
 ]
 
 
+REQUESTS = metrics.default_registry.counter(
+    "quantrt_rest_requests_total", "REST requests by method and outcome.", ["method", "outcome"])
+REQUEST_SECONDS = metrics.default_registry.histogram(
+    "quantrt_rest_request_seconds", "REST request round trips by method, including rate limiting.", ["method"])
+
+
 def submit_to_executor(func):
+    """Run the blocking request on `config.executor` so that the event loop is not blocked.
+    Requests run concurrently up to the executor's workers, and the client's rate limiters
+    hold them back to the exchange's limits.
+    """
+    method = func.__name__
+
+    @functools.wraps(func)
     async def wrapped(*args, **kwargs):
-        if config.executor:
-            result = await config.executor.submit(func, *args, **kwargs)
-            return result
-        return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            if config.executor:
+                result = await asyncio.get_event_loop().run_in_executor(
+                    config.executor, functools.partial(func, *args, **kwargs))
+            else:
+                result = func(*args, **kwargs)
+        except Exception:
+            REQUESTS.labels(method, "error").inc()
+            raise
+        finally:
+            REQUEST_SECONDS.labels(method).observe(time.perf_counter() - start)
+        REQUESTS.labels(method, "ok").inc()
+        return result
     return wrapped
 
 
@@ -161,6 +190,37 @@ def cancel_order(order_id: str) -> List[str]:
     return config.rest_client.cancel_order(order_id)
 
 
+@submit_to_executor
+def cancel_all(product_id: Optional[str] = None) -> List[str]:
+    if not config.rest_client:
+        QuantrtLog.exception(
+            "Cannot submit request. Client does not exist.")
+        raise EnvironmentError("Cannot submit request to coinbase. Client does not exist")
+    return config.rest_client.cancel_all(product_id=product_id)
+
+
+async def place_orders(orders: Iterable[Dict]) -> List[Union[Dict, Exception]]:
+    """Place many orders concurrently.
+    :param orders: The keyword arguments of `place_order` for each order.
+    :return: The response of each order, or the exception it raised, in the order of `orders`.
+    """
+    return await asyncio.gather(*[place_order(**order) for order in orders], return_exceptions=True)
+
+
+async def cancel_orders(order_ids: Iterable[str]) -> List[Union[List[str], Exception]]:
+    """Cancel many orders concurrently.
+    :return: The response of each cancel, or the exception it raised, in the order of `order_ids`.
+    """
+    return await asyncio.gather(*[cancel_order(order_id) for order_id in order_ids], return_exceptions=True)
+
+
+async def cancel_products(product_ids: Iterable[str]) -> List[Union[List[str], Exception]]:
+    """Cancel every open order of many products, with one request per product.
+    :return: The canceled order ids of each product, or the exception it raised, in the order of `product_ids`.
+    """
+    return await asyncio.gather(*[cancel_all(product_id) for product_id in product_ids], return_exceptions=True)
+
+
 @submit_to_executor
 def get_order(order_id: str) -> Dict:
     if not config.rest_client:
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
+import time
+
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.util.metrics
+
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from quantrt.api.codec import L2Update, Match, Ticker, parse_time_ns
+from quantrt.api.feed import FeedManager
+from quantrt.api.ws import ChannelType, subscription
+from quantrt.common.fixed import ProductScale
+from quantrt.market.book import OrderBook
+from quantrt.util.ring import SharedRing
+
+
+__all__ = ["EVENT_DTYPE", "KIND_L2", "KIND_RESET", "KIND_MATCH", "KIND_TICKER", "KIND_HEARTBEAT",
+           "HEALTH_FIELDS", "SHARDED_CHANNELS", "ShardedFeed"]
+
+
+""" A decoded feed event. Times are epoch nanoseconds, prices and sizes are ticks of the product's scale. """
+EVENT_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("received", "<i8"),
+    ("sequence", "<i8"),
+    ("trade_id", "<i8"),
+    ("price", "<i8"),
+    ("size", "<i8"),
+    # index of the product in `ShardedFeed.products`
+    ("product", "<u2"),
+    ("kind", "u1"),
+    # 0 for buy, 1 for sell
+    ("side", "u1"),
+])
+
+# one level of an l2update or snapshot
+KIND_L2 = 1
+# clears the product's book, followed by the levels of a snapshot
+KIND_RESET = 2
+KIND_MATCH = 3
+KIND_TICKER = 4
+# carries only the time, advances the shard's watermark
+KIND_HEARTBEAT = 5
+
+
+""" The channels whose messages the shards encode. Other channels, e.g. `full` or `user`, need a `FeedManager`. """
+SHARDED_CHANNELS = {ChannelType.Level2, ChannelType.Matches, ChannelType.Ticker, ChannelType.Heartbeat}
+
+
+""" Per-shard counters kept in shared memory by the worker processes. """
+HEALTH_FIELDS = ["frames", "events", "dropped", "reconnects", "last_received", "last_time", "started"]
+_FRAMES, _EVENTS, _DROPPED, _RECONNECTS, _LAST_RECEIVED, _LAST_TIME, _STARTED = range(len(HEALTH_FIELDS))
+
+# (field of `ShardedFeed.health`, metric family, Prometheus type, help) of the exported shard metrics
+_METRICS: List[Tuple[str, str, str, str]] = [
+    ("frames", "quantrt_shard_frames_total", "counter", "Websocket frames read by each feed shard."),
+    ("events", "quantrt_shard_events_total", "counter", "Events written to the ring of each feed shard."),
+    ("dropped", "quantrt_shard_dropped_total", "counter", "Events dropped by each feed shard on a full ring."),
+    ("reconnects", "quantrt_shard_reconnects_total", "counter", "Websocket reconnects of each feed shard."),
+    ("alive", "quantrt_shard_alive", "gauge", "Whether the process of each feed shard is running."),
+    ("backlog", "quantrt_shard_backlog", "gauge", "Events waiting in the ring of each feed shard."),
+]
+
+
+def _encode(message, received_ns: int, last_time: int, products: Dict[str, int],
+            scales: Dict[str, ProductScale]) -> List[tuple]:
+    """The `EVENT_DTYPE` rows of one decoded message.
+    Messages without an exchange time are stamped with `last_time`, the latest exchange time of
+    the shard, so they keep their place in the shard's order after the merge.
+    """
+    kind = type(message)
+    if kind is L2Update:
+        product = products[message.product]
+        return [(message.time, received_ns, 0, 0, price, size, product, KIND_L2, side == "sell")
+                for side, price, size in zip(message.sides, message.prices, message.sizes)]
+    if kind is Match:
+        return [(message.time, received_ns, message.sequence, message.trade_id, message.price, message.size,
+                 products[message.product], KIND_MATCH, message.side == "sell")]
+    if kind is Ticker:
+        return [(message.time or last_time, received_ns, message.sequence, message.trade_id, message.price,
+                 message.last_size, products[message.product], KIND_TICKER, message.side == "sell")]
+
+    kind = message.get("type")
+    if kind == "heartbeat":
+        return [(parse_time_ns(message["time"]), received_ns, message["sequence"], message.get("last_trade_id", 0),
+                 0, 0, products[message["product_id"]], KIND_HEARTBEAT, 0)]
+    if kind == "snapshot":
+        product = message["product_id"]
+        price, size = scales[product].price.parse, scales[product].size.parse
+        index = products[product]
+        rows = [(last_time, received_ns, 0, 0, 0, 0, index, KIND_RESET, 0)]
+        rows.extend((last_time, received_ns, 0, 0, price(level[0]), size(level[1]), index, KIND_L2, 0)
+                    for level in message["bids"])
+        rows.extend((last_time, received_ns, 0, 0, price(level[0]), size(level[1]), index, KIND_L2, 1)
+                    for level in message["asks"])
+        return rows
+    return []
+
+
+def _shard_main(shard: int, products: List[str], shard_products: List[str], channels: List[ChannelType],
+                scales: Dict[str, ProductScale], url: str, ring_name: str, capacity: int, health_name: str):
+    """The entry point of a worker process. Reads one websocket connection into its ring.
+    Only the product scales are set up, the worker needs none of the app's other resources.
+    """
+    quantrt.common.config.product_scales = scales
+    ring = SharedRing(EVENT_DTYPE, capacity, name=ring_name)
+    health_shm = shared_memory.SharedMemory(name=health_name)
+    health = np.ndarray((len(HEALTH_FIELDS),), dtype=np.int64, buffer=health_shm.buf,
+                        offset=shard * len(HEALTH_FIELDS) * 8)
+    indexes = {product: i for i, product in enumerate(products)}
+    request = subscription().to_channels_and_products([(channel, shard_products) for channel in channels])
+    # books are kept by the strategy process from the merged events
+    feed = FeedManager(request, url=url, keep_books=False)
+
+    def on_frame(frame, received_ns: int):
+        health[_FRAMES] += 1
+        health[_LAST_RECEIVED] = received_ns
+
+    def on_message(message):
+        rows = _encode(message, int(health[_LAST_RECEIVED]), int(health[_LAST_TIME]), indexes, scales)
+        if not rows:
+            return
+        batch = np.array(rows, dtype=EVENT_DTYPE)
+        written = ring.write(batch)
+        health[_EVENTS] += written
+        health[_DROPPED] += len(batch) - written
+        health[_LAST_TIME] = max(int(health[_LAST_TIME]), int(batch["time"].max()))
+
+    feed.on_frame(on_frame)
+    feed.on_message(on_message)
+    health[_STARTED] = time.time_ns()
+
+    async def run():
+        while True:
+            await feed.run()
+            health[_RECONNECTS] += 1
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del health
+        health_shm.close()
+        ring.close()
+
+
+class ShardedFeed:
+    """Reads the websocket feed of many products through several worker processes.
+
+    Products are split round robin across `shards` processes, each with its own connection and
+    subscription, so decoding scales with cores. Workers write `EVENT_DTYPE` records into one
+    `SharedRing` each. `poll` merges the rings into a single stream ordered by exchange time:
+    an event is released once every shard has reported a later time, or once it is older than
+    `max_delay`, so a quiet shard delays the merge by at most that much. The heartbeat channel
+    is always subscribed so that every shard reports a time at least once a second.
+    Handlers registered with `on_events`, e.g. `EventBus.attach_sharded`, receive every released
+    batch after it is applied to `books`.
+    :param products: The product ids.
+    :param channels: The channels to subscribe to for every product.
+    :param shards: The number of worker processes. Defaults to the number of cpus, at most one per product.
+    :param capacity: The number of events each ring holds.
+    :param max_delay: Seconds an event is held back waiting for the other shards.
+    :param url: The websocket endpoint. Defaults to `config.ws_url`.
+    """
+
+    def __init__(self, products: Sequence[str], channels: Iterable[ChannelType], shards: Optional[int] = None,
+                 capacity: int = 1 << 16, max_delay: float = 0.25, url: Optional[str] = None):
+        self.products: List[str] = list(products)
+        self.product_index: Dict[str, int] = {product: i for i, product in enumerate(self.products)}
+        self.channels: List[ChannelType] = list(channels)
+        if ChannelType.Heartbeat not in self.channels:
+            self.channels.append(ChannelType.Heartbeat)
+        shards = shards or multiprocessing.cpu_count()
+        self.shards: int = max(1, min(shards, len(self.products)))
+        self.capacity: int = capacity
+        self.max_delay_ns: int = int(max_delay * 1e9)
+        self.url: str = url or quantrt.common.config.ws_url
+        self.books: Dict[str, OrderBook] = {}
+
+        self.rings: List[SharedRing] = []
+        self.processes: List[multiprocessing.Process] = []
+        self.health_shm: Optional[shared_memory.SharedMemory] = None
+        self.health_array: Optional[np.ndarray] = None
+        # events read from each ring and not yet released
+        self._pending: List[np.ndarray] = []
+        # the latest time read from each ring
+        self._watermarks: List[int] = []
+        self._handlers: List[Callable[[np.ndarray], Any]] = []
+        self._running: bool = False
+
+
+    def on_events(self, handler: Callable[[np.ndarray], Any]) -> Callable[[np.ndarray], Any]:
+        """Register a handler called with every released batch of events, after the order books are updated."""
+        self._handlers.append(handler)
+        return handler
+
+
+    def assignment(self) -> List[List[str]]:
+        """The products read by each shard."""
+        return [self.products[shard::self.shards] for shard in range(self.shards)]
+
+
+    def start(self):
+        """Start the worker processes."""
+        context = multiprocessing.get_context("spawn")
+        self.health_shm = shared_memory.SharedMemory(create=True, size=self.shards * len(HEALTH_FIELDS) * 8)
+        self.health_array = np.ndarray((self.shards, len(HEALTH_FIELDS)), dtype=np.int64, buffer=self.health_shm.buf)
+        self.health_array[:] = 0
+        scales = quantrt.common.config.product_scales
+        missing = [product for product in self.products if product not in scales]
+        if missing:
+            raise EnvironmentError("No product scales are loaded for {}.".format(missing))
+
+        for shard, shard_products in enumerate(self.assignment()):
+            ring = SharedRing(EVENT_DTYPE, self.capacity)
+            process = context.Process(
+                target=_shard_main, name="quantrt-shard-{}".format(shard), daemon=True,
+                args=(shard, self.products, shard_products, self.channels,
+                      {product: scales[product] for product in shard_products},
+                      self.url, ring.name, ring.capacity, self.health_shm.name))
+            process.start()
+            self.rings.append(ring)
+            self.processes.append(process)
+            self._pending.append(np.empty(0, dtype=EVENT_DTYPE))
+            self._watermarks.append(0)
+        quantrt.common.log.QuantrtLog.info(
+            "Started %s feed shards for %s products.", self.shards, len(self.products))
+        for field, name, kind, help in _METRICS:
+            quantrt.util.metrics.default_registry.collect(
+                name, help, kind, lambda name=name, field=field: self._health_samples(name, field))
+
+
+    def stop(self):
+        """Stop the worker processes and free the shared memory."""
+        self._running = False
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for ring in self.rings:
+            ring.close()
+        if self.health_shm is not None:
+            del self.health_array
+            self.health_shm.close()
+            self.health_shm.unlink()
+            self.health_shm = None
+        self.rings, self.processes, self._pending, self._watermarks = [], [], [], []
+
+
+    def poll(self, now_ns: Optional[int] = None) -> np.ndarray:
+        """Read every ring and release the events that are safe to order.
+        :param now_ns: The current time in epoch nanoseconds. Defaults to now.
+        :return: The released events ordered by exchange time.
+        """
+        if now_ns is None:
+            now_ns = time.time_ns()
+        for shard, ring in enumerate(self.rings):
+            batch = ring.read()
+            if len(batch):
+                self._watermarks[shard] = max(self._watermarks[shard], int(batch["time"].max()))
+                self._pending[shard] = np.concatenate((self._pending[shard], batch)) \
+                    if len(self._pending[shard]) else batch
+
+        release = max(min(self._watermarks), now_ns - self.max_delay_ns)
+        ready: List[np.ndarray] = []
+        for shard, pending in enumerate(self._pending):
+            if not len(pending):
+                continue
+            cut = pending["time"] <= release
+            if cut.all():
+                ready.append(pending)
+                self._pending[shard] = pending[:0]
+            elif cut.any():
+                ready.append(pending[cut])
+                self._pending[shard] = pending[~cut]
+
+        if not ready:
+            return np.empty(0, dtype=EVENT_DTYPE)
+        events = np.concatenate(ready) if len(ready) > 1 else ready[0]
+        # a stable sort keeps the order of events with equal times within a shard
+        return events[np.argsort(events["time"], kind="stable")]
+
+
+    def apply(self, events: np.ndarray):
+        """Apply released level 2 events to `books`."""
+        for event in events[(events["kind"] == KIND_L2) | (events["kind"] == KIND_RESET)].tolist():
+            product = self.products[event[6]]
+            book = self.books.get(product)
+            if book is None:
+                book = self.books[product] = OrderBook(quantrt.common.config.product_scales[product])
+            if event[7] == KIND_RESET:
+                book.clear()
+            else:
+                book.update("sell" if event[8] else "buy", event[4], event[5])
+                book.time = event[0]
+
+
+    async def run(self, handler: Optional[Callable[[np.ndarray], Any]] = None, interval: float = 0.001):
+        """Poll the shards until `stop`, applying events to the books and passing each released batch to the
+        handlers registered with `on_events` and to `handler`. A handler that raises is logged and skipped.
+        """
+        handlers = self._handlers + ([handler] if handler is not None else [])
+        self._running = True
+        while self._running:
+            events = self.poll()
+            if len(events):
+                self.apply(events)
+                for handler in handlers:
+                    try:
+                        handler(events)
+                    except Exception as err:
+                        quantrt.common.log.QuantrtLog.throttled(
+                            "shards.handler", 1.0, logging.ERROR, "Handler %r failed on the merged events: %r",
+                            handler, err)
+            await asyncio.sleep(interval)
+
+
+    def _health_samples(self, name: str, field: str) -> List[quantrt.util.metrics.Sample]:
+        if self.health_shm is None:
+            return []
+        return [(name, {"shard": str(shard)}, counters[field]) for shard, counters in enumerate(self.health())]
+
+
+    def health(self) -> List[Dict[str, int]]:
+        """The counters of each shard, with whether its process is alive, its ring backlog and its lag."""
+        now_ns = time.time_ns()
+        report = []
+        for shard, ring in enumerate(self.rings):
+            counters = dict(zip(HEALTH_FIELDS, self.health_array[shard].tolist()))
+            counters["alive"] = int(self.processes[shard].is_alive())
+            counters["backlog"] = len(ring)
+            counters["lag_ns"] = now_ns - counters["last_received"] if counters["last_received"] else -1
+            report.append(counters)
+        return report
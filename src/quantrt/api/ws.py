@@ -1,5 +1,5 @@
-import json
 import quantrt.api.auth
+import quantrt.api.codec
 
 from dataclasses import dataclass
 from enum import Enum
@@ -57,13 +57,13 @@ class subscription:
     
 
     def to_channel(self, channel: ChannelType) -> "subscription":
-        self.channels.append(channel.name)
+        self.channels.append(channel.value)
         self.has_channels = True
         return self
     
 
     def to_channels(self, channels: Iterable[ChannelType]) -> "subscription":
-        self.channels.extend(map(lambda channel_type: channel_type.name, channels))
+        self.channels.extend(map(lambda channel_type: channel_type.value, channels))
         self.has_channels = True
         return self
 
@@ -82,7 +82,7 @@ class subscription:
 
     def to_channel_and_product(self, channel: ChannelType, product: Product) -> "subscription":
         self.channels.append({
-            "name": channel.name,
+            "name": channel.value,
             "product_ids": [f"{product}"]
         })
         self.has_channels = True
@@ -92,7 +92,7 @@ class subscription:
 
     def to_channel_and_products(self, channel: ChannelType, products: Iterable[Product]) -> "subscription":
         self.channels.append({
-            "name": channel.name,
+            "name": channel.value,
             "product_ids": list(map(lambda product: f"{product}", products))
         })
         self.has_channels = True
@@ -103,7 +103,7 @@ class subscription:
     def to_channels_and_products(self, channel_product_pairs: Iterable[Tuple[ChannelType, Iterable[Product]]]) -> "subscription":
         self.channels.extend(map(lambda pair:
             {
-                "name": pair[0].name,
+                "name": pair[0].value,
                 "product_ids": list(map(lambda product: f"{product}", pair[1])),
             },
             channel_product_pairs,
@@ -139,6 +139,6 @@ class subscription:
         }
 
         if self.secret and self.key and self.passphrase:
-            quantrt.api.auth.sign_websocket_request(request)
+            quantrt.api.auth.sign_websocket_request(self.secret, self.key, self.passphrase, request)
 
-        return json.dumps(request)
+        return quantrt.api.codec.dumps(request)
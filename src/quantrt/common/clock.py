@@ -0,0 +1,71 @@
+import datetime
+
+from typing import Optional
+
+
+__all__ = ["Clock", "WallClock", "SimulatedClock"]
+
+
+class Clock:
+    """The source of the current time for the app and its schedulers.
+    `now` returns a naive datetime in the clock's `tzinfo`.
+    """
+
+    @property
+    def tzinfo(self) -> datetime.tzinfo:
+        raise NotImplementedError()
+
+
+    def now(self) -> datetime.datetime:
+        raise NotImplementedError()
+
+
+    def now_utc(self) -> datetime.datetime:
+        """The current time as a timezone aware UTC datetime."""
+        return self.now().replace(tzinfo=self.tzinfo).astimezone(datetime.timezone.utc)
+
+
+class WallClock(Clock):
+    """The system clock, in local time. Used for live trading."""
+
+    @property
+    def tzinfo(self) -> datetime.tzinfo:
+        return datetime.datetime.now().astimezone().tzinfo
+
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now()
+
+
+    def now_utc(self) -> datetime.datetime:
+        return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+class SimulatedClock(Clock):
+    """A clock that only moves when it is told to. Used for backtests.
+    :param start: The initial time.
+    :param tzinfo: The timezone of the simulated times. Defaults to UTC, the timezone of stored candles.
+    """
+
+    def __init__(self, start: datetime.datetime, tzinfo: Optional[datetime.tzinfo] = None):
+        self.current: datetime.datetime = start
+        self._tzinfo: datetime.tzinfo = tzinfo or datetime.timezone.utc
+
+
+    @property
+    def tzinfo(self) -> datetime.tzinfo:
+        return self._tzinfo
+
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+
+    def set(self, when: datetime.datetime):
+        """Move the clock to `when`. The clock never moves backwards."""
+        if when > self.current:
+            self.current = when
+
+
+    def advance(self, delta: datetime.timedelta):
+        self.current += delta
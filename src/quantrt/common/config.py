@@ -4,11 +4,24 @@ from asyncpg import Pool
 from collections import OrderedDict
 from concurrent.futures import Executor
 from datetime import datetime
+from typing import Dict, Optional, TYPE_CHECKING
 
-from quantrt.common.types import REST
+from quantrt.common.clock import Clock, WallClock
+from quantrt.common.fixed import ProductScale
 
+if TYPE_CHECKING:
+    from quantrt.common.types import REST
+    from quantrt.trading.engine import ExecutionEngine
+    from quantrt.trading.ledger import Ledger
+    from quantrt.trading.risk import RiskLimits
+    from quantrt.util.cache import CandleCache
+    from quantrt.util.latency import LatencyTracker
+    from quantrt.util.profiling import StrategyProfiler
 
-__all__ = ["app_dir", "dsn", "db_conn_pool", "build_label", "rest_client", "prepared_sql", "curtime"]
+
+__all__ = ["app_dir", "dsn", "db_conn_pool", "build_label", "rest_client", "prepared_sql", "curtime", "candle_cache",
+           "product_scales", "clock", "execution_engine", "ledger",
+           "risk_limits", "latency", "profiler"]
 
 
 """ The root directory of the app. This is three levels above this file's path. """
@@ -33,7 +46,7 @@ build_label: str
 
 
 """ The global authenticated user used throughout the application lifecycle. """
-rest_client: REST
+rest_client: "REST"
 
 
 """ SQL prepared statements for caching. """
@@ -43,6 +56,10 @@ prepared_sql: OrderedDict
 curtime: datetime
 
 
+""" The clock read by `util.time.now` and the schedulers. A `SimulatedClock` in backtests. """
+clock: Clock = WallClock()
+
+
 """ Stop time for a simulation, none if live. """
 stoptime: datetime
 
@@ -63,5 +80,37 @@ secret_key: str
 passphrase: str
 
 
-""" An executor for submitting async requests """
-executor: Executor
+""" An executor for submitting async requests. Requests block the calling thread when None. """
+executor: Optional[Executor] = None
+
+
+""" The number of REST requests in flight at once, and of pooled keep-alive connections. """
+rest_workers: int = 16
+
+
+""" The local on-disk candle cache. When set, `candle.fetch_batch` reads through it. """
+candle_cache: Optional["CandleCache"] = None
+
+
+""" Fixed-point scales of every product, keyed by product id. Loaded from `rest.get_products`. """
+product_scales: Dict[str, ProductScale] = {}
+
+
+""" The engine placing and tracking the orders of a run. None until a live run or backtest starts. """
+execution_engine: Optional["ExecutionEngine"] = None
+
+
+""" The in-memory balances and positions of a run. None until a live run or backtest starts. """
+ledger: Optional["Ledger"] = None
+
+
+""" Pre-trade risk limits by product. The limits under `default` apply to every other product. """
+risk_limits: Dict[str, "RiskLimits"] = {}
+
+
+""" Latency histograms of the tick-to-trade path. None to not measure latency. """
+latency: Optional["LatencyTracker"] = None
+
+
+""" Profiles the strategies of a backtest. None to not profile. """
+profiler: Optional["StrategyProfiler"] = None
@@ -0,0 +1,129 @@
+import numpy as np
+
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, Union
+
+
+__all__ = ["Scale", "ProductScale", "load_product_scales"]
+
+
+Number = Union[Decimal, str, int]
+
+
+class Scale:
+    """A fixed-point scale for an exchange increment such as `quote_increment` or `base_increment`.
+    Values are represented as integer ticks, a count of increments, so that arithmetic on them
+    is integer arithmetic and exact with respect to the exchange's rounding.
+    :param increment: The smallest representable step, e.g. "0.01".
+    """
+
+    def __init__(self, increment: Number):
+        increment = Decimal(increment).normalize()
+        if increment <= 0:
+            raise ValueError("Invalid increment ({} is not positive)".format(increment))
+        # The number of decimal digits of the increment.
+        self.decimals: int = max(-increment.as_tuple().exponent, 0)
+        # The increment as an integer count of 10^-decimals units.
+        self.step: int = int(increment.scaleb(self.decimals))
+        # 10^decimals
+        self.unit: int = 10 ** self.decimals
+        self.increment: Decimal = increment
+
+
+    def __repr__(self) -> str:
+        return "Scale({})".format(self.increment)
+
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Scale) and self.increment == other.increment
+
+
+    def __hash__(self) -> int:
+        return hash(self.increment)
+
+
+    def to_ticks(self, value: Number, rounding: str = ROUND_HALF_EVEN) -> int:
+        """Convert a decimal value to ticks, rounding to the nearest increment.
+        :param value: The decimal value.
+        :param rounding: A `decimal` rounding mode. Defaults to ROUND_HALF_EVEN.
+        :return: The value in ticks.
+        """
+        return int((Decimal(value) / self.increment).to_integral_value(rounding=rounding))
+
+
+    def from_ticks(self, ticks: int) -> Decimal:
+        """Convert ticks back to an exact decimal value.
+        :param ticks: The value in ticks.
+        :return: The decimal value, with exactly `decimals` digits.
+        """
+        return Decimal(int(ticks) * self.step).scaleb(-self.decimals)
+
+
+    def parse(self, text: Union[str, bytes]) -> int:
+        """Parse a decimal string, e.g. a price from the websocket feed, directly to ticks
+        without constructing a `Decimal`. Digits below the increment are truncated.
+        :param text: The decimal string.
+        :return: The value in ticks.
+        """
+        if isinstance(text, bytes):
+            text = text.decode("ascii")
+        negative = text.startswith("-")
+        if negative:
+            text = text[1:]
+        whole, _, frac = text.partition(".")
+        units = int(whole or "0") * self.unit
+        if self.decimals:
+            units += int(frac[:self.decimals].ljust(self.decimals, "0"))
+        ticks = units // self.step
+        return -ticks if negative else ticks
+
+
+    def format(self, ticks: int) -> str:
+        """Format ticks as a decimal string suitable for the REST api."""
+        return str(self.from_ticks(ticks))
+
+
+    def to_ticks_array(self, values: np.ndarray) -> np.ndarray:
+        """Convert an array of floats to an int64 array of ticks, rounding to the nearest increment."""
+        return np.rint(np.asarray(values, dtype=np.float64) * (self.unit / self.step)).astype(np.int64)
+
+
+    def from_ticks_array(self, ticks: np.ndarray) -> np.ndarray:
+        """Convert an array of ticks to float64 values."""
+        return np.asarray(ticks, dtype=np.int64) * (self.step / self.unit)
+
+
+@dataclass(frozen=True)
+class ProductScale:
+    # The product ticker.
+    product: str
+    # Scale of prices, from the product's `quote_increment`.
+    price: Scale
+    # Scale of sizes, from the product's `base_increment`.
+    size: Scale
+
+
+    @property
+    def notional(self) -> Scale:
+        """The scale of `price * size` products of ticks."""
+        return Scale(self.price.increment * self.size.increment)
+
+
+    def notional_ticks(self, price: int, size: int) -> int:
+        """The notional value of `size` ticks at `price` ticks, in ticks of `notional`."""
+        return price * size
+
+
+def load_product_scales(products: Iterable[Dict]) -> Dict[str, ProductScale]:
+    """Build the fixed-point scales of every product from the output of `rest.get_products`.
+    :param products: Iterable[Dict] - product descriptions with `id`, `quote_increment` and `base_increment`.
+    :return: A dictionary of product id to `ProductScale`.
+    """
+    return {
+        product["id"]: ProductScale(
+            product=product["id"],
+            price=Scale(product["quote_increment"]),
+            size=Scale(product["base_increment"]))
+        for product in products
+    }
@@ -1,24 +1,129 @@
+import atexit
 import datetime
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+import time
 
-from typing import Any
+from typing import Any, Dict, List, Optional
 
 
-__all__ = ["QuantrtLog"]
+__all__ = ["QuantrtLog", "JsonFormatter"]
 
+
+class _QuantrtLogger(logging.Logger):
+
+    def findCaller(self, stack_info: bool = False, stacklevel: int = 1):
+        # every record comes through a `QuantrtLog` method, so walking the stack for the caller
+        # would only ever find that method
+        return "(unknown file)", 0, "(unknown function)", None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, so the message is formatted on the writer thread.
+    The writer is started with the default outputs on the first record if it was not configured.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        if not _configured:
+            with _configure_lock:
+                if not _configured:
+                    QuantrtLog.configure()
+        super().emit(record)
+
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one json object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_previous_class = logging.getLoggerClass()
+logging.setLoggerClass(_QuantrtLogger)
 logger = logging.getLogger('quantrtlog')
-formatter = logging.Formatter("[%(name)s] @ %(asctime)s from %(funcName)s with level %(levelname)s: %(message)s")
-console_stream = logging.StreamHandler(stream = sys.stderr)
-console_stream.setFormatter(formatter)
-file_stream = logging.FileHandler(f"logs/quantrt-log-{datetime.datetime.now().date()}")
-file_stream.setFormatter(formatter)
+logging.setLoggerClass(_previous_class)
+formatter = logging.Formatter("[%(name)s] @ %(asctime)s with level %(levelname)s: %(message)s")
 
-logger.addHandler(console_stream)
-logger.addHandler(file_stream)
+# The logger only puts records on the queue, the listener's thread formats and writes them
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+logger.addHandler(_DeferredQueueHandler(_queue))
+_listener: Optional[logging.handlers.QueueListener] = None
+# Nothing is opened or started at import, see `_DeferredQueueHandler.emit`
+_configured: bool = False
+_configure_lock = threading.Lock()
+
+# key -> [time of the last logged message, messages suppressed since]
+_throttles: Dict[str, List] = {}
+# key -> calls since the last logged message
+_samples: Dict[str, int] = {}
 
 
 class QuantrtLog:
+    """The application log.
+
+    Logging a message puts the record on a queue and returns, and a background thread formats
+    it and writes it to stderr and the day's log file, so the event loop never waits on file
+    I/O. Since formatting is deferred, arguments are formatted after the call returns and
+    should not be mutated afterwards. Messages on hot paths can be limited with `throttled`
+    or `sampled`.
+    """
+
+    @classmethod
+    def configure(cls, json_lines: bool = False, path: Optional[str] = None, level: Optional[int] = None):
+        """Set where the writer thread writes records, replacing the current outputs.
+        :param json_lines: Whether to write one json object per record instead of text lines.
+        :param path: The log file. Defaults to the day's file under `logs/`.
+        :param level: The level of the logger. Unchanged by default.
+        """
+        global _listener, _configured
+        _configured = True
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        if path is None:
+            path = f"logs/quantrt-log-{datetime.datetime.now().date()}" + (".jsonl" if json_lines else "")
+        output = JsonFormatter() if json_lines else formatter
+        console_stream = logging.StreamHandler(stream = sys.stderr)
+        console_stream.setFormatter(output)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_stream = logging.FileHandler(path, delay=True)
+        file_stream.setFormatter(output)
+        _listener = logging.handlers.QueueListener(_queue, console_stream, file_stream, respect_handler_level=True)
+        _listener.start()
+        if level is not None:
+            logger.setLevel(level)
+
+
+    @classmethod
+    def shutdown(cls):
+        """Write the queued records and stop the writer thread."""
+        global _listener
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
 
     @classmethod
     def info(cls, message: Any, *args: Any):
@@ -32,7 +137,7 @@ class QuantrtLog:
 
     @classmethod
     def warn(cls, message: Any, *args: Any):
-        logger.warn(message, *args)
+        logger.warning(message, *args)
 
 
     @classmethod
@@ -44,17 +149,57 @@ class QuantrtLog:
     def error(cls, message: Any, *args: Any):
         logger.error(message, *args)
 
-    
+
     @classmethod
     def exception(cls, message: Any, *args: Any):
         logger.exception(message, *args)
 
 
+    @classmethod
+    def throttled(cls, key: str, interval: float, level: int, message: str, *args: Any):
+        """Log at most one message of `key` every `interval` seconds, noting how many were suppressed.
+        :param key: The messages limited together, e.g. the call site.
+        :param interval: Seconds between logged messages of the key.
+        :param level: The logging level, e.g. `logging.WARNING`.
+        """
+        if not logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        state = _throttles.get(key)
+        if state is None:
+            state = _throttles[key] = [now - interval, 0]
+        if now - state[0] < interval:
+            state[1] += 1
+            return
+        if state[1]:
+            message, args = message + " (%d similar messages suppressed)", args + (state[1],)
+        state[0], state[1] = now, 0
+        logger.log(level, message, *args)
+
+
+    @classmethod
+    def sampled(cls, key: str, every: int, level: int, message: str, *args: Any):
+        """Log the first and then every `every`th message of `key`.
+        :param key: The messages sampled together, e.g. the call site.
+        :param every: One in how many messages is logged.
+        :param level: The logging level, e.g. `logging.DEBUG`.
+        """
+        if not logger.isEnabledFor(level):
+            return
+        count = _samples.get(key, 0)
+        _samples[key] = count + 1
+        if count % every == 0:
+            logger.log(level, message, *args)
+
+
     @classmethod
     def set_level(cls, level: int):
         logger.setLevel(level)
 
-    
+
     @classmethod
     def get_level(cls) -> int:
         return logger.level
+
+
+atexit.register(QuantrtLog.shutdown)
@@ -11,12 +11,12 @@ class LRU:
         self.cache: List = []
 
     def __call__(self, key: Any, check: Callable[[Any, Any], bool], loader: Callable[[Any], Any]) -> Any:
-        for i, (k ,v) in self.cache:
+        for i, (k, v) in enumerate(self.cache):
             if check(k, key):
                 self.cache.append(self.cache.pop(i))
                 return v
         v = loader(key)
         if len(self.cache) >= self.maxsize:
             self.cache.pop(0)
-        self.cache.append(v)
-        return v
\ No newline at end of file
+        self.cache.append((key, v))
+        return v
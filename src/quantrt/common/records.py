@@ -0,0 +1,57 @@
+import dataclasses
+
+from typing import Any, Dict, Optional, Type
+
+
+__all__ = ["slotted"]
+
+
+# Attributes generated by `dataclass` or `type` that must not be copied onto the slotted class.
+_GENERATED = {
+    "__dict__", "__weakref__", "__dataclass_fields__", "__dataclass_params__", "__init__",
+    "__repr__", "__eq__", "__hash__", "__match_args__", "__annotations__", "__module__",
+    "__qualname__", "__doc__", "__slots__", "__setattr__", "__delattr__",
+}
+
+
+def _getstate(self) -> tuple:
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+
+def _setstate(self, state: tuple):
+    for name, value in zip(self.__slots__, state):
+        object.__setattr__(self, name, value)
+
+
+def slotted(cls: Type, frozen: bool = False, name: Optional[str] = None) -> Type:
+    """Build a `__slots__` variant of a dataclass.
+    Instances of the variant have the same fields, constructor and methods as `cls` but no
+    per-instance `__dict__`, which makes them smaller and their attribute lookups faster.
+    :param cls: The dataclass to copy.
+    :param frozen: Whether instances of the variant are immutable (and hashable).
+    :param name: The name of the variant. Defaults to `Slotted<cls>` or `Frozen<cls>`.
+    :return: The slotted dataclass.
+    """
+    if not dataclasses.is_dataclass(cls):
+        raise TypeError("slotted() should be passed a dataclass")
+
+    fields = dataclasses.fields(cls)
+    if any(field.default is not dataclasses.MISSING or field.default_factory is not dataclasses.MISSING
+           for field in fields):
+        raise TypeError("slotted() does not support fields with default values")
+    namespace: Dict[str, Any] = {
+        key: value for key, value in cls.__dict__.items() if key not in _GENERATED
+    }
+    for field in fields:
+        namespace.pop(field.name, None)
+    namespace["__slots__"] = tuple(field.name for field in fields)
+    namespace["__annotations__"] = {field.name: field.type for field in fields}
+    namespace["__module__"] = cls.__module__
+    namespace["__doc__"] = cls.__doc__
+    # Frozen slotted instances cannot be restored through setattr, so pickle them as tuples.
+    namespace["__getstate__"] = _getstate
+    namespace["__setstate__"] = _setstate
+
+    name = name or ("Frozen" if frozen else "Slotted") + cls.__name__
+    namespace["__qualname__"] = name
+    return dataclasses.dataclass(frozen=frozen)(type(name, cls.__bases__, namespace))
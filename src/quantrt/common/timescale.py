@@ -17,23 +17,44 @@ class Timescale(Enum):
 
     @property
     def unit(self) -> str:
-        if self == Timescale.Minute: return "1M"
-        elif self == Timescale.FiveMinute: return "5M"
-        elif self == Timescale.FifteenMinute: return "1M"
-        elif self == Timescale.ThirtyMinute: return "1M"
-        elif self == Timescale.Hour: return "1H"
-        elif self == Timescale.SixHour: return "1H"
-        elif self == Timescale.Day: return "1D"
-        raise ValueError("Unknow type for `Timescale`")
+        return _UNITS[self]
     
 
     @property
     def timedelta(self) -> timedelta:
-        if self == Timescale.Minute: return timedelta(minutes = 1)
-        elif self == Timescale.FiveMinute: return timedelta(minutes = 5)
-        elif self == Timescale.FifteenMinute: return timedelta(minutes = 15)
-        elif self == Timescale.ThirtyMinute: return timedelta(minutes = 30)
-        elif self == Timescale.Hour: return timedelta(hours = 1)
-        elif self == Timescale.SixHour: return timedelta(hours = 6)
-        elif self == Timescale.Day: return timedelta(days = 1)
-        raise ValueError("Unknow type for `Timescale`")
+        return _TIMEDELTAS[self]
+
+
+    @property
+    def seconds(self) -> int:
+        """The width of one bucket in seconds."""
+        return _SECONDS[self]
+
+
+    @property
+    def nanoseconds(self) -> int:
+        """The width of one bucket in nanoseconds, for bucketing int64 epoch arrays."""
+        return _NANOSECONDS[self]
+
+
+# Lookup tables computed once so that the properties above are a single dict lookup.
+_UNITS = {
+    Timescale.Minute: "1M",
+    Timescale.FiveMinute: "5M",
+    Timescale.FifteenMinute: "1M",
+    Timescale.ThirtyMinute: "1M",
+    Timescale.Hour: "1H",
+    Timescale.SixHour: "1H",
+    Timescale.Day: "1D",
+}
+_TIMEDELTAS = {
+    Timescale.Minute: timedelta(minutes = 1),
+    Timescale.FiveMinute: timedelta(minutes = 5),
+    Timescale.FifteenMinute: timedelta(minutes = 15),
+    Timescale.ThirtyMinute: timedelta(minutes = 30),
+    Timescale.Hour: timedelta(hours = 1),
+    Timescale.SixHour: timedelta(hours = 6),
+    Timescale.Day: timedelta(days = 1),
+}
+_SECONDS = {scale: int(delta.total_seconds()) for scale, delta in _TIMEDELTAS.items()}
+_NANOSECONDS = {scale: seconds * 1_000_000_000 for scale, seconds in _SECONDS.items()}
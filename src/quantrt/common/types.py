@@ -1,19 +1,20 @@
-import coinbasepro
-
 from dataclasses import dataclass
 from decimal import Decimal
-from typing import TypeVar, Collection, Union, NewType
+from typing import Any, TypeVar, Collection, Union, NewType, Iterator, List, Optional, Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from coinbasepro import AuthenticatedClient as REST
 
 
-__all__ = ["REST", "OneOrMany", "is_one", "is_many", "Product",
+# `REST` is left out of `__all__` so that star imports do not load coinbasepro, see `__getattr__`
+__all__ = ["OneOrMany", "is_one", "is_many", "Product",
            "Nothing", "MarketBuy", "MarketSell", "LimitBuy", 
-           "LimitSell", "StopLimitBuy", "StopLimitSell"]
+           "LimitSell", "StopLimitBuy", "StopLimitSell", "ActionBatch"]
 
 
 T = TypeVar("T")
 
 OneOrMany = Union[T, Collection[T]]
-REST = coinbasepro.AuthenticatedClient
 Symbol = NewType("Symbol", str)
 
 
@@ -38,23 +39,26 @@ def is_many(t: OneOrMany[T]) -> bool:
     
 
 class Nothing:
-    pass
+    __slots__ = ()
 
 
 @dataclass
 class MarketBuy:
+    __slots__ = ("product", "amount")
     product: str
     amount: Decimal
 
 
 @dataclass
 class MarketSell:
+    __slots__ = ("product", "amount")
     product: str
     amount: Decimal
 
 
 @dataclass
 class LimitBuy:
+    __slots__ = ("product", "amount", "price")
     product: str
     amount: Decimal
     price: Decimal
@@ -62,6 +66,7 @@ class LimitBuy:
 
 @dataclass
 class LimitSell:
+    __slots__ = ("product", "amount", "price")
     product: str
     amount: Decimal
     price: Decimal
@@ -69,6 +74,7 @@ class LimitSell:
 
 @dataclass
 class StopLimitBuy:
+    __slots__ = ("product", "stop", "price", "amount")
     product: str
     stop: Decimal
     price: Decimal
@@ -77,6 +83,7 @@ class StopLimitBuy:
 
 @dataclass
 class StopLimitSell:
+    __slots__ = ("product", "stop", "price", "amount")
     product: str
     stop: Decimal
     price: Decimal
@@ -84,3 +91,61 @@ class StopLimitSell:
 
 
 Action = Union[Nothing, MarketBuy, MarketSell, LimitBuy, LimitSell, StopLimitBuy, StopLimitSell]
+
+
+ACTION_KINDS: List[Type] = [Nothing, MarketBuy, MarketSell, LimitBuy, LimitSell, StopLimitBuy, StopLimitSell]
+
+
+class ActionBatch:
+    """A struct-of-arrays container of actions produced by a strategy.
+    Each action is stored as one entry in each column instead of as an object, `None`
+    marks a column that does not apply to the action's kind. Iterating the batch
+    yields the equivalent `Action` objects.
+    """
+    __slots__ = ("kinds", "products", "amounts", "prices", "stops")
+
+    def __init__(self):
+        # Index of the action type in `ACTION_KINDS`.
+        self.kinds: List[int] = []
+        self.products: List[Optional[str]] = []
+        self.amounts: List[Optional[Decimal]] = []
+        self.prices: List[Optional[Decimal]] = []
+        self.stops: List[Optional[Decimal]] = []
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __iter__(self) -> Iterator[Action]:
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> Action:
+        kind = ACTION_KINDS[self.kinds[i]]
+        if kind is Nothing:
+            return Nothing()
+        if kind is MarketBuy or kind is MarketSell:
+            return kind(self.products[i], self.amounts[i])
+        if kind is LimitBuy or kind is LimitSell:
+            return kind(self.products[i], self.amounts[i], self.prices[i])
+        return kind(self.products[i], self.stops[i], self.prices[i], self.amounts[i])
+
+    def append(self, action: Action) -> "ActionBatch":
+        self.kinds.append(ACTION_KINDS.index(type(action)))
+        self.products.append(getattr(action, "product", None))
+        self.amounts.append(getattr(action, "amount", None))
+        self.prices.append(getattr(action, "price", None))
+        self.stops.append(getattr(action, "stop", None))
+        return self
+
+    def extend(self, actions: Collection[Action]) -> "ActionBatch":
+        for action in actions:
+            self.append(action)
+        return self
+
+
+def __getattr__(name: str) -> Any:
+    # coinbasepro loads requests and urllib3, so `REST` is resolved on first use
+    if name == "REST":
+        from coinbasepro import AuthenticatedClient
+        return AuthenticatedClient
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,129 @@
+import bisect
+import numpy as np
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+from quantrt.common.fixed import ProductScale
+
+if TYPE_CHECKING:
+    from quantrt.api.codec import L2Update
+
+
+__all__ = ["OrderBook"]
+
+
+Level = Tuple[int, int]
+
+
+class OrderBook:
+    """A level 2 order book for a single product.
+    Prices and sizes are kept as integer ticks of the product's `ProductScale`,
+    and only converted back to `Decimal` at the REST boundary.
+    """
+
+    def __init__(self, scale: ProductScale):
+        self.product: str = scale.product
+        self.scale: ProductScale = scale
+        # price ticks -> size ticks
+        self.bids: Dict[int, int] = {}
+        self.asks: Dict[int, int] = {}
+        # sorted ascending price ticks of each side
+        self._bid_prices: List[int] = []
+        self._ask_prices: List[int] = []
+        # exchange time of the last update, epoch nanoseconds from `apply_update` or the message string from `apply`
+        self.time: Optional[Union[int, str]] = None
+
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_prices.clear()
+        self._ask_prices.clear()
+
+
+    def snapshot(self, bids: Iterable[Sequence[str]], asks: Iterable[Sequence[str]]):
+        """Replace the book with a snapshot of [price, size] string pairs."""
+        self.clear()
+        price, size = self.scale.price.parse, self.scale.size.parse
+        self.bids.update((price(level[0]), size(level[1])) for level in bids)
+        self.asks.update((price(level[0]), size(level[1])) for level in asks)
+        self._bid_prices.extend(sorted(self.bids))
+        self._ask_prices.extend(sorted(self.asks))
+
+
+    def update(self, side: str, price: int, size: int):
+        """Set the size at a price level. A size of 0 removes the level.
+        :param side: str - `buy` or `sell`.
+        :param price: int - the price in ticks.
+        :param size: int - the new total size at the level in ticks, not a delta.
+        """
+        if side == "buy":
+            levels, prices = self.bids, self._bid_prices
+        else:
+            levels, prices = self.asks, self._ask_prices
+
+        if size == 0:
+            if levels.pop(price, None) is not None:
+                del prices[bisect.bisect_left(prices, price)]
+            return
+        if price not in levels:
+            bisect.insort(prices, price)
+        levels[price] = size
+
+
+    def apply(self, message: Dict):
+        """Apply a `snapshot` or `l2update` message from the level2 channel."""
+        kind = message["type"]
+        if kind == "l2update":
+            price, size = self.scale.price.parse, self.scale.size.parse
+            for side, level_price, level_size in message["changes"]:
+                self.update(side, price(level_price), size(level_size))
+            self.time = message.get("time")
+        elif kind == "snapshot":
+            self.snapshot(message["bids"], message["asks"])
+
+
+    def apply_update(self, update: "L2Update"):
+        """Apply an `L2Update` decoded by `codec.MessageDecoder`, whose levels are already ticks."""
+        update_level = self.update
+        for side, price, size in zip(update.sides, update.prices, update.sizes):
+            update_level(side, price, size)
+        self.time = update.time
+
+
+    @property
+    def best_bid(self) -> Optional[Level]:
+        if not self._bid_prices:
+            return None
+        price = self._bid_prices[-1]
+        return price, self.bids[price]
+
+
+    @property
+    def best_ask(self) -> Optional[Level]:
+        if not self._ask_prices:
+            return None
+        price = self._ask_prices[0]
+        return price, self.asks[price]
+
+
+    @property
+    def spread(self) -> Optional[int]:
+        if not self._bid_prices or not self._ask_prices:
+            return None
+        return self._ask_prices[0] - self._bid_prices[-1]
+
+
+    def depth(self, side: str, levels: int = 10) -> List[Level]:
+        """The best `levels` levels of one side, best first."""
+        if side == "buy":
+            return [(price, self.bids[price]) for price in reversed(self._bid_prices[-levels:])]
+        return [(price, self.asks[price]) for price in self._ask_prices[:levels]]
+
+
+    def as_arrays(self, side: str, levels: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """The best `levels` levels of one side as int64 (prices, sizes) tick arrays, best first."""
+        depth = self.depth(side, levels)
+        prices = np.fromiter((price for price, _ in depth), dtype=np.int64, count=len(depth))
+        sizes = np.fromiter((size for _, size in depth), dtype=np.int64, count=len(depth))
+        return prices, sizes
@@ -0,0 +1,315 @@
+import asyncio
+import collections
+import datetime
+import numpy as np
+import time
+
+import quantrt.util.metrics
+
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from quantrt.api.codec import L2Update, Match, Ticker
+from quantrt.api.feed import FeedManager
+from quantrt.api.shards import KIND_HEARTBEAT, KIND_L2, KIND_MATCH, KIND_RESET, KIND_TICKER, ShardedFeed
+from quantrt.api.ws import ChannelType
+
+
+__all__ = ["Topic", "Subscriber", "EventBus", "POLICIES", "STATE_CHANNELS"]
+
+
+""" A (channel, product) pair. A product of None matches every product of the channel. """
+Topic = Tuple[ChannelType, Optional[str]]
+Event = Tuple[ChannelType, str, Any]
+
+
+"""
+What a full subscriber queue does with a new event:
+    drop_oldest  discard the oldest queued event
+    drop_newest  discard the new event
+    conflate     like drop_oldest, and state channels keep only the latest undelivered event of each
+                 product, so a slow subscriber sees the latest book or ticker rather than a backlog
+"""
+POLICIES = ("drop_oldest", "drop_newest", "conflate")
+
+
+""" Channels whose events are the latest state of a product, and can be conflated. """
+STATE_CHANNELS = {ChannelType.Level2, ChannelType.Ticker, ChannelType.Heartbeat, ChannelType.Status}
+
+
+# full channel message types, which are also sent on the user channel for the user's orders
+_FULL_TYPES = {"received", "open", "done", "match", "change", "activate"}
+
+# stands in the queue for the latest event of a conflated topic
+_LATEST = object()
+
+
+class Subscriber:
+    """The queue of one subscriber of an `EventBus`.
+    Events are the objects published to the bus, not copies. A subscriber that falls behind
+    only loses its own events, counted in `dropped` or `conflated`.
+    :param name: A name for the stats.
+    :param maxsize: The most events queued.
+    :param policy: One of `POLICIES`.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, policy: str = "drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy {}. Choose one of {}.".format(policy, POLICIES))
+        self.name: str = name
+        self.maxsize: int = maxsize
+        self.policy: str = policy
+        self.topics: List[Topic] = []
+        # counters
+        self.published: int = 0
+        self.delivered: int = 0
+        self.dropped: int = 0
+        self.conflated: int = 0
+        self.high_water: int = 0
+        # (channel, product, event or _LATEST, enqueue time)
+        self._queue: Deque[Tuple[ChannelType, str, Any, float]] = collections.deque()
+        # the latest undelivered event of each conflated (channel, product)
+        self._latest: Dict[Tuple[ChannelType, str], Any] = {}
+        self._ready: Optional[asyncio.Event] = None
+
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest queued event has waited."""
+        if not self._queue:
+            return 0.0
+        return time.monotonic() - self._queue[0][3]
+
+
+    def offer(self, channel: ChannelType, product: str, event: Any, now: float):
+        """Queue an event without blocking, applying the overflow policy."""
+        self.published += 1
+        if self.policy == "conflate" and channel in STATE_CHANNELS:
+            key = (channel, product)
+            if key in self._latest:
+                # replace the undelivered event, keeping its place in the queue
+                self._latest[key] = event
+                self.conflated += 1
+                return
+            self._latest[key] = event
+            event = _LATEST
+
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                if event is _LATEST:
+                    del self._latest[(channel, product)]
+                return
+            oldest = queue.popleft()
+            if oldest[2] is _LATEST:
+                del self._latest[(oldest[0], oldest[1])]
+        queue.append((channel, product, event, now))
+        if len(queue) > self.high_water:
+            self.high_water = len(queue)
+        if self._ready is not None:
+            self._ready.set()
+
+
+    def get_nowait(self) -> Optional[Event]:
+        """The next (channel, product, event), or None if nothing is queued."""
+        if not self._queue:
+            return None
+        channel, product, event, _ = self._queue.popleft()
+        if event is _LATEST:
+            event = self._latest.pop((channel, product))
+        self.delivered += 1
+        return channel, product, event
+
+
+    async def get(self) -> Event:
+        """Wait for the next (channel, product, event)."""
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while True:
+            item = self.get_nowait()
+            if item is not None:
+                return item
+            self._ready.clear()
+            await self._ready.wait()
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self) -> Event:
+        return await self.get()
+
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "queued": len(self),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "high_water": self.high_water,
+            "lag": self.lag,
+        }
+
+
+class EventBus:
+    """Fans market data out to subscribers by (channel, product).
+
+    `publish` never blocks or awaits: it appends a reference to the event to the queue of each
+    matching subscriber, so one slow subscriber cannot delay another or the feed. Attached to a
+    `FeedManager`, the `level2` channel carries the product's `OrderBook` after each update.
+    """
+
+    def __init__(self):
+        self.subscribers: List[Subscriber] = []
+        self._routes: Dict[Topic, List[Subscriber]] = {}
+        # subscribers of each exact (channel, product), including the channel's wildcard subscribers
+        self._resolved: Dict[Tuple[ChannelType, str], Tuple[Subscriber, ...]] = {}
+
+
+    def subscribe(self, name: str, topics: Iterable[Topic], maxsize: int = 1024,
+                  policy: str = "drop_oldest") -> Subscriber:
+        """Add a subscriber to every (channel, product) in `topics`."""
+        subscriber = Subscriber(name, maxsize, policy)
+        for topic in topics:
+            subscriber.topics.append(topic)
+            self._routes.setdefault(topic, []).append(subscriber)
+        self.subscribers.append(subscriber)
+        self._resolved.clear()
+        return subscriber
+
+
+    def unsubscribe(self, subscriber: Subscriber):
+        for topic in subscriber.topics:
+            self._routes[topic].remove(subscriber)
+        self.subscribers.remove(subscriber)
+        self._resolved.clear()
+
+
+    def publish(self, channel: ChannelType, product: str, event: Any):
+        key = (channel, product)
+        subscribers = self._resolved.get(key)
+        if subscribers is None:
+            subscribers = self._resolved[key] = tuple(self._routes.get(key, ())) + \
+                tuple(self._routes.get((channel, None), ()))
+        if subscribers:
+            now = time.monotonic()
+            for subscriber in subscribers:
+                subscriber.offer(channel, product, event, now)
+
+
+    def attach(self, feed: FeedManager) -> "EventBus":
+        """Publish every message of the feed, after the feed has updated its order books."""
+        books = feed.books
+
+        def on_message(message):
+            kind = type(message)
+            if kind is L2Update:
+                book = books.get(message.product)
+                if book is not None:
+                    self.publish(ChannelType.Level2, message.product, book)
+            elif kind is Match:
+                self.publish(ChannelType.Matches, message.product, message)
+            elif kind is Ticker:
+                self.publish(ChannelType.Ticker, message.product, message)
+            else:
+                self._publish_dict(message, books)
+
+        feed.on_message(on_message)
+        return self
+
+
+    def attach_sharded(self, feed: ShardedFeed) -> "EventBus":
+        """Publish the merged events of a `ShardedFeed`, after it has applied them to its order books.
+
+        Events are published in the same types as `attach` publishes live messages. The `level2`
+        channel carries each changed product's `OrderBook` once per batch, after the batch's other
+        events. Matches and tickers are rebuilt as `Match` and `Ticker` records; the shards do not
+        carry the order ids of a match, and a ticker's best bid and ask are read from the merged book.
+        """
+        products = feed.products
+        books = feed.books
+
+        def on_events(events: np.ndarray):
+            changed = {}
+            for time_ns, _, sequence, trade_id, price, size, index, kind, side in events.tolist():
+                product = products[index]
+                if kind == KIND_L2 or kind == KIND_RESET:
+                    changed[product] = None
+                elif kind == KIND_MATCH:
+                    self.publish(ChannelType.Matches, product, Match(
+                        product, time_ns, sequence, trade_id, "sell" if side else "buy", price, size, "", ""))
+                elif kind == KIND_TICKER:
+                    book = books.get(product)
+                    bid = book.best_bid if book is not None else None
+                    ask = book.best_ask if book is not None else None
+                    self.publish(ChannelType.Ticker, product, Ticker(
+                        product, time_ns, sequence, trade_id, "sell" if side else "buy", price, size,
+                        bid[0] if bid else 0, ask[0] if ask else 0))
+                elif kind == KIND_HEARTBEAT:
+                    self.publish(ChannelType.Heartbeat, product, {
+                        "type": "heartbeat",
+                        "product_id": product,
+                        "sequence": sequence,
+                        "last_trade_id": trade_id,
+                        "time": datetime.datetime.utcfromtimestamp(time_ns / 1e9).isoformat() + "Z",
+                    })
+            for product in changed:
+                book = books.get(product)
+                if book is not None:
+                    self.publish(ChannelType.Level2, product, book)
+
+        feed.on_events(on_events)
+        return self
+
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """The counters of every subscriber."""
+        return [subscriber.stats() for subscriber in self.subscribers]
+
+
+    def register_metrics(self, registry: Optional[quantrt.util.metrics.Registry] = None):
+        """Expose the queue depth, lag and event counters of every subscriber, read at scrape time."""
+        registry = registry or quantrt.util.metrics.default_registry
+        registry.collect("quantrt_bus_queued", "Events queued for each subscriber.", "gauge",
+                         lambda: [("quantrt_bus_queued", {"subscriber": subscriber.name}, len(subscriber))
+                                  for subscriber in list(self.subscribers)])
+        registry.collect("quantrt_bus_lag_seconds", "Seconds the oldest queued event of each subscriber has waited.",
+                         "gauge", lambda: [("quantrt_bus_lag_seconds", {"subscriber": subscriber.name}, subscriber.lag)
+                                           for subscriber in list(self.subscribers)])
+        registry.collect("quantrt_bus_events_total", "Events of each subscriber by what happened to them.", "counter",
+                         lambda: [("quantrt_bus_events_total", {"subscriber": subscriber.name, "outcome": outcome},
+                                   getattr(subscriber, outcome))
+                                  for subscriber in list(self.subscribers)
+                                  for outcome in ("published", "delivered", "dropped", "conflated")])
+
+
+    def _publish_dict(self, message: Dict, books):
+        kind = message.get("type")
+        product = message.get("product_id")
+        if product is None:
+            return
+        if kind == "snapshot" or kind == "l2update":
+            book = books.get(product)
+            if book is not None:
+                self.publish(ChannelType.Level2, product, book)
+        elif kind == "heartbeat":
+            self.publish(ChannelType.Heartbeat, product, message)
+        elif kind == "ticker":
+            self.publish(ChannelType.Ticker, product, message)
+        elif kind == "match" and "user_id" in message:
+            # the matches channel carries its own copy of the user's trades
+            self.publish(ChannelType.User, product, message)
+        elif kind == "match" or kind == "last_match":
+            self.publish(ChannelType.Matches, product, message)
+        elif kind in _FULL_TYPES:
+            self.publish(ChannelType.Full, product, message)
+            if "user_id" in message:
+                self.publish(ChannelType.User, product, message)
@@ -0,0 +1,347 @@
+import datetime
+import glob
+import numpy as np
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import quantrt.common.config
+import quantrt.common.log
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from quantrt.api.feed import FeedManager
+
+
+__all__ = ["CHUNK_HEADER", "RECORD_HEADER", "INDEX_DTYPE", "CODECS", "default_codec", "Recorder", "CaptureReader"]
+
+
+"""
+Capture files are append-only sequences of compressed chunks of raw websocket frames.
+
+    <prefix>-<%Y%m%dT%H%M%S>-<first sequence>.qcap   chunks, each a CHUNK_HEADER and its payload
+    <prefix>-<%Y%m%dT%H%M%S>-<first sequence>.qidx   one INDEX_DTYPE entry per chunk
+
+A decompressed payload is `count` records, each a RECORD_HEADER followed by the frame bytes.
+The index duplicates the chunk headers so a reader can seek without scanning the data file.
+"""
+CHUNK_MAGIC = b"QCAP"
+# magic, codec id, record count, raw payload size, compressed payload size, first receive ns, last receive ns, first sequence
+CHUNK_HEADER = struct.Struct("<4sBxxxIIIqqq")
+# receive ns, frame length
+RECORD_HEADER = struct.Struct("<qI")
+INDEX_DTYPE = np.dtype([
+    ("offset", "<i8"),
+    ("size", "<i8"),
+    ("first_ns", "<i8"),
+    ("last_ns", "<i8"),
+    ("first_seq", "<i8"),
+    ("count", "<u4"),
+    ("codec", "u1"),
+])
+
+
+Codec = Tuple[int, Callable[[], Callable[[bytes], bytes]], Callable[[], Callable[[bytes], bytes]]]
+
+
+def _zlib() -> Codec:
+    return 1, lambda: lambda data: zlib.compress(data, 1), lambda: zlib.decompress
+
+
+def _zstd() -> Optional[Codec]:
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return (2, lambda: zstandard.ZstdCompressor(level=3).compress,
+            lambda: zstandard.ZstdDecompressor().decompress)
+
+
+def _lz4() -> Optional[Codec]:
+    try:
+        import lz4.block
+    except ImportError:
+        return None
+    return 3, lambda: lz4.block.compress, lambda: lz4.block.decompress
+
+
+""" The available codecs by name, each an id and factories of its compress and decompress functions. """
+CODECS: Dict[str, Codec] = {
+    name: codec for name, codec in [("zstd", _zstd()), ("lz4", _lz4()), ("zlib", _zlib())] if codec is not None
+}
+CODEC_NAMES: Dict[int, str] = {codec[0]: name for name, codec in CODECS.items()}
+
+
+def default_codec() -> str:
+    """The fastest installed codec: zstd, then lz4, then zlib from the standard library."""
+    return next(iter(CODECS))
+
+
+class Recorder:
+    """Tees the raw frames of a `FeedManager` into rotating, chunk compressed capture files.
+
+    `record` only appends the frame to the open chunk. Full chunks are handed to a background
+    thread that packs, compresses and writes them, so the feed is never blocked on disk or
+    compression. If the writer falls more than `max_pending` chunks behind, new chunks are
+    dropped and counted rather than queued without bound.
+    :param root: The directory of the capture files. Defaults to `<app_dir>/capture`.
+    :param prefix: The file name prefix.
+    :param codec: The codec name from `CODECS`. Defaults to `default_codec()`.
+    :param chunk_frames: The number of frames per chunk.
+    :param flush_interval: Seconds of receive time after which a partial chunk is written.
+    :param max_bytes: The size at which a capture file is rotated.
+    :param rotate_interval: Seconds of receive time after which a capture file is rotated.
+    :param max_pending: The most chunks queued for the writer.
+    """
+
+    def __init__(self, root: Optional[str] = None, prefix: str = "feed", codec: Optional[str] = None,
+                 chunk_frames: int = 4096, flush_interval: float = 1.0, max_bytes: int = 256 * 1024 * 1024,
+                 rotate_interval: float = 3600.0, max_pending: int = 256):
+        if root is None:
+            root = os.path.join(quantrt.common.config.app_dir, "capture")
+        codec = codec or default_codec()
+        if codec not in CODECS:
+            raise ValueError("The codec {} is not available. Choose one of {}.".format(codec, list(CODECS)))
+        self.root: str = root
+        self.prefix: str = prefix
+        self.codec: str = codec
+        self.chunk_frames: int = chunk_frames
+        self.flush_interval_ns: int = int(flush_interval * 1e9)
+        self.max_bytes: int = max_bytes
+        self.rotate_interval_ns: int = int(rotate_interval * 1e9)
+
+        # counters, read from any thread
+        self.frames: int = 0
+        self.chunks: int = 0
+        self.dropped: int = 0
+        self.raw_bytes: int = 0
+        self.written_bytes: int = 0
+        self.files: List[str] = []
+
+        self._sequence: int = 0
+        self._times: List[int] = []
+        self._frames: List[Union[str, bytes]] = []
+        self._queue: "queue.Queue[Optional[Tuple[int, List[int], List[Union[str, bytes]]]]]" = queue.Queue(max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._dropping: bool = False
+        os.makedirs(root, exist_ok=True)
+
+
+    def attach(self, feed: FeedManager) -> "Recorder":
+        """Record every frame the feed receives."""
+        feed.on_frame(self.record)
+        return self
+
+
+    def record(self, frame: Union[str, bytes], received_ns: int):
+        """Append a raw frame to the open chunk."""
+        times = self._times
+        times.append(received_ns)
+        self._frames.append(frame)
+        if len(times) >= self.chunk_frames or received_ns - times[0] >= self.flush_interval_ns:
+            self.flush()
+
+
+    def flush(self):
+        """Hand the open chunk to the writer."""
+        if not self._times:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, name="quantrt-recorder", daemon=True)
+            self._thread.start()
+        chunk = (self._sequence, self._times, self._frames)
+        self._sequence += len(self._times)
+        self._times, self._frames = [], []
+        try:
+            self._queue.put_nowait(chunk)
+            self._dropping = False
+        except queue.Full:
+            self.dropped += len(chunk[1])
+            if not self._dropping:
+                quantrt.common.log.QuantrtLog.warning("The capture writer is behind, dropping frames.")
+            self._dropping = True
+
+
+    def close(self):
+        """Write the open chunk, wait for the writer to finish and close the capture file."""
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def _write_loop(self):
+        codec_id, compressor, _ = CODECS[self.codec]
+        compress = compressor()
+        data = index = None
+        file_start = 0
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            sequence, times, frames = chunk
+
+            parts: List[bytes] = []
+            pack = RECORD_HEADER.pack
+            for received_ns, frame in zip(times, frames):
+                if isinstance(frame, str):
+                    frame = frame.encode("utf-8")
+                parts.append(pack(received_ns, len(frame)))
+                parts.append(frame)
+            raw = b"".join(parts)
+            payload = compress(raw)
+
+            if data is None or data.tell() >= self.max_bytes or times[0] - file_start >= self.rotate_interval_ns:
+                if data is not None:
+                    data.close()
+                    index.close()
+                data, index = self._open(times[0], sequence)
+                file_start = times[0]
+
+            offset = data.tell()
+            data.write(CHUNK_HEADER.pack(CHUNK_MAGIC, codec_id, len(times), len(raw), len(payload),
+                                         times[0], times[-1], sequence))
+            data.write(payload)
+            data.flush()
+            entry = np.array([(offset, CHUNK_HEADER.size + len(payload), times[0], times[-1], sequence,
+                               len(times), codec_id)], dtype=INDEX_DTYPE)
+            index.write(entry.tobytes())
+            index.flush()
+
+            self.frames += len(times)
+            self.chunks += 1
+            self.raw_bytes += len(raw)
+            self.written_bytes += CHUNK_HEADER.size + len(payload)
+
+        if data is not None:
+            data.close()
+            index.close()
+
+
+    def _open(self, first_ns: int, sequence: int):
+        stamp = datetime.datetime.utcfromtimestamp(first_ns / 1e9).strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(self.root, "{}-{}-{:012d}".format(self.prefix, stamp, sequence))
+        self.files.append(path + ".qcap")
+        quantrt.common.log.QuantrtLog.info("Recording the websocket feed to %s.qcap", path)
+        return open(path + ".qcap", "ab"), open(path + ".qidx", "ab")
+
+
+class CaptureReader:
+    """Reads capture files written by a `Recorder`.
+
+    Only the chunk indexes are loaded up front. A chunk is read and decompressed when it is
+    reached, and its frames are sliced out of the payload as raw bytes, so nothing is json
+    decoded until a consumer asks for it.
+    :param paths: The `.qcap` files, or a directory whose capture files are read in name order.
+    :param prefix: The file name prefix when `paths` is a directory.
+    """
+
+    def __init__(self, paths: Union[str, Iterable[str]], prefix: str = "feed"):
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(os.path.join(paths, "{}-*.qcap".format(prefix))))
+        self.paths: List[str] = list(paths)
+        self.indexes: List[np.ndarray] = [self._load_index(path) for path in self.paths]
+        self._decompressors: Dict[int, Callable[[bytes], bytes]] = {
+            codec[0]: codec[2]() for codec in CODECS.values()
+        }
+
+
+    @property
+    def first_ns(self) -> Optional[int]:
+        """The receive time of the first captured frame."""
+        firsts = [int(index["first_ns"][0]) for index in self.indexes if len(index)]
+        return min(firsts) if firsts else None
+
+
+    @property
+    def last_ns(self) -> Optional[int]:
+        """The receive time of the last captured frame."""
+        lasts = [int(index["last_ns"][-1]) for index in self.indexes if len(index)]
+        return max(lasts) if lasts else None
+
+
+    def __len__(self) -> int:
+        """The number of captured frames."""
+        return int(sum(index["count"].sum() for index in self.indexes))
+
+
+    def locate(self, when_ns: int) -> Tuple[int, int]:
+        """The (file, chunk) position of the first chunk that may hold frames received at or after `when_ns`."""
+        for i, index in enumerate(self.indexes):
+            if len(index) and index["last_ns"][-1] >= when_ns:
+                return i, int(np.searchsorted(index["last_ns"], when_ns, side="left"))
+        return len(self.indexes), 0
+
+
+    def read_chunk(self, file: int, chunk: int) -> bytes:
+        """Read and decompress the payload of one chunk."""
+        entry = self.indexes[file][chunk]
+        with open(self.paths[file], "rb") as fhandle:
+            fhandle.seek(int(entry["offset"]))
+            data = fhandle.read(int(entry["size"]))
+        header = CHUNK_HEADER.unpack_from(data)
+        if header[0] != CHUNK_MAGIC:
+            raise ValueError("Corrupt capture chunk at {}:{}.".format(self.paths[file], int(entry["offset"])))
+        return self._decompressors[header[1]](data[CHUNK_HEADER.size:])
+
+
+    def frames(self, start_ns: Optional[int] = None, stop_ns: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        """Yield (receive ns, raw frame) pairs received in [start_ns, stop_ns), in capture order."""
+        file, chunk = self.locate(start_ns) if start_ns is not None else (0, 0)
+        unpack = RECORD_HEADER.unpack_from
+        size = RECORD_HEADER.size
+        while file < len(self.indexes):
+            index = self.indexes[file]
+            while chunk < len(index):
+                if stop_ns is not None and index["first_ns"][chunk] >= stop_ns:
+                    return
+                payload = self.read_chunk(file, chunk)
+                view = memoryview(payload)
+                offset, end = 0, len(payload)
+                while offset < end:
+                    received_ns, length = unpack(payload, offset)
+                    offset += size
+                    if stop_ns is not None and received_ns >= stop_ns:
+                        return
+                    if start_ns is None or received_ns >= start_ns:
+                        yield received_ns, view[offset:offset + length].tobytes()
+                    offset += length
+                chunk += 1
+            file, chunk = file + 1, 0
+
+
+    def _load_index(self, path: str) -> np.ndarray:
+        index_path = path[:-len(".qcap")] + ".qidx"
+        if os.path.exists(index_path):
+            # a writer killed mid entry leaves a partial record at the end
+            index = np.fromfile(index_path, dtype=np.uint8)
+            return index[:len(index) - len(index) % INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        return self._scan_index(path)
+
+
+    def _scan_index(self, path: str) -> np.ndarray:
+        """Rebuild the index of a capture file from its chunk headers."""
+        entries = []
+        with open(path, "rb") as fhandle:
+            while True:
+                offset = fhandle.tell()
+                header = fhandle.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size:
+                    break
+                magic, codec, count, _, size, first_ns, last_ns, sequence = CHUNK_HEADER.unpack(header)
+                if magic != CHUNK_MAGIC:
+                    break
+                fhandle.seek(size, os.SEEK_CUR)
+                entries.append((offset, CHUNK_HEADER.size + size, first_ns, last_ns, sequence, count, codec))
+        return np.array(entries, dtype=INDEX_DTYPE)
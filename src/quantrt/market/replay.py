@@ -0,0 +1,116 @@
+import asyncio
+import datetime
+import time
+
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.util.cache
+
+from typing import Optional, Union
+
+from quantrt.api.feed import FeedManager
+from quantrt.common.clock import SimulatedClock
+from quantrt.market.capture import CaptureReader
+
+
+__all__ = ["Replay"]
+
+
+class Replay:
+    """Feeds captured websocket frames through a `FeedManager` as if they were arriving live.
+
+    With `speed=None` frames are fed as fast as they can be decoded. Otherwise the gaps between
+    receive times are reproduced, divided by `speed`, so 1.0 is real time and 10.0 is ten times
+    faster. If a `SimulatedClock` is given it is set to each frame's receive time before the
+    frame is fed, so anything reading the clock sees capture time and a replay is deterministic.
+    :param source: The capture to replay, a `CaptureReader` or a capture directory.
+    :param feed: The pipeline to feed.
+    :param speed: The replay speed relative to real time, None for as fast as possible.
+    :param clock: The clock to move with the replay. Defaults to `config.clock` if it is simulated.
+    """
+
+    def __init__(self, source: Union[CaptureReader, str], feed: FeedManager, speed: Optional[float] = None,
+                 clock: Optional[SimulatedClock] = None):
+        if speed is not None and speed <= 0:
+            raise ValueError("The replay speed must be positive.")
+        if clock is None and isinstance(quantrt.common.config.clock, SimulatedClock):
+            clock = quantrt.common.config.clock
+        self.reader: CaptureReader = source if isinstance(source, CaptureReader) else CaptureReader(source)
+        self.feed: FeedManager = feed
+        self.speed: Optional[float] = speed
+        self.clock: Optional[SimulatedClock] = clock
+        # the receive time replay starts from, set by `seek`
+        self.position_ns: Optional[int] = None
+        # number of frames fed
+        self.frames: int = 0
+        self._running: bool = False
+
+
+    def seek(self, when: Union[datetime.datetime, int]):
+        """Start the next run at the first frame received at or after `when`.
+        :param when: A naive UTC datetime or epoch nanoseconds.
+        """
+        if isinstance(when, datetime.datetime):
+            when = quantrt.util.cache.to_epoch_ns(when)
+        self.position_ns = when
+
+
+    def run(self, stop: Optional[Union[datetime.datetime, int]] = None) -> int:
+        """Replay as fast as possible from the current position.
+        :param stop: Stop before the first frame received at or after this time. Defaults to the end of the capture.
+        :return: The number of frames fed.
+        """
+        if self.speed is not None:
+            raise ValueError("Paced replays must be run with `run_async`.")
+        self._running = True
+        fed = 0
+        for received_ns, frame in self.reader.frames(self.position_ns, self._stop_ns(stop)):
+            if not self._running:
+                break
+            self._feed(frame, received_ns)
+            fed += 1
+        return fed
+
+
+    async def run_async(self, stop: Optional[Union[datetime.datetime, int]] = None) -> int:
+        """Replay from the current position at `speed`, sleeping between frames that are not yet due.
+        The event loop is yielded to at least once per chunk of frames even at full speed.
+        :param stop: Stop before the first frame received at or after this time. Defaults to the end of the capture.
+        :return: The number of frames fed.
+        """
+        self._running = True
+        fed = 0
+        origin_ns = wall_origin = None
+        for received_ns, frame in self.reader.frames(self.position_ns, self._stop_ns(stop)):
+            if not self._running:
+                break
+            if self.speed is not None:
+                if origin_ns is None:
+                    origin_ns, wall_origin = received_ns, time.perf_counter()
+                delay = wall_origin + (received_ns - origin_ns) / 1e9 / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif fed % 4096 == 0:
+                await asyncio.sleep(0)
+            self._feed(frame, received_ns)
+            fed += 1
+        return fed
+
+
+    def stop(self):
+        """Stop a run after the frame being fed."""
+        self._running = False
+
+
+    def _feed(self, frame: bytes, received_ns: int):
+        if self.clock is not None:
+            self.clock.set(quantrt.util.cache.from_epoch_ns(received_ns))
+        self.feed.feed(frame, received_ns)
+        self.position_ns = received_ns + 1
+        self.frames += 1
+
+
+    def _stop_ns(self, stop: Optional[Union[datetime.datetime, int]]) -> Optional[int]:
+        if isinstance(stop, datetime.datetime):
+            return quantrt.util.cache.to_epoch_ns(stop)
+        return stop
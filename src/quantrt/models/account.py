@@ -1,5 +1,6 @@
 import asyncio
 import asyncpg
+import numpy as np
 
 import quantrt.common.config
 import quantrt.common.log
@@ -10,7 +11,9 @@ from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
-from typing import Optional, Iterable, List
+from typing import Optional, Iterable, Iterator, List, Mapping, Tuple, Union
+
+from quantrt.common.records import slotted
 
 
 @dataclass
@@ -29,6 +32,76 @@ class Account:
     enabled: bool
 
 
+SlottedAccount = slotted(Account)
+FrozenAccount = slotted(Account, frozen=True)
+
+
+class AccountBatch:
+    """A struct-of-arrays container of accounts.
+    Balances are numpy arrays and identifiers are lists. Iterating the batch yields
+    `FrozenAccount` records, so it can be passed anywhere an `Iterable[Account]` is read.
+    """
+    __slots__ = ("account_id", "profile_id", "currency", "balance", "available", "enabled")
+
+    def __init__(self, account_id: List[str], profile_id: List[str], currency: List[str],
+                 balance: np.ndarray, available: np.ndarray, enabled: np.ndarray):
+        self.account_id: List[str] = account_id
+        self.profile_id: List[str] = profile_id
+        self.currency: List[str] = currency
+        self.balance: np.ndarray = balance
+        self.available: np.ndarray = available
+        self.enabled: np.ndarray = enabled
+
+
+    @classmethod
+    def from_accounts(cls, accounts: Iterable[Union[Account, Mapping]]) -> "AccountBatch":
+        """Build a batch from `Account` records or from database rows."""
+        accounts = [account if isinstance(account, (Account, SlottedAccount, FrozenAccount)) else Account(
+            account_id=account["account_id"],
+            profile_id=account["profile_id"],
+            currency=account["currency"],
+            balance=account["balance"],
+            available=account["available"],
+            enabled=account["enabled"]) for account in accounts]
+        return cls(
+            account_id=[account.account_id for account in accounts],
+            profile_id=[account.profile_id for account in accounts],
+            currency=[account.currency for account in accounts],
+            balance=np.array([account.balance for account in accounts], dtype=np.float64),
+            available=np.array([account.available for account in accounts], dtype=np.float64),
+            enabled=np.array([account.enabled for account in accounts], dtype=np.bool_))
+
+
+    def __len__(self) -> int:
+        return len(self.account_id)
+
+
+    def __getitem__(self, i: int) -> FrozenAccount:
+        return FrozenAccount(
+            account_id=self.account_id[i],
+            profile_id=self.profile_id[i],
+            currency=self.currency[i],
+            balance=self.balance[i],
+            available=self.available[i],
+            enabled=bool(self.enabled[i]))
+
+
+    def __iter__(self) -> Iterator[FrozenAccount]:
+        for i in range(len(self.account_id)):
+            yield self[i]
+
+
+    def rows(self) -> Iterator[Tuple]:
+        """The batch as `save_batch` parameter tuples."""
+        return zip(
+            self.account_id,
+            self.profile_id,
+            self.currency,
+            self.balance.tolist(),
+            self.available.tolist(),
+            self.enabled.tolist())
+
+
 async def save(account: Account, pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
@@ -60,7 +133,7 @@ async def save(account: Account, pool: Optional[asyncpg.Pool] = None):
             account.enabled))
 
 
-async def save_batch(accounts: Iterable[Account], pool: Optional[asyncpg.Pool] = None):
+async def save_batch(accounts: Union[Iterable[Account], AccountBatch], pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -82,6 +155,9 @@ async def save_batch(accounts: Iterable[Account], pool: Optional[asyncpg.Pool] =
                 enabled = EXCLUDED.enabled
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
+        if isinstance(accounts, AccountBatch):
+            await statement.executemany(accounts.rows())
+            return
         await statement.executemany((
             account.account_id,
             account.profile_id,
@@ -114,7 +190,8 @@ async def fetch(account_id: str, profile_id: str, currency: str, pool: Optional[
     )
 
 
-async def fetch_batch(currency: str, pool: Optional[asyncpg.Pool] = None) -> Iterable[Account]:
+async def fetch_batch(currency: str, pool: Optional[asyncpg.Pool] = None,
+                      as_batch: bool = False) -> Union[Iterable[Account], AccountBatch]:
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -127,7 +204,9 @@ async def fetch_batch(currency: str, pool: Optional[asyncpg.Pool] = None) -> Ite
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
         rows = await statement.fetch(currency)
-    
+
+    if as_batch:
+        return AccountBatch.from_accounts(rows)
     return [Account(
         account_id=row["account_id"],
         profile_id=row["profile_id"],
@@ -136,7 +215,8 @@ async def fetch_batch(currency: str, pool: Optional[asyncpg.Pool] = None) -> Ite
         enabled=row["enabled"]) for row in rows]
 
 
-async def fetch_all_enabled(pool: Optional[asyncpg.Pool] = None) -> Iterable[Account]:
+async def fetch_all_enabled(pool: Optional[asyncpg.Pool] = None,
+                            as_batch: bool = False) -> Union[Iterable[Account], AccountBatch]:
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -149,7 +229,9 @@ async def fetch_all_enabled(pool: Optional[asyncpg.Pool] = None) -> Iterable[Acc
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
         rows = await statement.fetch()
-    
+
+    if as_batch:
+        return AccountBatch.from_accounts(rows)
     return [Account(
         account_id=row["account_id"],
         profile_id=row["profile_id"],
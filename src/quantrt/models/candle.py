@@ -1,20 +1,24 @@
 import asyncio
 import asyncpg
+import numpy as np
 
 import quantrt.common.config
 import quantrt.common.log
+import quantrt.util.cache
+import quantrt.util.coverage
 import quantrt.util.database
 import quantrt.util.time
 
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Iterator, Tuple, Union
 
+from quantrt.common.records import slotted
 from quantrt.common.timescale import Timescale
 
 
-__all__ = ["Candle", "save", "save_batch", "fetch", "fetch_batch"]
+__all__ = ["Candle", "SlottedCandle", "FrozenCandle", "CandleBatch", "save", "save_batch", "fetch", "fetch_batch"]
 
 
 @dataclass
@@ -37,6 +41,85 @@ class Candle:
     volume: Decimal
 
 
+SlottedCandle = slotted(Candle)
+FrozenCandle = slotted(Candle, frozen=True)
+
+
+class CandleBatch:
+    """A struct-of-arrays container of the candles of one product and timescale.
+    The columns are numpy arrays with timestamps as int64 nanoseconds since the epoch, so a
+    batch built from the candle cache shares memory with the cached segment. Iterating the
+    batch yields `FrozenCandle` records, so it can be passed anywhere an `Iterable[Candle]` is read.
+    """
+    __slots__ = ("product", "timescale", "tstamp", "open", "high", "low", "close", "volume")
+
+    def __init__(self, product: str, timescale: Timescale, tstamp: np.ndarray, open: np.ndarray,
+                 high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray):
+        self.product: str = product
+        self.timescale: Timescale = timescale
+        self.tstamp: np.ndarray = tstamp
+        self.open: np.ndarray = open
+        self.high: np.ndarray = high
+        self.low: np.ndarray = low
+        self.close: np.ndarray = close
+        self.volume: np.ndarray = volume
+
+
+    @classmethod
+    def from_array(cls, product: str, timescale: Timescale, rows: np.ndarray) -> "CandleBatch":
+        """Wrap a `cache.CANDLE_DTYPE` array without copying it."""
+        return cls(product, timescale, rows["tstamp"], rows["open"], rows["high"], rows["low"],
+                   rows["close"], rows["volume"])
+
+
+    @classmethod
+    def from_candles(cls, product: str, timescale: Timescale, candles: Iterable[Candle]) -> "CandleBatch":
+        rows = np.array([(
+            quantrt.util.cache.to_epoch_ns(candle.tstamp),
+            candle.open,
+            candle.high,
+            candle.low,
+            candle.close,
+            candle.volume) for candle in candles], dtype=quantrt.util.cache.CANDLE_DTYPE)
+        return cls.from_array(product, timescale, rows)
+
+
+    def __len__(self) -> int:
+        return len(self.tstamp)
+
+
+    def __getitem__(self, i: int) -> FrozenCandle:
+        return FrozenCandle(
+            product=self.product,
+            tstamp=quantrt.util.cache.from_epoch_ns(self.tstamp[i]),
+            timescale=self.timescale,
+            open=self.open[i],
+            high=self.high[i],
+            low=self.low[i],
+            close=self.close[i],
+            volume=self.volume[i])
+
+
+    def __iter__(self) -> Iterator[FrozenCandle]:
+        for i in range(len(self.tstamp)):
+            yield self[i]
+
+
+    def rows(self) -> Iterator[Tuple]:
+        """The batch as `save_batch` parameter tuples."""
+        timescale = self.timescale.name
+        tstamps = [quantrt.util.cache.from_epoch_ns(tstamp) for tstamp in self.tstamp.tolist()]
+        return zip(
+            [self.product] * len(tstamps),
+            tstamps,
+            [timescale] * len(tstamps),
+            self.open.tolist(),
+            self.high.tolist(),
+            self.low.tolist(),
+            self.close.tolist(),
+            self.volume.tolist())
+
+
 async def save(candle: Candle, pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
@@ -72,12 +155,16 @@ async def save(candle: Candle, pool: Optional[asyncpg.Pool] = None):
             candle.volume))
 
 
-async def save_batch(candles: Iterable[Candle], pool: Optional[asyncpg.Pool] = None):
+async def save_batch(candles: Union[Iterable[Candle], CandleBatch], pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
         quantrt.common.log.QuantrtLog.exception("No connection pool has been configured.")
         raise EnvironmentError("No connection pool has been configured.")
+
+    cache = quantrt.common.config.candle_cache
+    if (cache is not None or quantrt.util.coverage.coverage_indexes) and not isinstance(candles, CandleBatch):
+        candles = list(candles)
     
     async with pool.acquire() as conn:
         sql = """
@@ -96,15 +183,33 @@ async def save_batch(candles: Iterable[Candle], pool: Optional[asyncpg.Pool] = N
                 volume = EXCLUDED.volume
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
-        await statement.executemany([(
-            candle.product, 
-            candle.tstamp, 
-            candle.timescale.name, 
-            candle.open, 
-            candle.high, 
-            candle.low, 
-            candle.close, 
-            candle.volume) for candle in candles])
+        if isinstance(candles, CandleBatch):
+            await statement.executemany(candles.rows())
+        else:
+            await statement.executemany([(
+                candle.product, 
+                candle.tstamp, 
+                candle.timescale.name, 
+                candle.open, 
+                candle.high, 
+                candle.low, 
+                candle.close, 
+                candle.volume) for candle in candles])
+
+    quantrt.util.coverage.record(candles)
+    if cache is not None:
+        if isinstance(candles, CandleBatch):
+            if len(candles):
+                since = quantrt.util.cache.from_epoch_ns(candles.tstamp.min())
+                cache.invalidate(candles.product, candles.timescale, since)
+            return
+        earliest = {}
+        for candle in candles:
+            key = (candle.product, candle.timescale)
+            if key not in earliest or candle.tstamp < earliest[key]:
+                earliest[key] = candle.tstamp
+        for (product, timescale), since in earliest.items():
+            cache.invalidate(product, timescale, since)
 
 
 async def fetch(product: str, tstamp: datetime, timescale: Timescale, pool: Optional[asyncpg.Pool] = None) -> Candle:
@@ -134,7 +239,24 @@ async def fetch(product: str, tstamp: datetime, timescale: Timescale, pool: Opti
     )
 
 
-async def fetch_batch(product: str, start: datetime, stop: datetime, timescale: Timescale, pool: Optional[asyncpg.Pool] = None) -> Iterable[Candle]:
+async def fetch_batch(product: str, start: datetime, stop: datetime, timescale: Timescale, pool: Optional[asyncpg.Pool] = None,
+                      as_batch: bool = False) -> Union[Iterable[Candle], CandleBatch]:
+    cache = quantrt.common.config.candle_cache
+    if cache is not None:
+        rows = await cache.fetch_array(product, start, stop, timescale, pool)
+        if as_batch:
+            return CandleBatch.from_array(product, timescale, rows)
+        return [Candle(
+            product=product,
+            tstamp=quantrt.util.cache.from_epoch_ns(row["tstamp"]),
+            timescale=timescale,
+            open=row["open"],
+            high=row["high"],
+            low=row["low"],
+            close=row["close"],
+            volume=row["volume"]
+        ) for row in rows]
+
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -150,7 +272,15 @@ async def fetch_batch(product: str, start: datetime, stop: datetime, timescale:
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
         rows = await statement.fetch(product, start, stop, timescale.name)
-    
+
+    if as_batch:
+        return CandleBatch.from_array(product, timescale, np.array([(
+            quantrt.util.cache.to_epoch_ns(row["tstamp"]),
+            row["open"],
+            row["high"],
+            row["low"],
+            row["close"],
+            row["volume"]) for row in rows], dtype=quantrt.util.cache.CANDLE_DTYPE))
     return [Candle(
         product=row["product"],
         tstamp=row["tstamp"],
@@ -1,8 +1,10 @@
 import asyncio
 import asyncpg
+import numpy as np
 
 import quantrt.common.config
 import quantrt.common.log
+import quantrt.util.cache
 import quantrt.util.database
 import quantrt.util.time
 
@@ -10,10 +12,13 @@ from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Iterator, List, Mapping, Tuple, Union
 
+from quantrt.common.records import slotted
 
-__all__ = ["OrderStatus", "Order", "save", "save_batch", "fetch", "fetch_batch", "fetch_open"]
+
+__all__ = ["OrderStatus", "Order", "SlottedOrder", "FrozenOrder", "OrderBatch",
+           "save", "save_batch", "fetch", "fetch_batch", "fetch_open"]
 
 
 class OrderStatus(Enum):
@@ -41,6 +46,82 @@ class Order:
     price: Decimal
 
 
+SlottedOrder = slotted(Order)
+FrozenOrder = slotted(Order, frozen=True)
+
+
+class OrderBatch:
+    """A struct-of-arrays container of orders.
+    Numeric columns are numpy arrays, with timestamps as int64 nanoseconds since the epoch,
+    and text columns are lists. Iterating the batch yields `FrozenOrder` records, so it can
+    be passed anywhere an `Iterable[Order]` is read.
+    """
+    __slots__ = ("order_id", "product", "tstamp", "status", "side", "amount", "price")
+
+    def __init__(self, order_id: List[str], product: List[str], tstamp: np.ndarray, status: List[OrderStatus],
+                 side: List[str], amount: np.ndarray, price: np.ndarray):
+        self.order_id: List[str] = order_id
+        self.product: List[str] = product
+        self.tstamp: np.ndarray = tstamp
+        self.status: List[OrderStatus] = status
+        self.side: List[str] = side
+        self.amount: np.ndarray = amount
+        self.price: np.ndarray = price
+
+
+    @classmethod
+    def from_orders(cls, orders: Iterable[Union[Order, Mapping]]) -> "OrderBatch":
+        """Build a batch from `Order` records or from database rows."""
+        orders = [order if isinstance(order, (Order, SlottedOrder, FrozenOrder)) else Order(
+            order_id=order["order_id"],
+            product=order["product"],
+            tstamp=order["tstamp"],
+            status=OrderStatus[order["status"]],
+            side=order["side"],
+            amount=order["amount"],
+            price=order["price"]) for order in orders]
+        return cls(
+            order_id=[order.order_id for order in orders],
+            product=[order.product for order in orders],
+            tstamp=np.array([quantrt.util.cache.to_epoch_ns(order.tstamp) for order in orders], dtype=np.int64),
+            status=[order.status for order in orders],
+            side=[order.side for order in orders],
+            amount=np.array([order.amount for order in orders], dtype=np.float64),
+            price=np.array([order.price for order in orders], dtype=np.float64))
+
+
+    def __len__(self) -> int:
+        return len(self.order_id)
+
+
+    def __getitem__(self, i: int) -> FrozenOrder:
+        return FrozenOrder(
+            order_id=self.order_id[i],
+            product=self.product[i],
+            tstamp=quantrt.util.cache.from_epoch_ns(self.tstamp[i]),
+            status=self.status[i],
+            side=self.side[i],
+            amount=self.amount[i],
+            price=self.price[i])
+
+
+    def __iter__(self) -> Iterator[FrozenOrder]:
+        for i in range(len(self.order_id)):
+            yield self[i]
+
+
+    def rows(self) -> Iterator[Tuple]:
+        """The batch as `save_batch` parameter tuples."""
+        return zip(
+            self.order_id,
+            self.product,
+            [quantrt.util.cache.from_epoch_ns(tstamp) for tstamp in self.tstamp.tolist()],
+            [status.name for status in self.status],
+            self.side,
+            self.amount.tolist(),
+            self.price.tolist())
+
+
 async def save(order: Order, pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
@@ -75,7 +156,7 @@ async def save(order: Order, pool: Optional[asyncpg.Pool] = None):
             order.price))
 
 
-async def save_batch(orders: Iterable[Order], pool: Optional[asyncpg.Pool] = None):
+async def save_batch(orders: Union[Iterable[Order], OrderBatch], pool: Optional[asyncpg.Pool] = None):
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -99,6 +180,9 @@ async def save_batch(orders: Iterable[Order], pool: Optional[asyncpg.Pool] = Non
                 price = EXCLUDED.price
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
+        if isinstance(orders, OrderBatch):
+            await statement.executemany(orders.rows())
+            return
         await statement.executemany([(
             order.order_id,
             order.product,
@@ -132,7 +216,8 @@ async def fetch(id: str, pool: Optional[asyncpg.Pool] = None) -> Order:
     )
 
 
-async def fetch_batch(ids: Iterable[str], pool: Optional[asyncpg.Pool] = None) -> Iterable[Order]:
+async def fetch_batch(ids: Iterable[str], pool: Optional[asyncpg.Pool] = None,
+                      as_batch: bool = False) -> Union[Iterable[Order], OrderBatch]:
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -145,6 +230,8 @@ async def fetch_batch(ids: Iterable[str], pool: Optional[asyncpg.Pool] = None) -
         statement = await quantrt.util.database.prepare_sql(sql, conn)
         rows = [await statement.fetchrow(id) for order_id in ids]
 
+    if as_batch:
+        return OrderBatch.from_orders(rows)
     return [Order(
         order_id=row["order_id"],
         product=row["product"],
@@ -156,7 +243,8 @@ async def fetch_batch(ids: Iterable[str], pool: Optional[asyncpg.Pool] = None) -
     ) for row in rows]
 
 
-async def fetch_open(product_id: str, pool: Optional[asyncpg.Pool] = None) -> Iterable[Order]:
+async def fetch_open(product_id: str, pool: Optional[asyncpg.Pool] = None,
+                     as_batch: bool = False) -> Union[Iterable[Order], OrderBatch]:
     if not pool:
         pool = quantrt.common.config.db_conn_pool
     if not pool:
@@ -168,6 +256,8 @@ async def fetch_open(product_id: str, pool: Optional[asyncpg.Pool] = None) -> It
         """
         statement = await quantrt.util.database.prepare_sql(sql, conn)
         rows = await statement.fetch(product_id)
+    if as_batch:
+        return OrderBatch.from_orders(rows)
     return [Order(
         order_id=row["order_id"],
         product=row["product"],
@@ -1,15 +1,41 @@
+import logging
+import time
+
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.util.metrics
+
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
-from typing import Coroutine
+from typing import Any, Coroutine, Iterable, List, TYPE_CHECKING
+
+from quantrt.api.ws import ChannelType
+
+if TYPE_CHECKING:
+    from quantrt.common.types import Action
+    from quantrt.market.bus import EventBus, Topic
+    from quantrt.trading.engine import LiveOrder
+
 
+__all__ = ["Strategy", "STRATEGY_SECONDS"]
 
-__all__ = ["Strategy"]
 
+STRATEGY_SECONDS = quantrt.util.metrics.default_registry.histogram(
+    "quantrt_strategy_seconds", "Wall time of strategy scan, act and on_event calls.", ["strategy", "stage"])
 
-class Strategy(meta=ABCMeta):
+
+class Strategy(metaclass=ABCMeta):
     """A Strategy is run on realtime or backtest time input and a
     list of actionable products to determine actions to take.
     """
+    # The (channel, product) pairs of market data passed to `on_event` when running live.
+    topics: List["Topic"] = []
+    # What to do when events arrive faster than `on_event` handles them, one of `bus.POLICIES`.
+    policy: str = "conflate"
+    # The most events queued for the strategy, unless it conflates.
+    queue_size: int = 1024
+
+
     def __init__(self, name: str):
         self.name = name
 
@@ -28,3 +54,53 @@ class Strategy(meta=ABCMeta):
         :param tstamp: datetime - the time at which to run the strategy, may be live or backtest.
         """
         raise NotImplementedError()
+
+
+    async def on_event(self, channel: ChannelType, product: str, event: Any):
+        """Handle one market data event of `topics`.
+        :param channel: ChannelType - the channel of the event.
+        :param product: str - the product of the event.
+        :param event: Any - the product's `OrderBook` for level2, otherwise the decoded message.
+        """
+        pass
+
+
+    async def listen(self, bus: "EventBus"):
+        """Subscribe to `topics` and pass their events to `on_event` until cancelled.
+        An event whose `on_event` raises is logged and skipped, so the strategy keeps its market data.
+        """
+        subscriber = bus.subscribe(self.name, self.topics, self.queue_size, self.policy)
+        seconds = STRATEGY_SECONDS.labels(self.name, "on_event")
+        try:
+            async for channel, product, event in subscriber:
+                start = time.monotonic_ns()
+                try:
+                    await self.on_event(channel, product, event)
+                except Exception as err:
+                    quantrt.common.log.QuantrtLog.throttled(
+                        "strategy.on_event." + self.name, 1.0, logging.ERROR,
+                        "Strategy %s failed on a %s event of %s: %r", self.name, channel.value, product, err)
+                elapsed = time.monotonic_ns() - start
+                seconds.observe(elapsed / 1e9)
+                tracker = quantrt.common.config.latency
+                if tracker is not None:
+                    tracker.record("on_event", self.name, elapsed)
+        finally:
+            bus.unsubscribe(subscriber)
+
+
+    async def execute(self, actions: Iterable["Action"]) -> List["LiveOrder"]:
+        """Place the orders of `actions` through the live `config.execution_engine`.
+        :param actions: Iterable[Action] - the actions to carry out, `Nothing` is skipped.
+        :return: List[LiveOrder] - the tracked orders, in the order of `actions`.
+        """
+        engine = quantrt.common.config.execution_engine
+        if engine is None:
+            quantrt.common.log.QuantrtLog.exception("No execution engine has been configured.")
+            raise EnvironmentError("No execution engine has been configured.")
+        orders = []
+        for action in actions:
+            order = await engine.submit(action)
+            if order is not None:
+                orders.append(order)
+        return orders
@@ -0,0 +1,477 @@
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+
+import quantrt.api.rest
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.models.order
+import quantrt.util.time
+
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, ValuesView, TYPE_CHECKING
+
+from quantrt.api.codec import Match, RecentTrades, is_user_message
+from quantrt.common.types import *
+from quantrt.common.types import Action
+from quantrt.models.order import Order, OrderStatus
+
+if TYPE_CHECKING:
+    from quantrt.trading.risk import RiskEngine
+
+
+__all__ = ["OrderState", "LiveOrder", "ExecutionEngine"]
+
+
+class OrderState(Enum):
+    # Sent, not yet acknowledged by the exchange.
+    Pending = "pending"
+    # Resting on the book with nothing filled.
+    Open = "open"
+    PartiallyFilled = "partially_filled"
+    Filled = "filled"
+    Canceled = "canceled"
+    # Refused by the REST api.
+    Rejected = "rejected"
+
+
+""" States an order never leaves. """
+FINAL_STATES = {OrderState.Filled, OrderState.Canceled, OrderState.Rejected}
+
+
+class LiveOrder:
+    """The in-memory state of an order placed by the `ExecutionEngine`."""
+    __slots__ = ("client_oid", "order_id", "product", "side", "order_type", "price", "size", "stop", "stop_price",
+                 "filled", "executed_value", "state", "liquidity", "reason", "created", "updated")
+
+    def __init__(self, client_oid: str, product: str, side: str, order_type: str, size: Decimal,
+                 price: Optional[Decimal] = None, stop: Optional[str] = None, stop_price: Optional[Decimal] = None):
+        self.client_oid: str = client_oid
+        # the exchange order id, known once the order is acknowledged
+        self.order_id: Optional[str] = None
+        self.product: str = product
+        self.side: str = side
+        # `limit` or `market`
+        self.order_type: str = order_type
+        self.price: Optional[Decimal] = price
+        self.size: Decimal = size
+        self.stop: Optional[str] = stop
+        self.stop_price: Optional[Decimal] = stop_price
+        self.filled: Decimal = Decimal(0)
+        self.executed_value: Decimal = Decimal(0)
+        self.state: OrderState = OrderState.Pending
+        # `M` or `T` of the last fill
+        self.liquidity: Optional[str] = None
+        # the done reason or the rejection message
+        self.reason: Optional[str] = None
+        self.created: datetime.datetime = quantrt.util.time.now()
+        self.updated: datetime.datetime = self.created
+
+
+    def __repr__(self) -> str:
+        return "LiveOrder({} {} {} {} @ {} {}/{})".format(
+            self.client_oid, self.product, self.side, self.order_type, self.price, self.filled, self.size)
+
+
+    @property
+    def remaining(self) -> Decimal:
+        return self.size - self.filled
+
+
+    @property
+    def is_open(self) -> bool:
+        return self.state not in FINAL_STATES
+
+
+    def to_order(self) -> Order:
+        """The order as a `models.order.Order` row."""
+        if self.state is OrderState.Canceled or self.state is OrderState.Rejected:
+            status = OrderStatus.Canceled
+        elif self.state is OrderState.Filled:
+            status = OrderStatus.Taker if self.liquidity == "T" else OrderStatus.Maker
+        else:
+            status = OrderStatus.Open
+        return Order(
+            order_id=self.order_id,
+            product=self.product,
+            tstamp=self.updated,
+            status=status,
+            side=self.side,
+            amount=self.size,
+            price=self.price if self.price is not None else Decimal(0))
+
+
+class ExecutionEngine:
+    """Places orders for `Action`s and tracks them in memory from the user channel.
+
+    Every order gets a `client_oid` before it is sent, so it is tracked from the moment it is
+    submitted. Messages of the user channel drive each order through
+    pending -> open -> partially filled -> filled or canceled. Open orders are indexed by product
+    and net filled positions are kept per product, so both are O(1) to query. Orders are
+    persisted by a background task in batches rather than on the order path.
+    :param exchange: What orders are placed, canceled and listed with. Defaults to `api.rest`,
+        a `SimulatedExchange` in backtests.
+    :param persist_interval: Seconds between writes of changed orders to the database. None to not persist.
+    :param risk: Checks every order before it is sent. Orders it rejects are never sent.
+    """
+
+    def __init__(self, exchange: Any = None, persist_interval: Optional[float] = 1.0,
+                 risk: Optional["RiskEngine"] = None):
+        self.exchange: Any = exchange if exchange is not None else quantrt.api.rest
+        self.risk: Optional["RiskEngine"] = risk
+        self.orders: Dict[str, LiveOrder] = {}
+        self.persist_interval: Optional[float] = persist_interval
+        # exchange order id -> order
+        self._by_order_id: Dict[str, LiveOrder] = {}
+        # product -> client_oid -> open order
+        self._open: Dict[str, Dict[str, LiveOrder]] = {}
+        # product -> net filled base size, positive when long
+        self._positions: Dict[str, Decimal] = {}
+        # (product, side) -> unfilled size of the open orders
+        self._open_size: Dict[Tuple[str, str], Decimal] = {}
+        # changed orders waiting to be persisted, by client_oid
+        self._dirty: Dict[str, LiveOrder] = {}
+        self._persist_task: Optional[asyncio.Task] = None
+        # fills already applied, the same match can be delivered more than once
+        self._trades: RecentTrades = RecentTrades()
+
+
+    def get(self, client_oid: str) -> Optional[LiveOrder]:
+        return self.orders.get(client_oid)
+
+
+    def by_order_id(self, order_id: str) -> Optional[LiveOrder]:
+        return self._by_order_id.get(order_id)
+
+
+    def open_orders(self, product: str) -> ValuesView[LiveOrder]:
+        """A live view of the open orders of a product."""
+        return self._open.setdefault(product, {}).values()
+
+
+    def position(self, product: str) -> Decimal:
+        """The net base size filled through this engine, positive when long."""
+        return self._positions.get(product, Decimal(0))
+
+
+    def open_size(self, product: str, side: str) -> Decimal:
+        """The unfilled size of the open orders of a product on one side."""
+        return self._open_size.get((product, side), Decimal(0))
+
+
+    def order_for(self, action: Action) -> Optional[LiveOrder]:
+        """The order that carries out an action, not yet submitted. None for `Nothing`."""
+        client_oid = str(uuid.uuid4())
+        kind = type(action)
+        if kind is MarketBuy or kind is MarketSell:
+            return LiveOrder(client_oid, action.product, "buy" if kind is MarketBuy else "sell", "market",
+                             Decimal(action.amount))
+        if kind is LimitBuy or kind is LimitSell:
+            return LiveOrder(client_oid, action.product, "buy" if kind is LimitBuy else "sell", "limit",
+                             Decimal(action.amount), Decimal(action.price))
+        if kind is StopLimitBuy or kind is StopLimitSell:
+            # a stop buy triggers as the price rises to the stop, a stop sell as it falls
+            return LiveOrder(client_oid, action.product, "buy" if kind is StopLimitBuy else "sell", "limit",
+                             Decimal(action.amount), Decimal(action.price),
+                             "entry" if kind is StopLimitBuy else "loss", Decimal(action.stop))
+        return None
+
+
+    async def submit(self, action: Action) -> Optional[LiveOrder]:
+        """Place the order for an action.
+        :return: The tracked order, `Rejected` if the REST api refused it. None for `Nothing`.
+        """
+        orders = await self.submit_batch([action])
+        return orders[0] if orders else None
+
+
+    async def submit_batch(self, actions: Iterable[Action]) -> List[LiveOrder]:
+        """Place the orders for many actions at once. The requests are in flight together, so
+        the batch takes about one round trip within the REST rate limits rather than one each.
+        :return: The tracked orders in the order of `actions`, `Rejected` ones refused by the risk
+            checks or the REST api. `Nothing` actions are skipped.
+        """
+        tracker = quantrt.common.config.latency
+        start = time.monotonic_ns() if tracker is not None else 0
+        orders = [order for order in map(self.order_for, actions) if order is not None]
+        sent = []
+        for order in orders:
+            if self.risk is None:
+                rule = None
+            elif tracker is None:
+                rule = self.risk.check(order, self)
+            else:
+                checked = time.monotonic_ns()
+                rule = self.risk.check(order, self)
+                tracker.record("risk", order.product, time.monotonic_ns() - checked)
+            # each order is tracked before the next is checked, so it counts toward the limits
+            self._track(order)
+            if rule is not None:
+                self._finish(order, OrderState.Rejected, "risk: {}".format(rule))
+            else:
+                sent.append(order)
+        params = [self._params(order) for order in sent]
+        placed = time.monotonic_ns() if tracker is not None else 0
+        responses = await self.exchange.place_orders(params)
+        if tracker is not None:
+            self._record_latency(tracker, sent, start, placed, time.monotonic_ns())
+        for order, response in zip(sent, responses):
+            if isinstance(response, Exception):
+                quantrt.common.log.QuantrtLog.throttled(
+                    "order-rejected", 1.0, logging.WARNING, "Order %s was rejected: %s", order.client_oid, response)
+                self._finish(order, OrderState.Rejected, str(response))
+            else:
+                self._acknowledge(order, response)
+        return orders
+
+
+    async def cancel(self, client_oid: str) -> bool:
+        """Request the cancel of an order. The order is marked canceled by its `done` message.
+        :return: False if the order is unknown, already done, or the request failed.
+        """
+        return (await self.cancel_batch([client_oid]))[client_oid]
+
+
+    async def cancel_batch(self, client_oids: Iterable[str]) -> Dict[str, bool]:
+        """Request the cancel of many orders at once. Where the orders are every open order of a
+        product, the product's orders are canceled with one request.
+        :return: For each client_oid, False if the order is unknown, already done, or the request failed.
+        """
+        results = {client_oid: False for client_oid in client_oids}
+        by_product: Dict[str, List[LiveOrder]] = {}
+        for client_oid in results:
+            order = self.orders.get(client_oid)
+            if order is not None and order.is_open and order.order_id is not None:
+                by_product.setdefault(order.product, []).append(order)
+
+        whole, single = [], []
+        for product, orders in by_product.items():
+            if len(orders) > 1 and len(orders) == len(self._open.get(product, ())):
+                whole.append(product)
+            else:
+                single.extend(orders)
+        product_responses, order_responses = await asyncio.gather(
+            self.exchange.cancel_products(whole),
+            self.exchange.cancel_orders([order.order_id for order in single]))
+
+        for product, response in zip(whole, product_responses):
+            if isinstance(response, Exception):
+                quantrt.common.log.QuantrtLog.warning("Cancel of the orders of %s failed: %s", product, response)
+                continue
+            for order in by_product[product]:
+                results[order.client_oid] = True
+        for order, response in zip(single, order_responses):
+            if isinstance(response, Exception):
+                quantrt.common.log.QuantrtLog.throttled(
+                    "cancel-failed", 1.0, logging.WARNING, "Cancel of order %s failed: %s", order.client_oid, response)
+                continue
+            results[order.client_oid] = True
+        return results
+
+
+    async def requote(self, actions: Iterable[Action],
+                      products: Optional[Iterable[str]] = None) -> List[LiveOrder]:
+        """Replace the open orders of products with new ones, canceling and placing in the same
+        round trip. Cancels go out by order id, since a cancel of a whole product could race the
+        new orders and cancel them too.
+        :param actions: The new orders.
+        The orders being canceled are left out of `open_orders` and `open_size` from the start, so
+        the risk checks of the new orders do not count the orders they replace. An order whose
+        cancel fails is put back.
+        :param products: The products whose open orders are canceled. Defaults to the products of the new orders.
+        :return: The new tracked orders.
+        """
+        actions = list(actions)
+        if products is None:
+            products = {action.product for action in actions if type(action) is not Nothing}
+        stale = [order for product in products for order in list(self.open_orders(product))
+                 if order.order_id is not None]
+        for order in stale:
+            self._untrack_open(order)
+        orders, responses = await asyncio.gather(
+            self.submit_batch(actions), self.exchange.cancel_orders([order.order_id for order in stale]))
+        for order, response in zip(stale, responses):
+            if isinstance(response, Exception):
+                quantrt.common.log.QuantrtLog.throttled(
+                    "cancel-failed", 1.0, logging.WARNING, "Cancel of order %s failed: %s", order.client_oid, response)
+                if order.is_open:
+                    self._open.setdefault(order.product, {})[order.client_oid] = order
+                    self._add_open_size(order, max(order.remaining, Decimal(0)))
+        return orders
+
+
+    async def sync(self):
+        """Load the account's open orders from the REST api, e.g. after a restart."""
+        for row in await self.exchange.get_orders(status=["open", "pending", "active"]):
+            if row["id"] in self._by_order_id:
+                continue
+            order = LiveOrder(row.get("client_oid") or str(uuid.uuid4()), row["product_id"], row["side"],
+                              row["type"], Decimal(row.get("size") or 0),
+                              Decimal(row["price"]) if row.get("price") is not None else None)
+            order.filled = Decimal(row.get("filled_size") or 0)
+            self._track(order)
+            self._acknowledge(order, row)
+            if order.filled:
+                order.state = OrderState.PartiallyFilled
+
+
+    def attach(self, feed) -> "ExecutionEngine":
+        """Drive the orders from the user channel messages of a `FeedManager` or `SimulatedExchange`."""
+        feed.on_message(self.on_message)
+        return self
+
+
+    def on_message(self, message: Union[Dict, Match]):
+        """Apply a user channel message to the order it concerns.
+        Fills are only taken from the user channel, since the matches and full channels carry
+        the same trades without marking them as the user's.
+        """
+        if type(message) is not dict:
+            return
+        kind = message.get("type")
+        if kind == "match":
+            if not is_user_message(message) or not self._trades.add(message["product_id"], message["trade_id"]):
+                return
+            self._on_match(message["maker_order_id"], message["taker_order_id"], message["product_id"],
+                           Decimal(message["price"]), Decimal(message["size"]))
+            return
+        order = self._by_order_id.get(message.get("order_id"))
+        if order is None and kind == "received":
+            order = self.orders.get(message.get("client_oid"))
+            if order is not None and order.order_id is None:
+                order.order_id = message["order_id"]
+                self._by_order_id[order.order_id] = order
+        if order is None:
+            return
+        if kind == "open":
+            if order.state is OrderState.Pending:
+                self._set_state(order, OrderState.Open)
+        elif kind == "done":
+            self._finish(order, OrderState.Filled if message.get("reason") == "filled" else OrderState.Canceled,
+                         message.get("reason"))
+        elif kind == "change" and message.get("new_size") is not None:
+            remaining = order.remaining
+            order.size = Decimal(message["new_size"]) + order.filled
+            if self._is_tracked_open(order):
+                self._add_open_size(order, order.remaining - remaining)
+            self._set_state(order, order.state)
+
+
+    def start(self):
+        """Start persisting changed orders in the background."""
+        if self.persist_interval is not None and self._persist_task is None:
+            self._persist_task = asyncio.get_event_loop().create_task(self._persist_loop())
+
+
+    async def stop(self):
+        """Stop the background task and persist what is left."""
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            self._persist_task = None
+        if self.persist_interval is not None:
+            await self.persist()
+
+
+    async def persist(self):
+        """Write the orders changed since the last call to the database."""
+        orders = [order.to_order() for order in self._dirty.values() if order.order_id is not None]
+        # orders without an exchange id wait for it, unless they were never accepted
+        self._dirty = {client_oid: order for client_oid, order in self._dirty.items()
+                       if order.order_id is None and order.is_open}
+        if orders:
+            await quantrt.models.order.save_batch(orders)
+
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                await self.persist()
+            except Exception as err:
+                quantrt.common.log.QuantrtLog.exception("Persisting orders failed: %s", err)
+
+
+    @staticmethod
+    def _record_latency(tracker, orders: List[LiveOrder], start: int, placed: int, acknowledged: int):
+        for order in orders:
+            tracker.record("send", order.product, placed - start)
+            tracker.record("ack", order.product, acknowledged - placed)
+            mark = tracker.marks.get(order.product)
+            if mark is not None:
+                tracker.record("tick_to_trade", order.product, acknowledged - mark)
+
+
+    @staticmethod
+    def _params(order: LiveOrder) -> Dict:
+        """The keyword arguments of `rest.place_order` for an order."""
+        params = {"product_id": order.product, "side": order.side, "order_type": order.order_type,
+                  "size": order.size, "client_oid": order.client_oid}
+        if order.price is not None:
+            params["price"] = order.price
+        if order.stop is not None:
+            params["stop"] = order.stop
+            params["stop_price"] = order.stop_price
+        return params
+
+
+    def _track(self, order: LiveOrder):
+        self.orders[order.client_oid] = order
+        self._open.setdefault(order.product, {})[order.client_oid] = order
+        self._add_open_size(order, order.remaining)
+
+
+    def _is_tracked_open(self, order: LiveOrder) -> bool:
+        """Whether the order counts toward `open_orders` and `open_size`, i.e. is open and not being canceled."""
+        return order.client_oid in self._open.get(order.product, ())
+
+
+    def _untrack_open(self, order: LiveOrder):
+        if self._open.get(order.product, {}).pop(order.client_oid, None) is not None:
+            self._add_open_size(order, -max(order.remaining, Decimal(0)))
+
+
+    def _add_open_size(self, order: LiveOrder, size: Decimal):
+        key = (order.product, order.side)
+        self._open_size[key] = self._open_size.get(key, Decimal(0)) + size
+
+
+    def _acknowledge(self, order: LiveOrder, response: Dict):
+        if order.order_id is None and response.get("id"):
+            order.order_id = response["id"]
+            self._by_order_id[order.order_id] = order
+        if response.get("status") == "rejected":
+            self._finish(order, OrderState.Rejected, response.get("reject_reason"))
+        elif response.get("status") in ("open", "active") and order.state is OrderState.Pending:
+            self._set_state(order, OrderState.Open)
+        else:
+            self._dirty[order.client_oid] = order
+
+
+    def _on_match(self, maker_order_id: str, taker_order_id: str, product: str, price: Decimal, size: Decimal):
+        for order_id, liquidity in ((maker_order_id, "M"), (taker_order_id, "T")):
+            order = self._by_order_id.get(order_id)
+            if order is None:
+                continue
+            if self._is_tracked_open(order):
+                self._add_open_size(order, -min(size, max(order.remaining, Decimal(0))))
+            order.filled += size
+            order.executed_value += price * size
+            order.liquidity = liquidity
+            self._positions[product] = self.position(product) + (size if order.side == "buy" else -size)
+            if order.state is not OrderState.Filled:
+                self._set_state(order, OrderState.PartiallyFilled)
+
+
+    def _set_state(self, order: LiveOrder, state: OrderState):
+        order.state = state
+        order.updated = quantrt.util.time.now()
+        self._dirty[order.client_oid] = order
+
+
+    def _finish(self, order: LiveOrder, state: OrderState, reason: Optional[str]):
+        order.reason = reason
+        self._set_state(order, state)
+        self._untrack_open(order)
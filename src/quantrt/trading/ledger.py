@@ -0,0 +1,203 @@
+import asyncio
+
+import quantrt.api.rest
+import quantrt.common.config
+import quantrt.common.log
+
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from quantrt.api.codec import Match, RecentTrades, is_user_message
+
+
+__all__ = ["Ledger"]
+
+
+class Ledger:
+    """Balances, holds and positions kept in memory from fills and holds of the user channel.
+
+    The ledger is seeded with one `get_accounts` call. Afterwards each `received` message of an
+    own order puts its funds on hold, each `match` moves the filled funds and fee between the
+    product's currencies and releases the matching hold, and each `done` releases what is left
+    on hold. Balances, available funds and positions are dict lookups. A background task
+    reconciles the ledger with `get_accounts` and reports, then corrects, any drift, such as
+    fills of orders placed before the ledger was seeded.
+    :param exchange: What `get_accounts` and `get_fees` are called on. Defaults to `api.rest`,
+        a `SimulatedExchange` in backtests.
+    :param reconcile_interval: Seconds between reconciles. None to not reconcile in the background.
+    :param tolerance: The smallest difference reported as drift.
+    """
+
+    def __init__(self, exchange: Any = None, reconcile_interval: Optional[float] = 60.0,
+                 tolerance: Decimal = Decimal("1e-8")):
+        self.exchange: Any = exchange if exchange is not None else quantrt.api.rest
+        self.reconcile_interval: Optional[float] = reconcile_interval
+        self.tolerance: Decimal = tolerance
+        self.balances: Dict[str, Decimal] = {}
+        self.holds: Dict[str, Decimal] = {}
+        self.maker_fee_rate: Decimal = Decimal(0)
+        self.taker_fee_rate: Decimal = Decimal(0)
+        # currency -> balance on the exchange minus the ledger's balance, at the last reconcile with drift
+        self.drift: Dict[str, Decimal] = {}
+        self.reconciles: int = 0
+        # order id -> [held currency, amount still held, side, amount held per unit of size of a limit buy]
+        self._orders: Dict[str, List] = {}
+        # product -> (base, quote)
+        self._currencies: Dict[str, Tuple[str, str]] = {}
+        self._reconcile_task: Optional[asyncio.Task] = None
+        # fills already applied, the same match can be delivered more than once
+        self._trades: RecentTrades = RecentTrades()
+
+
+    def balance(self, currency: str) -> Decimal:
+        return self.balances.get(currency, Decimal(0))
+
+
+    def hold(self, currency: str) -> Decimal:
+        return self.holds.get(currency, Decimal(0))
+
+
+    def available(self, currency: str) -> Decimal:
+        """The balance not on hold for open orders."""
+        return self.balances.get(currency, Decimal(0)) - self.holds.get(currency, Decimal(0))
+
+
+    def position(self, product: str) -> Decimal:
+        """The balance of the product's base currency."""
+        return self.balances.get(self.currencies(product)[0], Decimal(0))
+
+
+    def currencies(self, product: str) -> Tuple[str, str]:
+        """The (base, quote) currencies of a product."""
+        pair = self._currencies.get(product)
+        if pair is None:
+            base, quote = product.split("-")
+            pair = self._currencies[product] = (base, quote)
+        return pair
+
+
+    async def load(self):
+        """Seed the balances from `get_accounts` and the fee rates from `get_fees`."""
+        fees, accounts = await asyncio.gather(self.exchange.get_fees(), self.exchange.get_accounts())
+        self.maker_fee_rate = Decimal(fees["maker_fee_rate"])
+        self.taker_fee_rate = Decimal(fees["taker_fee_rate"])
+        self.seed(accounts)
+
+
+    def seed(self, accounts: Iterable[Mapping]):
+        """Set the balances and holds from `get_accounts` rows."""
+        for account in accounts:
+            self.balances[account["currency"]] = Decimal(account["balance"])
+            self.holds[account["currency"]] = Decimal(account["hold"])
+
+
+    def attach(self, feed) -> "Ledger":
+        """Apply the user channel messages of a `FeedManager` or `SimulatedExchange`."""
+        feed.on_message(self.on_message)
+        return self
+
+
+    def on_message(self, message: Union[Dict, Match]):
+        """Apply a user channel message to the balances.
+        Fills are only taken from the user channel, whose matches also carry the fee rate.
+        """
+        if type(message) is not dict:
+            return
+        kind = message.get("type")
+        if kind == "match":
+            if not is_user_message(message) or not self._trades.add(message["product_id"], message["trade_id"]):
+                return
+            fee_rate = message.get("maker_fee_rate") or message.get("taker_fee_rate")
+            self._on_match(message["maker_order_id"], message["taker_order_id"], message["product_id"],
+                           Decimal(message["price"]), Decimal(message["size"]),
+                           Decimal(fee_rate) if fee_rate is not None else None)
+        elif kind == "received" and "user_id" in message:
+            self._on_received(message)
+        elif kind == "done":
+            held = self._orders.pop(message.get("order_id"), None)
+            if held is not None:
+                self.holds[held[0]] = self.hold(held[0]) - held[1]
+
+
+    def start(self):
+        """Start reconciling with the exchange in the background."""
+        if self.reconcile_interval is not None and self._reconcile_task is None:
+            self._reconcile_task = asyncio.get_event_loop().create_task(self._reconcile_loop())
+
+
+    def stop(self):
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+
+
+    async def reconcile(self) -> Dict[str, Decimal]:
+        """Compare the balances with `get_accounts`, log any drift and take the exchange's values.
+        Fills applied while the request is in flight can show up as drift that corrects itself.
+        :return: The drift of each currency that differs, the exchange's balance minus the ledger's.
+        """
+        accounts = await self.exchange.get_accounts()
+        drift = {}
+        for account in accounts:
+            currency = account["currency"]
+            difference = Decimal(account["balance"]) - self.balance(currency)
+            if abs(difference) > self.tolerance or abs(Decimal(account["hold"]) - self.hold(currency)) > self.tolerance:
+                drift[currency] = difference
+        if drift:
+            quantrt.common.log.QuantrtLog.warning("Ledger drifted from the exchange: %s", drift)
+            self.drift = drift
+        self.seed(accounts)
+        self.reconciles += 1
+        return drift
+
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as err:
+                quantrt.common.log.QuantrtLog.exception("Reconciling the ledger failed: %s", err)
+
+
+    def _on_received(self, message: Dict):
+        base, quote = self.currencies(message["product_id"])
+        side = message["side"]
+        price = Decimal(message["price"]) if message.get("price") is not None else None
+        if side == "buy":
+            unit = None
+            if price is not None and message.get("size") is not None:
+                # the exchange holds the taker fee on top of the value of a limit buy
+                unit = price * (1 + self.taker_fee_rate)
+                amount = unit * Decimal(message["size"])
+            elif message.get("funds") is not None:
+                amount = Decimal(message["funds"])
+            else:
+                amount = Decimal(0)
+            held = [quote, amount, side, unit]
+        else:
+            held = [base, Decimal(message.get("size") or 0), side, None]
+        self._orders[message["order_id"]] = held
+        self.holds[held[0]] = self.hold(held[0]) + held[1]
+
+
+    def _on_match(self, maker_order_id: str, taker_order_id: str, product: str, price: Decimal, size: Decimal,
+                  fee_rate: Optional[Decimal]):
+        for order_id, maker in ((maker_order_id, True), (taker_order_id, False)):
+            held = self._orders.get(order_id)
+            if held is None:
+                continue
+            base, quote = self.currencies(product)
+            value = price * size
+            fee = value * (fee_rate if fee_rate is not None else self.maker_fee_rate if maker else self.taker_fee_rate)
+            if held[2] == "buy":
+                release = held[3] * size if held[3] is not None else value + fee
+                self.balances[quote] = self.balance(quote) - value - fee
+                self.balances[base] = self.balance(base) + size
+            else:
+                release = size
+                self.balances[base] = self.balance(base) - size
+                self.balances[quote] = self.balance(quote) + value - fee
+            release = min(release, held[1])
+            held[1] -= release
+            self.holds[held[0]] = self.hold(held[0]) - release
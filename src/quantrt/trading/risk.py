@@ -0,0 +1,140 @@
+import time
+
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Dict, Mapping, Optional, TYPE_CHECKING
+
+from quantrt.market.book import OrderBook
+
+if TYPE_CHECKING:
+    from quantrt.trading.engine import ExecutionEngine, LiveOrder
+    from quantrt.trading.ledger import Ledger
+
+
+__all__ = ["RISK_RULES", "RiskLimits", "RiskEngine", "load_limits"]
+
+
+""" The rules an order can be rejected by, in the order they are checked. """
+RISK_RULES = ("order_rate", "price_band", "notional", "position", "self_trade")
+
+
+@dataclass
+class RiskLimits:
+    # The largest absolute base position, counting open orders on the side that grows it.
+    max_position: Optional[Decimal] = None
+    # The largest quote value of one order.
+    max_notional: Optional[Decimal] = None
+    # The furthest a limit price may be from the reference price, as a fraction of it.
+    price_band: Optional[Decimal] = None
+    # Orders per second, with bursts of up to this many orders.
+    max_order_rate: Optional[float] = None
+    # Whether to reject orders that would cross an own open order.
+    prevent_self_trade: bool = True
+
+
+def load_limits(limits: Mapping[str, Mapping]) -> Dict[str, RiskLimits]:
+    """Build the limits of each product from e.g. a json object of product -> field -> value."""
+    return {product: RiskLimits(
+        max_position=Decimal(fields["max_position"]) if fields.get("max_position") is not None else None,
+        max_notional=Decimal(fields["max_notional"]) if fields.get("max_notional") is not None else None,
+        price_band=Decimal(fields["price_band"]) if fields.get("price_band") is not None else None,
+        max_order_rate=float(fields["max_order_rate"]) if fields.get("max_order_rate") is not None else None,
+        prevent_self_trade=bool(fields.get("prevent_self_trade", True))) for product, fields in limits.items()}
+
+
+class RiskEngine:
+    """Pre-trade checks run on every order before the `ExecutionEngine` sends it.
+
+    Every check is a few comparisons against limits, the ledger's position, the engine's open
+    order totals and the best prices of the order book, so no check waits on the database or
+    the network and the same checks run live and in backtests. Rejections are counted by rule.
+    :param limits: The limits of each product.
+    :param default: The limits of products without their own. No limits by default.
+    :param ledger: Where positions are read from. Defaults to the engine's filled positions.
+    :param books: The order books the reference price is the mid of, e.g. `FeedManager.books`.
+    :param last_price: Reference prices of products without a two sided book, e.g. `SimulatedExchange.last_price`.
+    :param clock: Seconds, for the order rate. Defaults to `time.monotonic`.
+    """
+
+    def __init__(self, limits: Optional[Mapping[str, RiskLimits]] = None, default: Optional[RiskLimits] = None,
+                 ledger: Optional["Ledger"] = None, books: Optional[Mapping[str, OrderBook]] = None,
+                 last_price: Optional[Mapping[str, Decimal]] = None, clock: Callable[[], float] = time.monotonic):
+        self.limits: Dict[str, RiskLimits] = dict(limits or {})
+        self.default: RiskLimits = default or RiskLimits()
+        self.ledger: Optional["Ledger"] = ledger
+        self.books: Mapping[str, OrderBook] = books if books is not None else {}
+        self.last_price: Mapping[str, Decimal] = last_price if last_price is not None else {}
+        self.clock: Callable[[], float] = clock
+        self.checked: int = 0
+        self.rejections: Dict[str, int] = {rule: 0 for rule in RISK_RULES}
+        # product -> [tokens, time of the last refill]
+        self._buckets: Dict[str, list] = {}
+
+
+    def reference_price(self, product: str) -> Optional[Decimal]:
+        """The mid of the product's book, or its last price."""
+        book = self.books.get(product)
+        if book is not None:
+            bid, ask = book.best_bid, book.best_ask
+            if bid is not None and ask is not None:
+                return book.scale.price.from_ticks(bid[0] + ask[0]) / 2
+        return self.last_price.get(product)
+
+
+    def check(self, order: "LiveOrder", engine: "ExecutionEngine") -> Optional[str]:
+        """Check an order that is about to be sent.
+        :return: The rule the order breaks, None if it passes.
+        """
+        self.checked += 1
+        rule = self._check(order, engine)
+        if rule is not None:
+            self.rejections[rule] += 1
+        return rule
+
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.rejections, checked=self.checked)
+
+
+    def _check(self, order: "LiveOrder", engine: "ExecutionEngine") -> Optional[str]:
+        limits = self.limits.get(order.product, self.default)
+        product = order.product
+        buy = order.side == "buy"
+
+        if limits.max_order_rate is not None:
+            now = self.clock()
+            bucket = self._buckets.get(product)
+            if bucket is None:
+                bucket = self._buckets[product] = [limits.max_order_rate, now]
+            bucket[0] = min(limits.max_order_rate, bucket[0] + (now - bucket[1]) * limits.max_order_rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return "order_rate"
+            bucket[0] -= 1
+
+        price = order.price
+        if limits.max_notional is not None or limits.price_band is not None and price is not None:
+            reference = self.reference_price(product)
+            if limits.price_band is not None and price is not None and reference is not None \
+                    and abs(price - reference) > limits.price_band * reference:
+                return "price_band"
+            value_price = price if price is not None else reference
+            if limits.max_notional is not None and value_price is not None \
+                    and value_price * order.size > limits.max_notional:
+                return "notional"
+
+        if limits.max_position is not None:
+            position = self.ledger.position(product) if self.ledger is not None else engine.position(product)
+            if buy and position + engine.open_size(product, "buy") + order.size > limits.max_position:
+                return "position"
+            if not buy and position - engine.open_size(product, "sell") - order.size < -limits.max_position:
+                return "position"
+
+        if limits.prevent_self_trade:
+            # own open orders of a product are few, so they are scanned rather than indexed
+            for other in engine.open_orders(product):
+                if other.side == order.side or other.price is None or other.stop is not None:
+                    continue
+                if price is None or (price >= other.price if buy else price <= other.price):
+                    return "self_trade"
+        return None
@@ -0,0 +1,294 @@
+import datetime
+import itertools
+import uuid
+
+import quantrt.models.candle
+import quantrt.util.time
+
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Union
+
+from quantrt.common.timescale import Timescale
+from quantrt.models.candle import Candle
+
+
+__all__ = ["SimulatedExchange"]
+
+
+class SimulatedExchange:
+    """A matching engine for backtests that stands in for the REST api and the user channel.
+
+    It has the `place_orders`, `cancel_orders`, `cancel_products`, `get_orders`, `get_accounts`
+    and `get_fees` coroutines of `api.rest`, so an `ExecutionEngine` or `Ledger` given it as their
+    exchange runs unchanged, and it emits the user channel messages of the orders to the
+    callbacks registered with `on_message`, like a `FeedManager`.
+    Orders are matched against candles: a resting limit order fills completely at its price as
+    a maker once a candle trades through it, a stop order triggers once a candle reaches its
+    stop, and market orders, or limit orders that cross the last price, fill at the last price
+    as a taker. Funds are held for open orders and checked when an order is placed.
+    :param balances: The starting balance of each currency.
+    :param maker_fee_rate: The fee rate of maker fills.
+    :param taker_fee_rate: The fee rate of taker fills.
+    """
+
+    def __init__(self, balances: Mapping[str, Union[Decimal, str, int]],
+                 maker_fee_rate: Decimal = Decimal("0.005"), taker_fee_rate: Decimal = Decimal("0.005")):
+        self.maker_fee_rate: Decimal = Decimal(maker_fee_rate)
+        self.taker_fee_rate: Decimal = Decimal(taker_fee_rate)
+        self.profile_id: str = "simulated"
+        # currency -> account dict as returned by `get_accounts`
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        for currency, balance in balances.items():
+            self._account(currency)["balance"] = Decimal(balance)
+        # order id -> order dict as returned by `get_orders`, for orders not yet done
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        # product -> price of the latest candle close or fill
+        self.last_price: Dict[str, Decimal] = {}
+        self._callbacks: List[Callable[[Dict], Any]] = []
+        self._sequence = itertools.count(1)
+        self._trade_id = itertools.count(1)
+
+
+    def on_message(self, callback: Callable[[Dict], Any]) -> Callable[[Dict], Any]:
+        """Register a callback for the user channel messages of the simulated orders."""
+        self._callbacks.append(callback)
+        return callback
+
+
+    def place_order(self, product_id: str, side: str, order_type: str, size: Optional[Decimal] = None,
+                    price: Optional[Decimal] = None, funds: Optional[Decimal] = None, stop: Optional[str] = None,
+                    stop_price: Optional[Decimal] = None, client_oid: Optional[str] = None, **kwargs) -> Dict:
+        """Place an order, filling it at once if it is marketable.
+        :raises ValueError: If the order is malformed or the account has insufficient funds.
+        """
+        base, quote = product_id.split("-")
+        size = Decimal(size) if size is not None else None
+        price = Decimal(price) if price is not None else None
+        funds = Decimal(funds) if funds is not None else None
+        if order_type == "limit" and (size is None or price is None):
+            raise ValueError("A limit order needs a size and a price.")
+        if order_type == "market" and size is None and funds is None:
+            raise ValueError("A market order needs a size or funds.")
+
+        if side == "buy":
+            currency = quote
+            if order_type == "limit":
+                # like the exchange, a limit buy holds the taker fee on top of its value
+                hold = price * size * (1 + self.taker_fee_rate)
+            else:
+                hold = funds if funds is not None else size * self.last_price.get(product_id, Decimal(0))
+        else:
+            currency, hold = base, size
+        account = self._account(currency)
+        if account["balance"] - account["hold"] < hold:
+            raise ValueError("Insufficient funds.")
+        account["hold"] += hold
+
+        order = {
+            "id": str(uuid.uuid4()),
+            "client_oid": client_oid,
+            "product_id": product_id,
+            "side": side,
+            "type": order_type,
+            "size": size,
+            "price": price,
+            "funds": funds,
+            "stop": stop,
+            "stop_price": Decimal(stop_price) if stop_price is not None else None,
+            "filled_size": Decimal(0),
+            "hold": hold,
+            "status": "pending",
+            "created_at": quantrt.util.time.now(),
+        }
+        self.orders[order["id"]] = order
+        self._emit(order, "received", client_oid=client_oid, order_type=order_type, size=size, price=price,
+                   funds=funds)
+        if stop is None:
+            self._activate(order)
+        else:
+            order["status"] = "active"
+        return dict(order)
+
+
+    async def place_orders(self, orders: Iterable[Dict]) -> List[Union[Dict, Exception]]:
+        """Place many orders, like `rest.place_orders`."""
+        results = []
+        for order in orders:
+            try:
+                results.append(self.place_order(**order))
+            except ValueError as err:
+                results.append(err)
+        return results
+
+
+    def cancel_order(self, order_id: str) -> List[str]:
+        """Cancel an open order.
+        :raises ValueError: If the order is not open.
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            raise ValueError("Order {} is not open.".format(order_id))
+        self._done(order, "canceled")
+        return [order_id]
+
+
+    def cancel_all(self, product_id: Optional[str] = None) -> List[str]:
+        """Cancel every open order, or those of one product."""
+        canceled = [order_id for order_id, order in self.orders.items()
+                    if product_id is None or order["product_id"] == product_id]
+        for order_id in canceled:
+            self._done(self.orders[order_id], "canceled")
+        return canceled
+
+
+    async def cancel_orders(self, order_ids: Iterable[str]) -> List[Union[List[str], Exception]]:
+        """Cancel many orders, like `rest.cancel_orders`."""
+        results = []
+        for order_id in order_ids:
+            try:
+                results.append(self.cancel_order(order_id))
+            except ValueError as err:
+                results.append(err)
+        return results
+
+
+    async def cancel_products(self, product_ids: Iterable[str]) -> List[List[str]]:
+        """Cancel every open order of many products, like `rest.cancel_products`."""
+        return [self.cancel_all(product_id) for product_id in product_ids]
+
+
+    async def get_orders(self, product_id: Optional[str] = None, status: Optional[Union[str, List[str]]] = None,
+                         **kwargs) -> List[Dict]:
+        if isinstance(status, str):
+            status = [status]
+        return [dict(order) for order in self.orders.values()
+                if (product_id is None or order["product_id"] == product_id)
+                and (status is None or "all" in status or order["status"] in status)]
+
+
+    async def get_accounts(self) -> List[Dict]:
+        return [dict(account, available=account["balance"] - account["hold"]) for account in self.accounts.values()]
+
+
+    async def get_fees(self) -> Dict:
+        return {"maker_fee_rate": self.maker_fee_rate, "taker_fee_rate": self.taker_fee_rate}
+
+
+    def match_candle(self, candle: Candle):
+        """Trigger and fill the open orders of the candle's product that the candle trades through."""
+        product = candle.product
+        low, high = Decimal(candle.low), Decimal(candle.high)
+        for order in [order for order in self.orders.values() if order["product_id"] == product]:
+            if order["status"] == "active":
+                if order["stop"] == "entry" and high < order["stop_price"]:
+                    continue
+                if order["stop"] == "loss" and low > order["stop_price"]:
+                    continue
+                self.last_price[product] = order["stop_price"]
+                self._activate(order)
+                if order["id"] not in self.orders:
+                    continue
+            if order["type"] == "market":
+                self.last_price[product] = Decimal(candle.open)
+                self._fill(order, self.last_price[product], liquidity="T")
+            elif order["side"] == "buy" and low <= order["price"] or order["side"] == "sell" and high >= order["price"]:
+                self._fill(order, order["price"], liquidity="M")
+        self.last_price[product] = Decimal(candle.close)
+
+
+    async def step(self, tstamp: datetime.datetime, timescale: Timescale):
+        """Match the open orders against the candles that closed at `tstamp`, read with `candle.fetch_batch`."""
+        products = {order["product_id"] for order in self.orders.values()}
+        for product in sorted(products):
+            start = tstamp - timescale.timedelta
+            for candle in await quantrt.models.candle.fetch_batch(product, start, start, timescale):
+                self.match_candle(candle)
+
+
+    def _account(self, currency: str) -> Dict[str, Any]:
+        account = self.accounts.get(currency)
+        if account is None:
+            account = self.accounts[currency] = {
+                "id": str(uuid.uuid4()),
+                "currency": currency,
+                "balance": Decimal(0),
+                "hold": Decimal(0),
+                "profile_id": self.profile_id,
+                "trading_enabled": True,
+            }
+        return account
+
+
+    def _activate(self, order: Dict[str, Any]):
+        """Fill a marketable order against the last price, otherwise rest it on the book."""
+        last = self.last_price.get(order["product_id"])
+        marketable = order["type"] == "market" or last is not None and (
+            order["side"] == "buy" and order["price"] >= last or order["side"] == "sell" and order["price"] <= last)
+        if marketable and last is not None:
+            self._fill(order, last, liquidity="T")
+            return
+        order["status"] = "open"
+        if order["type"] == "limit":
+            self._emit(order, "open", price=order["price"], remaining_size=order["size"])
+
+
+    def _fill(self, order: Dict[str, Any], price: Decimal, liquidity: str):
+        base, quote = order["product_id"].split("-")
+        size = order["size"] - order["filled_size"] if order["size"] is not None else None
+        if size is None:
+            # a market buy for funds spends the funds left after the fee
+            size = order["funds"] / (price * (1 + self.taker_fee_rate))
+        fee_rate = self.maker_fee_rate if liquidity == "M" else self.taker_fee_rate
+        value = price * size
+        fee = value * fee_rate
+        base_account, quote_account = self._account(base), self._account(quote)
+        if order["side"] == "buy":
+            quote_account["hold"] -= order["hold"]
+            quote_account["balance"] -= value + fee
+            base_account["balance"] += size
+        else:
+            base_account["hold"] -= order["hold"]
+            base_account["balance"] -= size
+            quote_account["balance"] += value - fee
+        order["hold"] = Decimal(0)
+        order["filled_size"] += size
+        self.last_price[order["product_id"]] = price
+
+        ours = order["id"]
+        other = str(uuid.uuid4())
+        maker, taker = (ours, other) if liquidity == "M" else (other, ours)
+        maker_side = order["side"] if liquidity == "M" else ("sell" if order["side"] == "buy" else "buy")
+        fee_key = "maker_fee_rate" if liquidity == "M" else "taker_fee_rate"
+        self._emit(order, "match", **{"trade_id": next(self._trade_id), "maker_order_id": maker,
+                                      "taker_order_id": taker, "side": maker_side, "price": price,
+                                      "size": size, fee_key: fee_rate})
+        self._done(order, "filled")
+
+
+    def _done(self, order: Dict[str, Any], reason: str):
+        if order["hold"]:
+            currency = order["product_id"].split("-")[1 if order["side"] == "buy" else 0]
+            self._account(currency)["hold"] -= order["hold"]
+            order["hold"] = Decimal(0)
+        order["status"] = "done"
+        del self.orders[order["id"]]
+        remaining = order["size"] - order["filled_size"] if order["size"] is not None else Decimal(0)
+        self._emit(order, "done", reason=reason, price=order["price"], remaining_size=remaining)
+
+
+    def _emit(self, order: Dict[str, Any], kind: str, **fields):
+        message = {
+            "type": kind,
+            "time": quantrt.util.time.now().isoformat(),
+            "product_id": order["product_id"],
+            "sequence": next(self._sequence),
+            "user_id": self.profile_id,
+            "profile_id": self.profile_id,
+            "side": order["side"],
+        }
+        if kind != "match":
+            message["order_id"] = order["id"]
+        for key, value in fields.items():
+            message[key] = str(value) if isinstance(value, Decimal) else value
+        for callback in self._callbacks:
+            callback(message)
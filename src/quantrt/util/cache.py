@@ -0,0 +1,274 @@
+import asyncpg
+import datetime
+import json
+import numpy as np
+import os
+
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.util.database
+import quantrt.util.time
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from quantrt.common.timescale import Timescale
+
+
+__all__ = ["CANDLE_DTYPE", "CandleCache", "to_epoch_ns", "from_epoch_ns"]
+
+
+""" Columnar layout of a cached candle segment. Timestamps are nanoseconds since the epoch. """
+CANDLE_DTYPE = np.dtype([
+    ("tstamp", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch_ns(dt: datetime.datetime) -> int:
+    """Convert a naive (UTC) datetime to integer nanoseconds since the epoch.
+    :param dt: datetime - the datetime to convert.
+    :return: The nanoseconds since the epoch.
+    """
+    return ((dt - EPOCH) // datetime.timedelta(microseconds=1)) * 1000
+
+
+def from_epoch_ns(ns: int) -> datetime.datetime:
+    """Convert integer nanoseconds since the epoch to a naive (UTC) datetime.
+    :param ns: int - nanoseconds since the epoch.
+    :return: The datetime.
+    """
+    return EPOCH + datetime.timedelta(microseconds=int(ns) // 1000)
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(dt: datetime.datetime) -> datetime.datetime:
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+class CandleCache:
+    """A local, columnar, on-disk cache of candle history.
+
+    History is stored as one `.npy` segment per (product, timescale, month) under `root`.
+    Segments are memory mapped on read so slicing them does not copy. A json manifest
+    records how far each segment has been filled from Postgres, and the number of rows and
+    latest timestamp Postgres held for it then. Months that lie entirely before
+    `utcnow - recent` are not fetched again, the trailing `recent` window is always read
+    straight from Postgres since it may still be changing.
+    Writes to the `candle` table through `candle.save_batch` invalidate the affected months in
+    this process. Rows written by other processes, e.g. `live` or a backfill, are caught by
+    comparing each segment's row count and latest timestamp with Postgres the first time it is
+    read, and a segment that no longer matches is refilled. Rows updated in place are not detected.
+    """
+
+    def __init__(self, root: Optional[str] = None, recent: datetime.timedelta = datetime.timedelta(days=1)):
+        if root is None:
+            root = os.path.join(quantrt.common.config.app_dir, "cache", "candles")
+        self.root: str = root
+        self.recent: datetime.timedelta = recent
+        self.manifest_path: str = os.path.join(root, "manifest.json")
+        # segment key -> {"covered": epoch ns, "rows": count, "last": epoch ns or None}
+        self.manifest: Dict[str, Dict[str, Optional[int]]] = {}
+        # segment keys checked against Postgres by this instance
+        self.verified: Set[str] = set()
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as fhandle:
+                manifest = json.load(fhandle)
+            # segments of older manifests have no watermark and are refilled
+            self.manifest = {key: entry for key, entry in manifest.items() if isinstance(entry, dict)}
+
+
+    def segment_path(self, product: str, timescale: Timescale, month: datetime.datetime) -> str:
+        return os.path.join(self.root, product, timescale.value, "{:04d}-{:02d}.npy".format(month.year, month.month))
+
+
+    def segment_key(self, product: str, timescale: Timescale, month: datetime.datetime) -> str:
+        return "{}/{}/{:04d}-{:02d}".format(product, timescale.value, month.year, month.month)
+
+
+    def covered(self, product: str, timescale: Timescale, month: datetime.datetime) -> int:
+        """The exclusive upper bound, in epoch nanoseconds, of the cached part of a segment.
+        A segment with no coverage returns the start of the month.
+        """
+        entry = self.manifest.get(self.segment_key(product, timescale, month))
+        return entry["covered"] if entry is not None else to_epoch_ns(month)
+
+
+    def load_segment(self, product: str, timescale: Timescale, month: datetime.datetime) -> np.ndarray:
+        """Memory map a cached segment. Missing segments are empty arrays."""
+        path = self.segment_path(product, timescale, month)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.load(path, mmap_mode="r")
+
+
+    async def fetch_array(self, product: str, start: datetime.datetime, stop: datetime.datetime, timescale: Timescale,
+                          pool: Optional[asyncpg.Pool] = None) -> np.ndarray:
+        """Fetch the candles in [start, stop] as a `CANDLE_DTYPE` array, filling the cache from Postgres as needed.
+        A range that lies within one cached month is returned as a read only view of the memory mapped segment.
+        :param product: str - the product ticker.
+        :param start: datetime - the first candle to fetch (floored to the timescale).
+        :param stop: datetime - the last candle to fetch (floored to the timescale), inclusive.
+        :param timescale: Timescale - the candle granularity.
+        :param pool: Optional[asyncpg.Pool] - the pool used to fill the cache. Defaults to the configured pool.
+        :return: The candles ordered by timestamp.
+        """
+        start = quantrt.util.time.datetime_floor(start, timescale)
+        stop = quantrt.util.time.datetime_floor(stop, timescale) + timescale.timedelta
+        horizon = quantrt.util.time.datetime_floor(datetime.datetime.utcnow() - self.recent, timescale)
+
+        chunks: List[np.ndarray] = []
+        month = month_start(start)
+        while month < stop and month < horizon:
+            upper = min(next_month(month), horizon)
+            key = self.segment_key(product, timescale, month)
+            if key in self.manifest and key not in self.verified:
+                await self._verify(product, timescale, month, pool)
+            covered = self.covered(product, timescale, month)
+            if covered < to_epoch_ns(min(upper, stop)):
+                await self._fill(product, timescale, month, from_epoch_ns(covered), upper, pool)
+            chunks.append(self._slice(self.load_segment(product, timescale, month), start, stop))
+            month = next_month(month)
+
+        if stop > horizon:
+            rows = await self._query(product, timescale, max(start, horizon), stop, pool)
+            chunks.append(rows)
+
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if not chunks:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks)
+
+
+    def invalidate(self, product: str, timescale: Timescale, since: Optional[datetime.datetime] = None):
+        """Drop cached segments of a (product, timescale) pair so they are refilled on the next read.
+        :param product: str - the product ticker.
+        :param timescale: Timescale - the candle granularity.
+        :param since: Optional[datetime] - only drop the months from this time onwards. Defaults to every month.
+        """
+        prefix = "{}/{}/".format(product, timescale.value)
+        for key in [key for key in self.manifest if key.startswith(prefix)]:
+            year, month = key[len(prefix):].split("-")
+            month = datetime.datetime(int(year), int(month), 1)
+            if since is not None and month < month_start(since):
+                continue
+            path = self.segment_path(product, timescale, month)
+            if os.path.exists(path):
+                os.remove(path)
+            del self.manifest[key]
+        self._write_manifest()
+
+
+    async def _verify(self, product: str, timescale: Timescale, month: datetime.datetime,
+                      pool: Optional[asyncpg.Pool]):
+        """Drop a segment whose rows no longer match Postgres."""
+        key = self.segment_key(product, timescale, month)
+        entry = self.manifest[key]
+        rows, last = await self._watermark(product, timescale, month, from_epoch_ns(entry["covered"]), pool)
+        if rows != entry["rows"] or last != entry["last"]:
+            quantrt.common.log.QuantrtLog.info(
+                "Candle cache segment %s is stale (%d rows cached, %d stored), refilling", key, entry["rows"], rows)
+            path = self.segment_path(product, timescale, month)
+            if os.path.exists(path):
+                os.remove(path)
+            del self.manifest[key]
+            self._write_manifest()
+        self.verified.add(key)
+
+
+    def _slice(self, segment: np.ndarray, start: datetime.datetime, stop: datetime.datetime) -> np.ndarray:
+        tstamps = segment["tstamp"]
+        lo = np.searchsorted(tstamps, to_epoch_ns(start), side="left")
+        hi = np.searchsorted(tstamps, to_epoch_ns(stop), side="left")
+        return segment[lo:hi]
+
+
+    async def _fill(self, product: str, timescale: Timescale, month: datetime.datetime,
+                    start: datetime.datetime, stop: datetime.datetime, pool: Optional[asyncpg.Pool]):
+        quantrt.common.log.QuantrtLog.debug(
+            "Filling candle cache for %s %s from %s to %s", product, timescale.value, start, stop)
+        rows = await self._query(product, timescale, start, stop, pool)
+        existing = self.load_segment(product, timescale, month)
+        existing = existing[existing["tstamp"] < to_epoch_ns(start)]
+        segment = np.concatenate([existing, rows]) if len(existing) else rows
+
+        path = self.segment_path(product, timescale, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as fhandle:
+            np.save(fhandle, segment)
+        os.replace(path + ".tmp", path)
+
+        key = self.segment_key(product, timescale, month)
+        self.manifest[key] = {
+            "covered": to_epoch_ns(stop),
+            "rows": len(segment),
+            "last": int(segment["tstamp"][-1]) if len(segment) else None,
+        }
+        self.verified.add(key)
+        self._write_manifest()
+
+
+    async def _watermark(self, product: str, timescale: Timescale, start: datetime.datetime, stop: datetime.datetime,
+                         pool: Optional[asyncpg.Pool]) -> Tuple[int, Optional[int]]:
+        """The number of stored candles in [start, stop) and the epoch nanoseconds of the latest one."""
+        if not pool:
+            pool = quantrt.common.config.db_conn_pool
+        if not pool:
+            quantrt.common.log.QuantrtLog.exception("No connection pool has been configured.")
+            raise EnvironmentError("No connection pool has been configured.")
+
+        async with pool.acquire() as conn:
+            sql = """
+                SELECT count(*) AS rows, max(tstamp) AS last FROM candle
+                WHERE product = $1 AND timescale = $2 AND tstamp >= $3 AND tstamp < $4
+            """
+            statement = await quantrt.util.database.prepare_sql(sql, conn)
+            row = await statement.fetchrow(product, timescale.name, start, stop)
+
+        return row["rows"], to_epoch_ns(row["last"]) if row["last"] is not None else None
+
+
+    async def _query(self, product: str, timescale: Timescale, start: datetime.datetime, stop: datetime.datetime,
+                     pool: Optional[asyncpg.Pool]) -> np.ndarray:
+        if not pool:
+            pool = quantrt.common.config.db_conn_pool
+        if not pool:
+            quantrt.common.log.QuantrtLog.exception("No connection pool has been configured.")
+            raise EnvironmentError("No connection pool has been configured.")
+
+        async with pool.acquire() as conn:
+            sql = """
+                SELECT tstamp, open, high, low, close, volume FROM candle
+                WHERE product = $1 AND timescale = $2 AND tstamp >= $3 AND tstamp < $4
+                ORDER BY tstamp
+            """
+            statement = await quantrt.util.database.prepare_sql(sql, conn)
+            rows = await statement.fetch(product, timescale.name, start, stop)
+
+        return np.array([(
+            to_epoch_ns(row["tstamp"]),
+            row["open"],
+            row["high"],
+            row["low"],
+            row["close"],
+            row["volume"]) for row in rows], dtype=CANDLE_DTYPE)
+
+
+    def _write_manifest(self):
+        with open(self.manifest_path + ".tmp", "w") as fhandle:
+            json.dump(self.manifest, fhandle)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
@@ -0,0 +1,212 @@
+import asyncpg
+import bisect
+import datetime
+import numpy as np
+
+import quantrt.api.rest
+import quantrt.common.config
+import quantrt.common.log
+import quantrt.models.candle
+import quantrt.util.cache
+import quantrt.util.database
+import quantrt.util.time
+
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from quantrt.common.timescale import Timescale
+
+
+__all__ = ["CoverageIndex", "coverage_indexes", "get_coverage", "record", "backfill"]
+
+
+""" Granularities, in seconds, served by the coinbase historic rates endpoint. """
+HISTORIC_GRANULARITIES = {60, 300, 900, 3600, 21600, 86400}
+
+""" The most candles returned by one historic rates request. """
+HISTORIC_LIMIT = 300
+
+
+class CoverageIndex:
+    """The buckets of one (product, timescale) pair that are present in the `candle` table.
+
+    Coverage is kept as sorted, disjoint, half open intervals [start, stop) of epoch nanoseconds
+    whose ends are bucket boundaries. Contiguous history collapses into a single interval so the
+    index stays small, and both adding buckets and finding gaps are a binary search plus work
+    proportional to the number of intervals touched.
+    :param timescale: The candle granularity.
+    """
+
+    def __init__(self, timescale: Timescale):
+        self.timescale: Timescale = timescale
+        self.width: int = timescale.nanoseconds
+        self.starts: List[int] = []
+        self.stops: List[int] = []
+
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+    def __iter__(self):
+        return zip(self.starts, self.stops)
+
+
+    def add_range(self, start: int, stop: int):
+        """Mark the buckets in [start, stop) as present, merging with touching intervals."""
+        if stop <= start:
+            return
+        # first interval whose stop reaches start, last interval whose start reaches stop
+        lo = bisect.bisect_left(self.stops, start)
+        hi = bisect.bisect_right(self.starts, stop)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            stop = max(stop, self.stops[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.stops[lo:hi] = [stop]
+
+
+    def add(self, tstamps: np.ndarray):
+        """Mark the buckets starting at the given epoch nanoseconds as present."""
+        tstamps = np.unique(quantrt.util.time.floor_array(np.asarray(tstamps, dtype=np.int64), self.timescale))
+        if not len(tstamps):
+            return
+        # split the buckets into runs of consecutive buckets and add each run as one interval
+        breaks = np.flatnonzero(np.diff(tstamps) != self.width) + 1
+        firsts = tstamps[np.concatenate(([0], breaks))]
+        lasts = tstamps[np.concatenate((breaks - 1, [len(tstamps) - 1]))]
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            self.add_range(first, last + self.width)
+
+
+    def missing(self, start: int, stop: int) -> List[Tuple[int, int]]:
+        """The ranges of absent buckets in [start, stop).
+        :param start: int - epoch nanoseconds, floored to the timescale.
+        :param stop: int - epoch nanoseconds, exclusive.
+        :return: Half open [start, stop) ranges of epoch nanoseconds, in order.
+        """
+        start = start - start % self.width
+        gaps: List[Tuple[int, int]] = []
+        i = bisect.bisect_right(self.stops, start)
+        cursor = start
+        while cursor < stop and i < len(self.starts) and self.starts[i] < stop:
+            if self.starts[i] > cursor:
+                gaps.append((cursor, self.starts[i]))
+            cursor = max(cursor, self.stops[i])
+            i += 1
+        if cursor < stop:
+            gaps.append((cursor, stop))
+        return gaps
+
+
+    def covers(self, start: int, stop: int) -> bool:
+        """Whether every bucket in [start, stop) is present."""
+        start = start - start % self.width
+        i = bisect.bisect_right(self.starts, start) - 1
+        return i >= 0 and self.stops[i] >= stop
+
+
+""" The coverage of every (product, timescale) pair seeded so far. """
+coverage_indexes: Dict[Tuple[str, Timescale], CoverageIndex] = {}
+
+
+async def get_coverage(product: str, timescale: Timescale, pool: Optional[asyncpg.Pool] = None) -> CoverageIndex:
+    """Get the coverage index of a (product, timescale) pair, seeding it from the `candle` table
+    the first time it is requested. Later `candle.save_batch` calls keep it up to date.
+    """
+    key = (product, timescale)
+    if key not in coverage_indexes:
+        index = CoverageIndex(timescale)
+        for start, stop in await _query_islands(product, timescale, pool):
+            index.add_range(start, stop)
+        coverage_indexes[key] = index
+    return coverage_indexes[key]
+
+
+def record(candles: Union[Iterable["quantrt.models.candle.Candle"], "quantrt.models.candle.CandleBatch"]):
+    """Add saved candles to the coverage indexes that have already been seeded.
+    Called by `candle.save_batch`, pairs that were never seeded pick the candles up when they are.
+    """
+    if not coverage_indexes:
+        return
+    if isinstance(candles, quantrt.models.candle.CandleBatch):
+        index = coverage_indexes.get((candles.product, candles.timescale))
+        if index is not None:
+            index.add(candles.tstamp)
+        return
+    tstamps: Dict[Tuple[str, Timescale], List[int]] = {}
+    for candle in candles:
+        key = (candle.product, candle.timescale)
+        if key in coverage_indexes:
+            tstamps.setdefault(key, []).append(quantrt.util.cache.to_epoch_ns(candle.tstamp))
+    for key, values in tstamps.items():
+        coverage_indexes[key].add(np.array(values, dtype=np.int64))
+
+
+async def backfill(product: str, start: datetime.datetime, stop: datetime.datetime, timescale: Timescale,
+                   pool: Optional[asyncpg.Pool] = None) -> int:
+    """Download the candles missing from [start, stop) from coinbase and save them.
+    Buckets in which nothing traded are not returned by coinbase, so they stay missing.
+    :param product: str - the product ticker.
+    :param start: datetime - the first bucket to check (floored to the timescale).
+    :param stop: datetime - the end of the range, exclusive.
+    :param timescale: Timescale - the candle granularity.
+    :param pool: Optional[asyncpg.Pool] - the pool to save to. Defaults to the configured pool.
+    :return: The number of candles saved.
+    """
+    if timescale.seconds not in HISTORIC_GRANULARITIES:
+        raise ValueError("Coinbase does not serve {} candles.".format(timescale.value))
+
+    index = await get_coverage(product, timescale, pool)
+    window = HISTORIC_LIMIT * index.width
+    saved = 0
+    for gap_start, gap_stop in index.missing(quantrt.util.cache.to_epoch_ns(start), quantrt.util.cache.to_epoch_ns(stop)):
+        quantrt.common.log.QuantrtLog.info(
+            "Backfilling %s %s candles from %s to %s", product, timescale.value,
+            quantrt.util.cache.from_epoch_ns(gap_start), quantrt.util.cache.from_epoch_ns(gap_stop))
+        for lower in range(gap_start, gap_stop, window):
+            upper = min(lower + window, gap_stop)
+            rates = await quantrt.api.rest.get_product_historic_rates(
+                product,
+                start=quantrt.util.cache.from_epoch_ns(lower).isoformat(),
+                # the end of the request is inclusive
+                stop=quantrt.util.cache.from_epoch_ns(upper - index.width).isoformat(),
+                granularity=timescale.seconds)
+            candles = [quantrt.models.candle.Candle(
+                product=product,
+                tstamp=rate["time"],
+                timescale=timescale,
+                open=rate["open"],
+                high=rate["high"],
+                low=rate["low"],
+                close=rate["close"],
+                volume=rate["volume"]
+            ) for rate in rates if lower <= quantrt.util.cache.to_epoch_ns(rate["time"]) < upper]
+            if candles:
+                await quantrt.models.candle.save_batch(candles, pool)
+                saved += len(candles)
+    return saved
+
+
+async def _query_islands(product: str, timescale: Timescale, pool: Optional[asyncpg.Pool]) -> List[Tuple[int, int]]:
+    if not pool:
+        pool = quantrt.common.config.db_conn_pool
+    if not pool:
+        quantrt.common.log.QuantrtLog.exception("No connection pool has been configured.")
+        raise EnvironmentError("No connection pool has been configured.")
+
+    # Gaps and islands: consecutive buckets share the same tstamp - row_number * width, so each
+    # run of present buckets comes back as one row from a single ordered pass over the index.
+    async with pool.acquire() as conn:
+        sql = """
+            SELECT min(tstamp) AS first, max(tstamp) AS last FROM (
+                SELECT tstamp, tstamp - row_number() OVER (ORDER BY tstamp) * $3::interval AS island
+                FROM candle WHERE product = $1 AND timescale = $2
+            ) AS runs
+            GROUP BY island ORDER BY first
+        """
+        statement = await quantrt.util.database.prepare_sql(sql, conn)
+        rows = await statement.fetch(product, timescale.name, timescale.timedelta)
+
+    width = timescale.nanoseconds
+    return [(quantrt.util.cache.to_epoch_ns(row["first"]), quantrt.util.cache.to_epoch_ns(row["last"]) + width)
+            for row in rows]
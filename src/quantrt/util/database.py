@@ -1,16 +1,26 @@
 import asyncpg
 import asyncpg.prepared_stmt
-import pandas as pd
 
 import quantrt.common.log
 import quantrt.common.config
+import quantrt.util.metrics
 
 from asyncpg import Pool
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 __all__ = ["create_connection_pool", "fetch_as_dataframe", "prepare_sql"]
 
 
+PREPARED = quantrt.util.metrics.default_registry.counter(
+    "quantrt_db_prepared_statements_total", "Prepared statement lookups by whether they were cached.", ["cache"])
+_PREPARED_HIT = PREPARED.labels("hit")
+_PREPARED_MISS = PREPARED.labels("miss")
+
+
 async def create_connection_pool(dsn: str) -> Pool:
     quantrt.common.log.QuantrtLog.info("creating database connection pool")
     pool = await asyncpg.create_pool(
@@ -19,10 +29,19 @@ async def create_connection_pool(dsn: str) -> Pool:
         max_size=40,
     )
     quantrt.common.log.QuantrtLog.info("database connection pool created")
+    # read the pool's own counts at scrape time, its saturation is size - idle against max
+    quantrt.util.metrics.default_registry.collect(
+        "quantrt_db_pool_connections", "Database pool connections by state.", "gauge",
+        lambda: [("quantrt_db_pool_connections", {"state": "open"}, pool.get_size()),
+                 ("quantrt_db_pool_connections", {"state": "idle"}, pool.get_idle_size()),
+                 ("quantrt_db_pool_connections", {"state": "max"}, pool.get_max_size())])
     return pool
 
 
-async def fetch_as_dataframe(pool: Pool, query: str, *args) -> pd.DataFrame:
+async def fetch_as_dataframe(pool: Pool, query: str, *args) -> "pd.DataFrame":
+    # pandas takes a few hundred milliseconds to import, so it is only loaded by the callers that need it
+    import pandas as pd
+
     async with pool.acquire() as con:
         stmt = await con.prepare(query)
         columns = [a.name for a in stmt.get_attributes()]
@@ -36,7 +55,10 @@ async def fetch_as_dataframe(pool: Pool, query: str, *args) -> pd.DataFrame:
 
 
 async def prepare_sql(method: str, conn: asyncpg.Connection) -> asyncpg.prepared_stmt.PreparedStatement:
-    if method not in quantrt.common.config.prepared_sql:
+    if method in quantrt.common.config.prepared_sql:
+        _PREPARED_HIT.inc()
+    else:
+        _PREPARED_MISS.inc()
         if len(quantrt.common.config.prepared_sql) >= 32:
             quantrt.common.config.prepared_sql.popitem(last = True)
         
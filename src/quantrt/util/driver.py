@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import inspect
+
+import quantrt.common.config
+import quantrt.util.schedule
+import quantrt.util.time
+
+from typing import Any, Callable, Optional
+
+from quantrt.common.clock import SimulatedClock
+from quantrt.common.timescale import Timescale
+from quantrt.util.schedule import AsyncScheduler, Scheduler
+
+
+__all__ = ["BacktestDriver"]
+
+
+class BacktestDriver:
+    """Drive a backtest by jumping a `SimulatedClock` straight to the next deadline.
+    A deadline is either the next run of a scheduled job or, if a timescale is given, the next
+    candle boundary. Nothing happens between deadlines so the clock is never stepped through
+    them, and the scheduled jobs are the same `Job`s, run by the same scheduler code, as live.
+    :param stop: The time at which the backtest ends, inclusive.
+    :param scheduler: The scheduler whose jobs are run. Defaults to the default scheduler.
+    :param clock: The simulated clock. Defaults to `config.clock`, which must be a `SimulatedClock`.
+    :param timescale: If given, `on_candle` is called at every boundary of this timescale.
+    :param on_candle: Called with the boundary time at each candle boundary, may be a coroutine function.
+    """
+
+    def __init__(self, stop: datetime.datetime, scheduler: Optional[Scheduler] = None,
+                 clock: Optional[SimulatedClock] = None, timescale: Optional[Timescale] = None,
+                 on_candle: Optional[Callable[[datetime.datetime], Any]] = None):
+        if scheduler is None:
+            scheduler = quantrt.util.schedule.default_scheduler
+        if clock is None:
+            clock = quantrt.common.config.clock
+        if not isinstance(clock, SimulatedClock):
+            raise EnvironmentError("A backtest must be driven by a `SimulatedClock`.")
+        if on_candle is not None and timescale is None:
+            raise ValueError("`on_candle` requires a `timescale`.")
+
+        self.stop: datetime.datetime = stop
+        self.scheduler: Scheduler = scheduler
+        self.clock: SimulatedClock = clock
+        self.timescale: Optional[Timescale] = timescale
+        self.on_candle: Optional[Callable[[datetime.datetime], Any]] = on_candle
+        # number of deadlines processed
+        self.steps: int = 0
+        # the last candle boundary passed to `on_candle`
+        self._last_candle: Optional[datetime.datetime] = None
+
+
+    def next_candle(self) -> Optional[datetime.datetime]:
+        """The first candle boundary strictly after the current simulated time."""
+        if self.timescale is None:
+            return None
+        return quantrt.util.time.datetime_floor(self.clock.now(), self.timescale) + self.timescale.timedelta
+
+
+    def next_deadline(self) -> Optional[datetime.datetime]:
+        """The earliest of the next job run and the next candle boundary."""
+        deadlines = [when for when in (self.scheduler.next_run, self.next_candle()) if when is not None]
+        return min(deadlines) if deadlines else None
+
+
+    def step(self) -> bool:
+        """Advance to the next deadline and run what is due there.
+        Coroutine results of `on_candle` are discarded, use `run_async` for coroutines.
+        :return: False once the next deadline is past `stop`.
+        """
+        deadline = self._advance()
+        if deadline is None:
+            return False
+        if self._is_candle(deadline):
+            self.on_candle(deadline)
+        self.scheduler.run_pending()
+        return True
+
+
+    def run(self) -> int:
+        """Run the backtest to `stop` with a synchronous scheduler.
+        :return: The number of deadlines processed.
+        """
+        while self.step():
+            pass
+        self.clock.set(self.stop)
+        return self.steps
+
+
+    async def run_async(self) -> int:
+        """Run the backtest to `stop`, awaiting coroutine candle callbacks and, for an
+        `AsyncScheduler`, every job started at a deadline before moving to the next one.
+        :return: The number of deadlines processed.
+        """
+        while True:
+            deadline = self._advance()
+            if deadline is None:
+                break
+            if self._is_candle(deadline):
+                ret = self.on_candle(deadline)
+                if inspect.isawaitable(ret):
+                    await ret
+            self.scheduler.run_pending()
+            if isinstance(self.scheduler, AsyncScheduler):
+                running = [task for job in self.scheduler.jobs for task in job._tasks if not task.done()]
+                if running:
+                    await asyncio.wait(running)
+        self.clock.set(self.stop)
+        return self.steps
+
+
+    def _advance(self) -> Optional[datetime.datetime]:
+        deadline = self.next_deadline()
+        if deadline is None or deadline > self.stop:
+            return None
+        self.clock.set(deadline)
+        quantrt.common.config.curtime = self.clock.now()
+        self.steps += 1
+        return deadline
+
+
+    def _is_candle(self, deadline: datetime.datetime) -> bool:
+        if self.on_candle is None or deadline == self._last_candle:
+            return False
+        if quantrt.util.time.datetime_floor(deadline, self.timescale) != deadline:
+            return False
+        self._last_candle = deadline
+        return True
@@ -0,0 +1,220 @@
+import asyncio
+import time
+
+import quantrt.common.config
+import quantrt.common.log
+
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+
+__all__ = ["STAGES", "LatencyHistogram", "LatencyTracker", "timed"]
+
+
+"""
+The stages of the tick-to-trade path, each recorded in nanoseconds of the monotonic clock:
+    decode         websocket frame to decoded message
+    book           applying the message to the order book
+    dispatch       the message handlers, which publish to the strategies
+    on_event       a strategy handling one event, by strategy
+    scan, act      a strategy's `scan` and `act`, by strategy
+    risk           the pre-trade checks of one order
+    send           from submitting actions to the orders going out
+    ack            from the orders going out to their REST responses
+    tick_to_trade  from the product's latest frame to the REST response of an order
+"""
+STAGES = ("decode", "book", "dispatch", "on_event", "scan", "act", "risk", "send", "ack", "tick_to_trade")
+
+
+# values below this are counted exactly, above it each power of two is split into _HALF buckets
+_SUB_BITS = 5
+_HALF = 1 << _SUB_BITS
+_LINEAR = _HALF << 1
+# values of more than this many bits, over 18 minutes in nanoseconds, go in the last bucket
+_MAX_BITS = 40
+_BUCKETS = _LINEAR + (_MAX_BITS - _SUB_BITS - 1) * _HALF
+_NO_MIN = 1 << 62
+
+
+class LatencyHistogram:
+    """A histogram of nanosecond latencies in log-linear buckets, like an HDR histogram.
+    Every power of two is split into 32 buckets, so values are kept to about 3% and a record is a
+    few integer operations with no allocation. Histograms are written from the event loop thread
+    only, so they need no lock.
+    """
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * _BUCKETS
+        self.count: int = 0
+        self.total: int = 0
+        self.min: int = _NO_MIN
+        self.max: int = 0
+
+
+    def record(self, value: int):
+        if value < _LINEAR:
+            if value < 0:
+                value = 0
+            self.counts[value] += 1
+        else:
+            shift = value.bit_length() - _SUB_BITS - 1
+            index = (shift - 1) * _HALF + (value >> shift) + _HALF
+            self.counts[index if index < _BUCKETS else _BUCKETS - 1] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+
+    @staticmethod
+    def upper_bound(index: int) -> int:
+        """The largest value counted in a bucket."""
+        if index < _LINEAR:
+            return index
+        shift, sub = divmod(index - _LINEAR, _HALF)
+        shift += 1
+        return ((sub + _HALF + 1) << shift) - 1
+
+
+    def percentile(self, q: float) -> int:
+        """The value below which `q` percent of the records fall, to the precision of the buckets."""
+        if not self.count:
+            return 0
+        rank = max(1, int(self.count * q / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+
+    def reset(self):
+        self.counts = [0] * _BUCKETS
+        self.count = self.total = self.max = 0
+        self.min = _NO_MIN
+
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+        }
+
+
+class LatencyTracker:
+    """Latency histograms of the tick-to-trade path by stage and product.
+    Instrumented code records only when `config.latency` is a tracker, so with it unset the cost
+    is one attribute lookup per message. The tracker also keeps the monotonic receive time of
+    each product's latest frame, from which the tick-to-trade latency of an order is measured.
+    :param interval: Seconds between logging the histograms with `start`.
+    """
+
+    def __init__(self, interval: float = 60.0):
+        self.interval: float = interval
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        # product -> monotonic ns of its latest frame
+        self.marks: Dict[str, int] = {}
+        # product -> the decode, book and dispatch histograms, to record a frame with one lookup
+        self._feed: Dict[str, Tuple[LatencyHistogram, LatencyHistogram, LatencyHistogram]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+
+    def record(self, stage: str, key: str, nanos: int):
+        """Record a latency of a stage, keyed by product or, for strategy stages, by strategy."""
+        self.histogram(stage, key).record(nanos)
+
+
+    def histogram(self, stage: str, key: str) -> LatencyHistogram:
+        histogram = self.histograms.get((stage, key))
+        if histogram is None:
+            histogram = self.histograms[(stage, key)] = LatencyHistogram()
+        return histogram
+
+
+    def mark(self, product: str, nanos: int):
+        """Note the receive time of a product's latest frame."""
+        self.marks[product] = nanos
+
+
+    def record_frame(self, product: str, received: int, decoded: int, applied: int, dispatched: int):
+        """Record the feed stages of one frame and mark its receive time."""
+        self.marks[product] = received
+        histograms = self._feed.get(product)
+        if histograms is None:
+            histograms = self._feed[product] = (self.histogram("decode", product), self.histogram("book", product),
+                                                self.histogram("dispatch", product))
+        histograms[0].record(decoded - received)
+        histograms[1].record(applied - decoded)
+        histograms[2].record(dispatched - applied)
+
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """The summary of every histogram, by stage then key."""
+        report: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (stage, key), histogram in sorted(self.histograms.items()):
+            report.setdefault(stage, {})[key] = histogram.summary()
+        return report
+
+
+    def log(self):
+        """Log the summary of every histogram in microseconds."""
+        for stage, keys in self.snapshot().items():
+            for key, summary in keys.items():
+                quantrt.common.log.QuantrtLog.info(
+                    "latency %s %s: n=%d p50=%.1fus p99=%.1fus p99.9=%.1fus max=%.1fus", stage, key,
+                    summary["count"], summary["p50"] / 1e3, summary["p99"] / 1e3, summary["p999"] / 1e3,
+                    summary["max"] / 1e3)
+
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+
+    def start(self):
+        """Log the histograms every `interval` seconds in the background."""
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._log_loop())
+
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+    async def _log_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.log()
+
+
+async def timed(stage: str, key: str, awaitable: Awaitable) -> Any:
+    """Await `awaitable`, recording its wall time under `stage` and `key` if latency is tracked."""
+    tracker = quantrt.common.config.latency
+    if tracker is None:
+        return await awaitable
+    start = time.monotonic_ns()
+    try:
+        return await awaitable
+    finally:
+        tracker.record(stage, key, time.monotonic_ns() - start)
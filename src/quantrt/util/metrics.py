@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import math
+import threading
+
+import quantrt.common.log
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+__all__ = ["Counter", "Gauge", "Histogram", "Registry", "MetricsServer", "default_registry",
+           "DEFAULT_BUCKETS"]
+
+
+""" Histogram bucket upper bounds in seconds, from 100us to 10s. """
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+""" A sample of a collector: (metric name, labels, value). """
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name: str = name
+        self.help: str = help
+        self.label_names: Tuple[str, ...] = tuple(labels)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def labels(self, *values: str):
+        """The child metric of one combination of label values, created on first use.
+        Keep the child when updating it in a loop, the lookup costs more than the update.
+        """
+        if len(values) != len(self.label_names):
+            raise ValueError("{} takes the labels {}.".format(self.name, self.label_names))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+
+    def _child(self) -> "_Metric":
+        return type(self)(self.name, self.help)
+
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(name suffix, extra label, value) of an unlabeled metric or a child."""
+        raise NotImplementedError()
+
+
+    def expose(self) -> List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        children = list(self._children.items()) if self.label_names else [((), self)]
+        for values, child in children:
+            for suffix, extra, value in child._samples():
+                lines.append("{}{}{} {}".format(
+                    self.name, suffix, _format_labels(self.label_names, values, extra), _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as a number of requests."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.value: float = 0
+
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+    def _samples(self):
+        yield "", "", self.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as a queue depth."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.value: float = 0
+
+
+    def set(self, value: float):
+        self.value = value
+
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+
+    def _samples(self):
+        yield "", "", self.value
+
+
+class Histogram(_Metric):
+    """Counts of observed values, such as durations in seconds, in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum: float = 0.0
+
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+    def _samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield "_bucket", 'le="{}"'.format(_format_value(bound)), cumulative
+        yield "_sum", "", self.sum
+        yield "_count", "", cumulative
+
+
+class Registry:
+    """The metrics of the process, exposed in the Prometheus text format.
+
+    Counters, gauges and histograms are updated where things happen, under a lock per metric
+    so that the REST executor threads can update them too. State that already exists
+    elsewhere, such as queue depths, pool sizes or the counters the feed shards keep in shared
+    memory, is read by collectors at scrape time instead of being copied on every change.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def _get(self, cls, name: str, help: str, labels: Sequence[str], **kwargs) -> _Metric:
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **kwargs)
+            elif type(metric) is not cls or metric.label_names != tuple(labels):
+                raise ValueError("The metric {} is already registered as a different metric.".format(name))
+        return metric
+
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        """The counter of this name, registered on first use."""
+        return self._get(Counter, name, help, labels)
+
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+
+    def collect(self, name: str, help: str, kind: str, collector: Callable[[], Iterable[Sample]]):
+        """Register a function called at every scrape that returns the samples of a metric family.
+        :param name: The family name, samples may add a suffix to it.
+        :param kind: The Prometheus type, `gauge` or `counter`.
+        """
+        with self._lock:
+            self.collectors = [entry for entry in self.collectors if entry[0] != name]
+            self.collectors.append((name, help, kind, collector))
+
+
+    def exposition(self) -> str:
+        """Every metric in the Prometheus text format."""
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.expose())
+        for name, help, kind, collector in list(self.collectors):
+            try:
+                samples = list(collector())
+            except Exception as err:
+                quantrt.common.log.QuantrtLog.warning("Metrics collector %s failed: %s", name, err)
+                continue
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for sample_name, labels, value in samples:
+                lines.append("{}{} {}".format(
+                    sample_name, _format_labels(list(labels), list(labels.values())), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves `Registry.exposition` at `/metrics` over HTTP from the event loop, for a local scraper.
+    :param registry: The registry to serve. Defaults to `default_registry`.
+    :param host: The interface to listen on. Local only by default.
+    :param port: The port to listen on.
+    """
+
+    def __init__(self, registry: Optional[Registry] = None, host: str = "127.0.0.1", port: int = 9108):
+        self.registry: Registry = registry or default_registry
+        self.host: str = host
+        self.port: int = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        quantrt.common.log.QuantrtLog.info("Serving metrics at http://%s:%s/metrics", self.host, self.port)
+
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            # skip the headers
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.exposition().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write("HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         "Content-Length: {}\r\nConnection: close\r\n\r\n".format(status, len(body)).encode())
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+""" The metrics registry of the process. """
+default_registry = Registry()
@@ -0,0 +1,208 @@
+import cProfile
+import datetime
+import inspect
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+import quantrt.common.log
+
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple
+
+
+__all__ = ["PROFILERS", "StageStats", "StrategyProfiler"]
+
+
+""" The call profilers that can capture a backtest window. `pyinstrument` is optional. """
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class StageStats:
+    """The wall and CPU time of the calls of one strategy stage, and the memory they kept."""
+    __slots__ = ("calls", "wall_ns", "cpu_ns", "max_wall_ns", "allocated")
+
+    def __init__(self):
+        self.calls: int = 0
+        self.wall_ns: int = 0
+        self.cpu_ns: int = 0
+        self.max_wall_ns: int = 0
+        # net bytes allocated and not freed by the calls, if tracemalloc is tracing
+        self.allocated: int = 0
+
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "wall_ms": self.wall_ns / 1e6,
+            "cpu_ms": self.cpu_ns / 1e6,
+            "mean_wall_ms": self.wall_ns / self.calls / 1e6 if self.calls else 0.0,
+            "max_wall_ms": self.max_wall_ns / 1e6,
+            "allocated_bytes": self.allocated,
+        }
+
+
+class StrategyProfiler:
+    """Profiles the strategies of a backtest and writes a report per run.
+
+    Every `scan` and `act` is timed in wall and CPU time of the event loop thread. Strategies
+    are awaited together, so the CPU time of a stage includes whatever else ran on the loop
+    while it awaited, and is exact only for stages that do not await. With `memory`, allocations
+    are traced with tracemalloc: the net bytes each stage keeps are counted, and the report
+    lists the largest allocation sites of each strategy's module. Within each window, the
+    whole backtest is captured with cProfile or pyinstrument and written next to the report.
+    :param directory: Where the reports are written.
+    :param memory: Whether to trace allocations.
+    :param windows: The (start, end) simulated times to capture with the call profiler.
+    :param tool: The call profiler, one of `PROFILERS`.
+    """
+
+    def __init__(self, directory: str, memory: bool = False,
+                 windows: Sequence[Tuple[datetime.datetime, datetime.datetime]] = (), tool: str = "cprofile"):
+        if tool not in PROFILERS:
+            raise ValueError("The profiler must be one of {}.".format(PROFILERS))
+        self.directory: str = directory
+        self.memory: bool = memory
+        self.windows: List[Tuple[datetime.datetime, datetime.datetime]] = sorted(windows)
+        self.tool: str = tool
+        self.run_id: str = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        # (strategy, stage) -> stats
+        self.stages: Dict[Tuple[str, str], StageStats] = {}
+        # strategy -> the file of its module, to attribute allocations to
+        self.files: Dict[str, str] = {}
+        self.captures: List[str] = []
+        self._window: Optional[Tuple[datetime.datetime, datetime.datetime]] = None
+        self._capture: Any = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+
+    def add_strategy(self, strategy: Any):
+        """Attribute the allocations of the strategy's module file to it."""
+        try:
+            self.files[strategy.name] = inspect.getfile(type(strategy))
+        except TypeError:
+            pass
+
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot()
+
+
+    async def measure(self, stage: str, strategy: str, awaitable: Awaitable) -> Any:
+        """Await a stage of a strategy, adding its times to the strategy's stats."""
+        stats = self.stages.get((strategy, stage))
+        if stats is None:
+            stats = self.stages[(strategy, stage)] = StageStats()
+        allocated = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        cpu = time.thread_time_ns()
+        wall = time.perf_counter_ns()
+        try:
+            return await awaitable
+        finally:
+            wall = time.perf_counter_ns() - wall
+            stats.calls += 1
+            stats.wall_ns += wall
+            stats.cpu_ns += time.thread_time_ns() - cpu
+            if wall > stats.max_wall_ns:
+                stats.max_wall_ns = wall
+            if self.memory:
+                stats.allocated += tracemalloc.get_traced_memory()[0] - allocated
+
+
+    def step(self, tstamp: datetime.datetime):
+        """Start or stop the call profiler as the backtest enters or leaves a window."""
+        if self._window is not None and tstamp >= self._window[1]:
+            self._stop_capture()
+        if self._window is None:
+            while self.windows and tstamp >= self.windows[0][1]:
+                self.windows.pop(0)
+            if self.windows and tstamp >= self.windows[0][0]:
+                self._start_capture(self.windows.pop(0))
+
+
+    def finish(self) -> str:
+        """Stop any capture and write the run's report.
+        :return: The path of the report.
+        """
+        if self._window is not None:
+            self._stop_capture()
+        report = {
+            "run": self.run_id,
+            "strategies": {},
+            "captures": self.captures,
+        }
+        for (strategy, stage), stats in sorted(self.stages.items()):
+            report["strategies"].setdefault(strategy, {})[stage] = stats.summary()
+        if self.memory and tracemalloc.is_tracing():
+            report["memory"] = self._memory_report()
+        path = os.path.join(self.directory, "profile-{}.json".format(self.run_id))
+        with open(path, "w") as fno:
+            json.dump(report, fno, indent=2, default=str)
+        for strategy, stages in report["strategies"].items():
+            for stage, summary in stages.items():
+                quantrt.common.log.QuantrtLog.info(
+                    "profile %s %s: n=%d wall=%.1fms cpu=%.1fms max=%.2fms kept=%dB", strategy, stage,
+                    summary["calls"], summary["wall_ms"], summary["cpu_ms"], summary["max_wall_ms"],
+                    summary["allocated_bytes"])
+        quantrt.common.log.QuantrtLog.info("Wrote the profile of the run to %s", path)
+        return path
+
+
+    def _memory_report(self, limit: int = 10) -> Dict[str, Any]:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        report: Dict[str, Any] = {"current_bytes": current, "peak_bytes": peak, "strategies": {}}
+        if self._baseline is not None:
+            report["growth"] = [{"site": str(diff.traceback), "size_bytes": diff.size_diff, "count": diff.count_diff}
+                                for diff in snapshot.compare_to(self._baseline, "lineno")[:limit]]
+        for strategy, path in self.files.items():
+            statistics = snapshot.filter_traces([tracemalloc.Filter(True, path)]).statistics("lineno")
+            report["strategies"][strategy] = {
+                "size_bytes": sum(stat.size for stat in statistics),
+                "top": [{"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                        for stat in statistics[:limit]],
+            }
+        return report
+
+
+    def _start_capture(self, window: Tuple[datetime.datetime, datetime.datetime]):
+        if self.tool == "pyinstrument":
+            try:
+                import pyinstrument
+            except ImportError:
+                quantrt.common.log.QuantrtLog.exception("pyinstrument is not installed.")
+                raise EnvironmentError("pyinstrument is not installed.")
+            self._capture = pyinstrument.Profiler(async_mode="disabled")
+            self._capture.start()
+        else:
+            self._capture = cProfile.Profile()
+            self._capture.enable()
+        self._window = window
+        quantrt.common.log.QuantrtLog.info("Profiling the backtest from %s to %s", *window)
+
+
+    def _stop_capture(self):
+        start = self._window[0].strftime("%Y%m%dT%H%M%S")
+        base = os.path.join(self.directory, "profile-{}-{}".format(self.run_id, start))
+        if self.tool == "pyinstrument":
+            self._capture.stop()
+            path = base + ".html"
+            with open(path, "w") as fno:
+                fno.write(self._capture.output_html())
+        else:
+            self._capture.disable()
+            path = base + ".prof"
+            self._capture.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(self._capture, stream=text).sort_stats("cumulative").print_stats(40)
+            with open(base + ".txt", "w") as fno:
+                fno.write(text.getvalue())
+        self.captures.append(path)
+        self._capture = None
+        self._window = None
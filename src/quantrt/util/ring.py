@@ -0,0 +1,272 @@
+import numpy as np
+import os
+import select
+import time
+
+from multiprocessing import reduction, shared_memory
+from typing import Optional, Tuple
+
+
+__all__ = ["TRADE_DTYPE", "L2_DTYPE", "CANDLE_DTYPE", "WaitStrategy", "SpinWait", "SleepWait", "EventFdWait",
+           "SharedRing"]
+
+
+""" A trade. Times are epoch nanoseconds, prices and sizes are ticks of the product's scale. """
+TRADE_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("trade_id", "<i8"),
+    ("price", "<i8"),
+    ("size", "<i8"),
+    ("product", "<u2"),
+    # 0 for buy, 1 for sell
+    ("side", "u1"),
+])
+
+""" One changed level of a level 2 order book. """
+L2_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("price", "<i8"),
+    ("size", "<i8"),
+    ("product", "<u2"),
+    ("side", "u1"),
+])
+
+""" A candle. Prices and volume are floats as in the `candle` table. """
+CANDLE_DTYPE = np.dtype([
+    ("tstamp", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("product", "<u2"),
+])
+
+
+class WaitStrategy:
+    """How the consumer of a `SharedRing` waits for records."""
+
+    def wait(self, timeout: float):
+        """Block for at most `timeout` seconds or until notified."""
+        raise NotImplementedError()
+
+
+    def notify(self):
+        """Wake a waiting consumer. Called by the producer only when the consumer is waiting."""
+
+
+class SpinWait(WaitStrategy):
+    """Busy poll. The lowest latency, at the cost of a core."""
+
+    def wait(self, timeout: float):
+        pass
+
+
+class SleepWait(WaitStrategy):
+    """Sleep between polls. Cheap, but adds up to `interval` seconds of latency."""
+
+    def __init__(self, interval: float = 0.0005):
+        self.interval: float = interval
+
+
+    def wait(self, timeout: float):
+        time.sleep(min(self.interval, timeout))
+
+
+class EventFdWait(WaitStrategy):
+    """Block on a Linux eventfd the producer writes to. Low latency without burning a core.
+    The strategy can be passed to a child process as a `Process` argument, which duplicates the fd.
+    """
+
+    def __init__(self, fd: Optional[int] = None):
+        self.fd: int = os.eventfd(0, os.EFD_NONBLOCK) if fd is None else fd
+
+
+    def __reduce__(self):
+        return EventFdWait._rebuild, (reduction.DupFd(self.fd),)
+
+
+    @staticmethod
+    def _rebuild(fd) -> "EventFdWait":
+        return EventFdWait(fd.detach())
+
+
+    def wait(self, timeout: float):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                os.eventfd_read(self.fd)
+            except BlockingIOError:
+                pass
+
+
+    def notify(self):
+        try:
+            os.eventfd_write(self.fd, 1)
+        except BlockingIOError:
+            pass
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+# head, tail and consumer waiting flag, each on its own 64 byte cache line
+_HEADER_BYTES = 192
+_HEAD = 0
+_TAIL = 8
+_WAITING = 16
+# the longest the consumer blocks before checking the ring again, bounds a missed notification
+_WAIT_SLICE = 0.01
+
+
+class SharedRing:
+    """A single producer, single consumer ring buffer of fixed size records in shared memory.
+
+    Records are elements of a numpy structured dtype, so a batch is written or read with one
+    array copy and nothing is pickled. The producer only advances `head` and the consumer only
+    advances `tail`, both monotonically increasing record counts, so no lock is needed as long
+    as there is exactly one process on each end.
+    Create the ring in one process with `SharedRing(dtype, capacity)` and attach to it in the
+    other with `SharedRing(dtype, capacity, name=ring.name)`, passing the same wait strategy.
+    :param dtype: The record dtype.
+    :param capacity: The number of records, rounded up to a power of two.
+    :param name: The shared memory block to attach to. Creates a new block if None.
+    :param wait: How `read_wait` waits for records. Defaults to `SleepWait()`.
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int, name: Optional[str] = None,
+                 wait: Optional[WaitStrategy] = None):
+        self.dtype: np.dtype = np.dtype(dtype)
+        self.capacity: int = 1 << max(int(capacity) - 1, 1).bit_length()
+        self.mask: int = self.capacity - 1
+        self.owner: bool = name is None
+        self.wait: WaitStrategy = wait or SleepWait()
+        size = _HEADER_BYTES + self.capacity * self.dtype.itemsize
+        self.shm: shared_memory.SharedMemory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.counters: np.ndarray = np.ndarray((_HEADER_BYTES // 8,), dtype=np.int64, buffer=self.shm.buf)
+        self.records: np.ndarray = np.ndarray((self.capacity,), dtype=self.dtype, buffer=self.shm.buf,
+                                              offset=_HEADER_BYTES)
+        if self.owner:
+            self.counters[:] = 0
+
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+
+    def __len__(self) -> int:
+        """The number of records written and not yet read."""
+        return int(self.counters[_HEAD] - self.counters[_TAIL])
+
+
+    def free(self) -> int:
+        """The number of records that can be written without overwriting unread ones."""
+        return self.capacity - len(self)
+
+
+    def write(self, batch: np.ndarray) -> int:
+        """Append as many records of `batch` as fit. Producer side only.
+        :return: The number of records written, less than `len(batch)` if the ring is full.
+        """
+        counters = self.counters
+        head = int(counters[_HEAD])
+        count = min(len(batch), self.capacity - (head - int(counters[_TAIL])))
+        if count <= 0:
+            return 0
+        start = head & self.mask
+        first = min(count, self.capacity - start)
+        self.records[start:start + first] = batch[:first]
+        if first < count:
+            self.records[:count - first] = batch[first:count]
+        # publish the records only after they are written
+        counters[_HEAD] = head + count
+        if counters[_WAITING]:
+            self.wait.notify()
+        return count
+
+
+    def put(self, record: Tuple) -> bool:
+        """Append one record given as a tuple of its fields. Producer side only.
+        Prefer `write` with batches, a single record costs about as much as a small batch.
+        :return: False if the ring is full.
+        """
+        counters = self.counters
+        head = int(counters[_HEAD])
+        if head - int(counters[_TAIL]) >= self.capacity:
+            return False
+        self.records[head & self.mask] = record
+        counters[_HEAD] = head + 1
+        if counters[_WAITING]:
+            self.wait.notify()
+        return True
+
+
+    def read(self, limit: Optional[int] = None) -> np.ndarray:
+        """Remove and return up to `limit` records, oldest first. Consumer side only.
+        :return: A copy of the records, empty if the ring is empty.
+        """
+        tail = int(self.counters[_TAIL])
+        count = int(self.counters[_HEAD]) - tail
+        if limit is not None:
+            count = min(count, limit)
+        if count <= 0:
+            return np.empty(0, dtype=self.dtype)
+        start = tail & self.mask
+        first = min(count, self.capacity - start)
+        if first == count:
+            batch = self.records[start:start + count].copy()
+        else:
+            batch = np.concatenate((self.records[start:], self.records[:count - first]))
+        self.counters[_TAIL] = tail + count
+        return batch
+
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Remove up to `len(out)` records into a preallocated array, avoiding an allocation per read.
+        Consumer side only.
+        :return: The number of records copied into the front of `out`.
+        """
+        tail = int(self.counters[_TAIL])
+        count = min(int(self.counters[_HEAD]) - tail, len(out))
+        if count <= 0:
+            return 0
+        start = tail & self.mask
+        first = min(count, self.capacity - start)
+        out[:first] = self.records[start:start + first]
+        if first < count:
+            out[first:count] = self.records[:count - first]
+        self.counters[_TAIL] = tail + count
+        return count
+
+
+    def read_wait(self, limit: Optional[int] = None, timeout: Optional[float] = None) -> np.ndarray:
+        """Like `read`, but wait with the ring's wait strategy until records arrive or `timeout` passes.
+        :return: The records, empty on timeout.
+        """
+        batch = self.read(limit)
+        if len(batch):
+            return batch
+        deadline = None if timeout is None else time.monotonic() + timeout
+        counters = self.counters
+        while True:
+            remaining = _WAIT_SLICE if deadline is None else min(_WAIT_SLICE, deadline - time.monotonic())
+            if remaining <= 0:
+                return batch
+            counters[_WAITING] = 1
+            # records published before the flag was seen by the producer are caught by this check
+            if counters[_HEAD] == counters[_TAIL]:
+                self.wait.wait(remaining)
+            counters[_WAITING] = 0
+            batch = self.read(limit)
+            if len(batch):
+                return batch
+
+
+    def close(self):
+        """Detach from the ring, and free it if this process created it."""
+        del self.counters, self.records
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
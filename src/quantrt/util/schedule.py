@@ -1,20 +1,24 @@
+import asyncio
 import datetime
-import exchange_calendars
 import functools
+import heapq
+import inspect
+import itertools
 import logging
-import pandas as pd
-import pytz
 import random
 import re
 import time
 
+import quantrt.common.config
+import quantrt.util.metrics
+import quantrt.util.sessions
+
 from collections.abc import Hashable
 from concurrent.futures import Executor
 from logging import Logger
-from typing import Set, List, Optional, Callable, Union
-
+from typing import Dict, Set, List, Optional, Callable, Tuple, Union
 
-EST = pytz.timezone("US/Eastern")
+from quantrt.common.clock import Clock
 
 
 class ScheduleError(Exception):
@@ -35,6 +39,18 @@ class IntervalError(ScheduleValueError):
     pass
 
 
+JOB_SECONDS = quantrt.util.metrics.default_registry.histogram(
+    "quantrt_job_seconds", "Wall time of scheduled job runs by job function.", ["job"])
+JOB_ERRORS = quantrt.util.metrics.default_registry.counter(
+    "quantrt_job_errors_total", "Scheduled job runs that raised, by job function.", ["job"])
+
+
+def _job_label(job: "Job") -> str:
+    """The metrics label of a job, the qualified name of its function."""
+    func = job.job_func
+    return getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+
+
 class CancelJob(object):
     """
     Can be returned from a job to unschedule itself.
@@ -48,12 +64,32 @@ class Scheduler(object):
     Objects instantiated by the :class:`Scheduler <Scheduler>` are
     factories to create jobs, keep record of scheduled jobs and
     handle their execution.
+    Pending runs are kept in a heap ordered by `next_run`, so scheduling
+    and popping the next job are O(log n). Cancelled or rescheduled jobs
+    leave stale heap entries behind which are skipped when popped.
     """
 
-    def __init__(self, logger: Optional[Logger] = None, executor: Optional[Executor] = None) -> None:
-        self.jobs: List[Job] = []
+    def __init__(self, logger: Optional[Logger] = None, executor: Optional[Executor] = None,
+                 clock: Optional[Clock] = None) -> None:
         self.logger: Optional[Logger] = logger
         self.executor: Optional[Executor] = executor
+        # the clock jobs are scheduled against, `config.clock` if None
+        self.clock: Optional[Clock] = clock
+        # registered jobs, in registration order
+        self._jobs: Dict[Job, None] = {}
+        # heap of (next_run, sequence, job), an entry is current only if
+        # `sequence` is the job's latest sequence number
+        self._queue: List[Tuple[datetime.datetime, int, Job]] = []
+        self._sequence = itertools.count()
+        # tag -> jobs with that tag, in registration order
+        self._tags: Dict[Hashable, Dict[Job, None]] = {}
+
+    @property
+    def jobs(self) -> List["Job"]:
+        """
+        All scheduled jobs, in the order they were scheduled.
+        """
+        return list(self._jobs)
 
     def run_pending(self, blocking: bool = True) -> None:
         """
@@ -63,12 +99,21 @@ class Scheduler(object):
         that should run every minute and you only call run_pending()
         in one hour increments then your job won't be run 60 times in
         between but only once.
+        A job that raises stays scheduled and the other due jobs still run, after
+        which the first exception is raised.
         :param blocking: Whether this should block the calling thread. Can only be False if
         the executor is not `None`.
         """
-        runnable_jobs = (job for job in self.jobs if job.should_run)
-        for job in sorted(runnable_jobs):
-            self._run_job(job, blocking)
+        now = self._now()
+        error = None
+        for job in self._pop_due(now):
+            try:
+                self._run_job(job, blocking, now)
+            except Exception as err:
+                if error is None:
+                    error = err
+        if error is not None:
+            raise error
 
     def run_all(self, delay_seconds: int = 0) -> None:
         """
@@ -78,7 +123,7 @@ class Scheduler(object):
         over time.
         :param delay_seconds: A delay added between every executed job
         """
-        for job in self.jobs[:]:
+        for job in list(self._jobs):
             self._run_job(job)
             time.sleep(delay_seconds)
 
@@ -90,9 +135,9 @@ class Scheduler(object):
                     jobs to retrieve
         """
         if tag is None:
-            return self.jobs[:]
+            return list(self._jobs)
         else:
-            return [job for job in self.jobs if tag in job.tags]
+            return list(self._tags.get(tag, ()))
 
     def clear(self, tag: Optional[Hashable] = None) -> None:
         """
@@ -102,19 +147,26 @@ class Scheduler(object):
                     jobs to delete
         """
         if tag is None:
-            del self.jobs[:]
+            self._jobs.clear()
+            self._tags.clear()
+            del self._queue[:]
         else:
-            self.jobs[:] = (job for job in self.jobs if tag not in job.tags)
+            for job in list(self._tags.get(tag, ())):
+                self.cancel_job(job)
 
     def cancel_job(self, job: "Job") -> None:
         """
         Delete a scheduled job.
         :param job: The job to be unscheduled
         """
-        try:
-            self.jobs.remove(job)
-        except ValueError:
-            pass
+        if self._jobs.pop(job, False) is not False:
+            for tag in job.tags:
+                self._untag(job, tag)
+            # Stale heap entries are skipped lazily, but compact the heap
+            # once they make up most of it.
+            if len(self._queue) > 2 * len(self._jobs) + 64:
+                self._queue = [entry for entry in self._queue if self._is_current(entry)]
+                heapq.heapify(self._queue)
 
     def every(self, interval: int = 1) -> "Job":
         """
@@ -125,10 +177,63 @@ class Scheduler(object):
         job = Job(interval, self)
         return job
 
-    def _run_job(self, job: "Job", blocking: bool = True) -> None:
-        ret = job.run(executor=self.executor, blocking=blocking)
-        if isinstance(ret, CancelJob) or ret is CancelJob:
-            self.cancel_job(job)
+    def _clock(self) -> Clock:
+        return self.clock or quantrt.common.config.clock
+
+    def _now(self) -> datetime.datetime:
+        return self._clock().now()
+
+    def _run_job(self, job: "Job", blocking: bool = True, now: Optional[datetime.datetime] = None) -> None:
+        label = _job_label(job)
+        start = time.perf_counter()
+        ret = None
+        try:
+            ret = job.run(executor=self.executor, blocking=blocking, now=now)
+        except Exception:
+            JOB_ERRORS.labels(label).inc()
+            raise
+        finally:
+            JOB_SECONDS.labels(label).observe(time.perf_counter() - start)
+            # the job was popped from the heap, so it is pushed back even if it raised
+            if isinstance(ret, CancelJob) or ret is CancelJob:
+                self.cancel_job(job)
+            elif job in self._jobs:
+                self._push(job)
+
+    def _add_job(self, job: "Job") -> None:
+        self._jobs[job] = None
+        for tag in job.tags:
+            self._tag(job, tag)
+        self._push(job)
+
+    def _push(self, job: "Job") -> None:
+        job._sequence = next(self._sequence)
+        heapq.heappush(self._queue, (job.next_run, job._sequence, job))
+
+    def _tag(self, job: "Job", tag: Hashable) -> None:
+        self._tags.setdefault(tag, {})[job] = None
+
+    def _untag(self, job: "Job", tag: Hashable) -> None:
+        tagged = self._tags.get(tag)
+        if tagged is not None:
+            tagged.pop(job, None)
+            if not tagged:
+                del self._tags[tag]
+
+    def _is_current(self, entry: Tuple[datetime.datetime, int, "Job"]) -> bool:
+        _, sequence, job = entry
+        return job._sequence == sequence and job in self._jobs
+
+    def _pop_due(self, now: datetime.datetime) -> List["Job"]:
+        """
+        Pop every job due at `now` from the heap, in the order they should run.
+        """
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            entry = heapq.heappop(self._queue)
+            if self._is_current(entry):
+                due.append(entry[2])
+        return due
 
     @property
     def next_run(self) -> Optional[datetime.datetime]:
@@ -137,9 +242,11 @@ class Scheduler(object):
         :return: A :class:`~datetime.datetime` object
                  or None if no jobs scheduled
         """
-        if not self.jobs:
+        while self._queue and not self._is_current(self._queue[0]):
+            heapq.heappop(self._queue)
+        if not self._queue:
             return None
-        return min(self.jobs).next_run
+        return self._queue[0][0]
 
     @property
     def idle_seconds(self) -> Optional[float]:
@@ -148,9 +255,127 @@ class Scheduler(object):
                  :meth:`next_run <Scheduler.next_run>`
                  or None if no jobs are scheduled
         """
-        if not self.next_run:
+        next_run = self.next_run
+        if not next_run:
             return None
-        return (self.next_run - datetime.datetime.now()).total_seconds()
+        return (next_run - self._now()).total_seconds()
+
+
+class AsyncScheduler(Scheduler):
+    """
+    A :class:`Scheduler <Scheduler>` driven by an asyncio event loop.
+    :meth:`run <AsyncScheduler.run>` sleeps exactly until the next job is
+    due instead of polling, and is woken early when a job is scheduled
+    before that. Due jobs are started as tasks, so coroutine jobs (e.g.
+    `Strategy.scan`) run concurrently, and jobs marked
+    :meth:`in_executor <Job.in_executor>` run on the executor without
+    blocking the loop. What happens when a job is due while its previous
+    run is still going is decided by the job's
+    :meth:`overlap <Job.overlap>` policy.
+    """
+
+    def __init__(self, logger: Optional[Logger] = None, executor: Optional[Executor] = None,
+                 clock: Optional[Clock] = None) -> None:
+        super().__init__(logger=logger, executor=executor, clock=clock)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: bool = False
+
+    async def run(self) -> None:
+        """
+        Run jobs as they become due until :meth:`stop <AsyncScheduler.stop>` is called.
+        """
+        self._wakeup = asyncio.Event()
+        self._running = True
+        while self._running:
+            self.run_pending()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self) -> None:
+        """
+        Stop :meth:`run <AsyncScheduler.run>` after the current tick.
+        Jobs that are already running are left to finish.
+        """
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def run_pending(self, blocking: bool = False) -> None:
+        """
+        Start all jobs that are scheduled to run as tasks on the running event loop.
+        :param blocking: Unused, jobs never block the event loop.
+        """
+        now = self._now()
+        for job in self._pop_due(now):
+            self._start_job(job, now)
+
+    def run_all(self, delay_seconds: int = 0) -> None:
+        """
+        Start all jobs regardless if they are scheduled to run or not.
+        :param delay_seconds: Unused, jobs are started concurrently.
+        """
+        now = self._now()
+        for job in list(self._jobs):
+            self._start_job(job, now)
+
+    def _push(self, job: "Job") -> None:
+        super()._push(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _start_job(self, job: "Job", now: datetime.datetime) -> None:
+        if job._is_overdue(now):
+            if self.logger: self.logger.debug("Cancelling job %s", job)
+            self.cancel_job(job)
+            return
+
+        running = [task for task in job._tasks if not task.done()]
+        previous = None
+        if running and job.overlap_policy == "skip":
+            if self.logger: self.logger.debug("Skipping job %s, the previous run has not finished", job)
+        else:
+            if running and job.overlap_policy == "cancel":
+                for task in running:
+                    task.cancel()
+            elif running and job.overlap_policy == "queue":
+                previous = running[-1]
+            if self.logger: self.logger.debug("Running job %s", job)
+            running.append(asyncio.ensure_future(self._execute(job, previous)))
+        job._tasks = running
+
+        job.last_run = now
+        job._schedule_next_run()
+        if job._is_overdue(job.next_run):
+            if self.logger: self.logger.debug("Cancelling job %s", job)
+            self.cancel_job(job)
+        elif job in self._jobs:
+            self._push(job)
+
+    async def _execute(self, job: "Job", previous: Optional[asyncio.Future]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        label = _job_label(job)
+        start = time.perf_counter()
+        try:
+            if job.use_executor:
+                ret = await asyncio.get_event_loop().run_in_executor(self.executor, job.job_func)
+            else:
+                ret = job.job_func()
+                if inspect.isawaitable(ret):
+                    ret = await ret
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            JOB_ERRORS.labels(label).inc()
+            if self.logger: self.logger.exception("Job %s raised an exception", job)
+            return
+        finally:
+            JOB_SECONDS.labels(label).observe(time.perf_counter() - start)
+        if isinstance(ret, CancelJob) or ret is CancelJob:
+            self.cancel_job(job)
 
 
 class Job(object):
@@ -205,6 +430,18 @@ class Job(object):
         self.tags: Set[Hashable] = set()  # unique set of tags for the job
         self.scheduler: Optional[Scheduler] = scheduler  # scheduler to register with
 
+        # sequence number of the job's current entry in the scheduler's heap
+        self._sequence: Optional[int] = None
+
+        # what an AsyncScheduler does when the job is due while it is still running
+        self.overlap_policy: str = "skip"
+
+        # whether an AsyncScheduler runs the job on its executor
+        self.use_executor: bool = False
+
+        # the runs of the job started by an AsyncScheduler
+        self._tasks: List[asyncio.Future] = []
+
     def __lt__(self, other) -> bool:
         """
         PeriodicJobs are sortable based on the scheduled time they
@@ -411,6 +648,9 @@ class Job(object):
         if not all(isinstance(tag, Hashable) for tag in tags):
             raise TypeError("Tags must be hashable")
         self.tags.update(tags)
+        if self.scheduler is not None and self in self.scheduler._jobs:
+            for tag in tags:
+                self.scheduler._tag(self, tag)
         return self
 
     def at(self, time_str):
@@ -482,6 +722,33 @@ class Job(object):
         self.at_time = datetime.time(hour, minute, second)
         return self
 
+    def overlap(self, policy: str) -> "Job":
+        """
+        Specify what an :class:`AsyncScheduler <AsyncScheduler>` does when
+        the job is due while its previous run has not finished.
+        :param policy: One of
+            - `skip` -> do not start this run (the default)
+            - `queue` -> start this run once the previous one finishes
+            - `cancel` -> cancel the previous run and start this one
+        :return: The invoked job instance
+        """
+        if policy not in ("skip", "queue", "cancel"):
+            raise ScheduleValueError(
+                "Invalid overlap policy ({} is not one of `skip`, `queue` or `cancel`)".format(policy)
+            )
+        self.overlap_policy = policy
+        return self
+
+    @property
+    def in_executor(self):
+        """
+        Run the job on the scheduler's executor. Use this for CPU bound
+        jobs so that an :class:`AsyncScheduler <AsyncScheduler>` does not
+        block its event loop while they run.
+        """
+        self.use_executor = True
+        return self
+
     def at_event(self, event: str) -> "Job":
         """
         Specify an event to run at.
@@ -561,10 +828,10 @@ class Job(object):
         if isinstance(until_time, datetime.datetime):
             self.cancel_after = until_time
         elif isinstance(until_time, datetime.timedelta):
-            self.cancel_after = datetime.datetime.now() + until_time
+            self.cancel_after = self._now() + until_time
         elif isinstance(until_time, datetime.time):
             self.cancel_after = datetime.datetime.combine(
-                datetime.datetime.now(), until_time
+                self._now(), until_time
             )
         elif isinstance(until_time, str):
             cancel_after = self._decode_datetimestr(
@@ -581,7 +848,7 @@ class Job(object):
                 raise ScheduleValueError("Invalid string format for until()")
             if "-" not in until_time:
                 # the until_time is a time-only format. Set the date to today
-                now = datetime.datetime.now()
+                now = self._now()
                 cancel_after = cancel_after.replace(
                     year=now.year, month=now.month, day=now.day
                 )
@@ -591,7 +858,7 @@ class Job(object):
                 "until() takes a string, datetime.datetime, datetime.timedelta, "
                 "datetime.time parameter"
             )
-        if self.cancel_after < datetime.datetime.now():
+        if self.cancel_after < self._now():
             raise ScheduleValueError(
                 "Cannot schedule a job to run until a time in the past"
             )
@@ -614,7 +881,7 @@ class Job(object):
                 "Unable to a add job to schedule. "
                 "Job is not associated with an scheduler"
             )
-        self.scheduler.jobs.append(self)
+        self.scheduler._add_job(self)
         return self
 
     @property
@@ -623,9 +890,10 @@ class Job(object):
         :return: ``True`` if the job should be run now.
         """
         assert self.next_run is not None, "must run _schedule_next_run before"
-        return datetime.datetime.now() >= self.next_run
+        return self._now() >= self.next_run
 
-    def run(self, executor: Optional[Executor] = None, blocking: bool = True):
+    def run(self, executor: Optional[Executor] = None, blocking: bool = True,
+            now: Optional[datetime.datetime] = None):
         """
         Run the job and immediately reschedule it.
         If the job's deadline is reached (configured using .until()), the job is not
@@ -635,10 +903,11 @@ class Job(object):
         :param executor: The optional executor to run the job on.
         :param blocking: Whether the job should wait on the result from the executor. Executor must
         not be none.
+        :param now: The time the scheduler read for this tick. Defaults to the current time.
         :return: The return value returned by the `job_func`, or CancelJob if the job's
                  deadline is reached.
         """
-        if self._is_overdue(datetime.datetime.now()):
+        if self._is_overdue(now or self._now()):
             if self.scheduler.logger: self.scheduler.logger.debug("Cancelling job %s", self)
             return CancelJob
 
@@ -651,7 +920,7 @@ class Job(object):
         else:
             ret = self.job_func()
 
-        self.last_run = datetime.datetime.now()
+        self.last_run = self._now()
         self._schedule_next_run()
 
         if self._is_overdue(self.next_run):
@@ -665,13 +934,14 @@ class Job(object):
         """
         if self.event:
             event, exchange = self.event.split("/")
-            cal: exchange_calendars.ExchangeCalendar = exchange_calendars.get_calendar(exchange)
+            sessions = quantrt.util.sessions.get_session_index(exchange)
+            clock = self._clock()
             if event == "market_open":
-                dt: datetime.datetime = cal.next_open(pd.Timestamp.today(tz=pytz.UTC)).to_pydatetime()
-                dt = dt.astimezone(tz=EST).replace(tzinfo=None)
+                dt: datetime.datetime = sessions.next_open(clock.now_utc())
+                dt = dt.astimezone(tz=clock.tzinfo).replace(tzinfo=None)
             elif event == "market_close":
-                dt: datetime.datetime = cal.next_close(pd.Timestamp.today(tz=pytz.UTC)).to_pydatetime()
-                dt = dt.astimezone(tz=EST).replace(tzinfo=None)
+                dt: datetime.datetime = sessions.next_close(clock.now_utc())
+                dt = dt.astimezone(tz=clock.tzinfo).replace(tzinfo=None)
             else:
                 raise ScheduleValueError(
                     "Invalid event ({} is not of type `market_open` or `market_close`)".format(event)
@@ -698,7 +968,7 @@ class Job(object):
             interval = self.interval
 
         self.period = datetime.timedelta(**{self.unit: interval})
-        self.next_run = datetime.datetime.now() + self.period
+        self.next_run = self._now() + self.period
         if self.start_day is not None:
             if self.unit != "weeks":
                 raise ScheduleValueError("`unit` should be 'weeks'")
@@ -733,7 +1003,7 @@ class Job(object):
             # as well. This accounts for when a job takes so long it finished
             # in the next period.
             if not self.last_run or (self.next_run - self.last_run) > self.period:
-                now = datetime.datetime.now()
+                now = self._now()
                 if (
                     self.unit == "days"
                     and self.at_time > now.time()
@@ -752,9 +1022,17 @@ class Job(object):
                     self.next_run = self.next_run - datetime.timedelta(minutes=1)
         if self.start_day is not None and self.at_time is not None:
             # Let's see if we will still make that time we specified today
-            if (self.next_run - datetime.datetime.now()).days >= 7:
+            if (self.next_run - self._now()).days >= 7:
                 self.next_run -= self.period
 
+    def _clock(self) -> Clock:
+        if self.scheduler is None:
+            return quantrt.common.config.clock
+        return self.scheduler._clock()
+
+    def _now(self) -> datetime.datetime:
+        return self._clock().now()
+
     def _is_overdue(self, when: datetime.datetime):
         return self.cancel_after is not None and when > self.cancel_after
 
@@ -774,9 +1052,16 @@ class Job(object):
 
 #: Default :class:`Scheduler <Scheduler>` object
 default_scheduler = Scheduler()
+quantrt.util.metrics.default_registry.collect(
+    "quantrt_scheduled_jobs", "Jobs scheduled on the default scheduler.", "gauge",
+    lambda: [("quantrt_scheduled_jobs", {}, len(default_scheduler.jobs))])
+
 
-#: Default :class:`Jobs <Job>` list
-jobs = default_scheduler.jobs  # todo: should this be a copy, e.g. jobs()?
+def jobs() -> List[Job]:
+    """Calls :meth:`jobs <Scheduler.jobs>` on the
+    :data:`default scheduler instance <default_scheduler>`.
+    """
+    return default_scheduler.jobs
 
 
 def every(interval: int = 1) -> Job:
@@ -0,0 +1,161 @@
+import datetime
+import numpy as np
+import os
+import time
+
+import quantrt.common.config
+import quantrt.common.log
+
+from typing import Dict, Optional, Union
+
+
+__all__ = ["SessionIndex", "get_session_index"]
+
+
+UTC = datetime.timezone.utc
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+
+""" How long an on-disk session index is trusted before it is rebuilt from `exchange_calendars`. """
+MAX_AGE = datetime.timedelta(days=30)
+
+
+Instant = Union[datetime.datetime, int]
+
+
+def to_ns(when: Instant) -> int:
+    """Convert a timezone aware datetime, or nanoseconds since the epoch, to nanoseconds since the epoch.
+    Naive datetimes are taken to be UTC.
+    """
+    if isinstance(when, datetime.datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC)
+        return ((when - EPOCH) // datetime.timedelta(microseconds=1)) * 1000
+    return int(when)
+
+
+def from_ns(ns: int) -> datetime.datetime:
+    """Convert nanoseconds since the epoch to a UTC datetime."""
+    return EPOCH + datetime.timedelta(microseconds=int(ns) // 1000)
+
+
+class SessionIndex:
+    """The trading sessions of an exchange as sorted int64 arrays of open and close times,
+    in nanoseconds since the epoch. Building an `exchange_calendars` calendar takes hundreds
+    of milliseconds, so an index is built once per exchange and cached on disk, after which
+    every lookup is a binary search.
+    :param exchange: The exchange calendar name, e.g. `XNYS`.
+    :param opens: The session open times.
+    :param closes: The session close times.
+    :param built: When the index was built, in nanoseconds since the epoch.
+    """
+
+    def __init__(self, exchange: str, opens: np.ndarray, closes: np.ndarray, built: int):
+        self.exchange: str = exchange
+        self.opens: np.ndarray = opens
+        self.closes: np.ndarray = closes
+        self.built: int = built
+
+
+    @classmethod
+    def build(cls, exchange: str) -> "SessionIndex":
+        """Build the index from `exchange_calendars`."""
+        import exchange_calendars
+
+        quantrt.common.log.QuantrtLog.info("Building the session index of %s", exchange)
+        cal = exchange_calendars.get_calendar(exchange)
+        return cls(exchange, cls._as_ns(cal.opens), cls._as_ns(cal.closes), time.time_ns())
+
+
+    @classmethod
+    def load(cls, exchange: str, path: str) -> "SessionIndex":
+        with np.load(path) as data:
+            return cls(exchange, data["opens"], data["closes"], int(data["built"]))
+
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as fhandle:
+            np.savez(fhandle, opens=self.opens, closes=self.closes, built=np.int64(self.built))
+        os.replace(path + ".tmp", path)
+
+
+    def next_open(self, when: Instant) -> datetime.datetime:
+        """The first session open strictly after `when`, as a UTC datetime."""
+        return from_ns(self._next(self.opens, to_ns(when)))
+
+
+    def next_close(self, when: Instant) -> datetime.datetime:
+        """The first session close strictly after `when`, as a UTC datetime."""
+        return from_ns(self._next(self.closes, to_ns(when)))
+
+
+    def next_opens(self, when: np.ndarray) -> np.ndarray:
+        """Vectorized `next_open` over an int64 array of nanoseconds since the epoch."""
+        return self._next_many(self.opens, when)
+
+
+    def next_closes(self, when: np.ndarray) -> np.ndarray:
+        """Vectorized `next_close` over an int64 array of nanoseconds since the epoch."""
+        return self._next_many(self.closes, when)
+
+
+    def is_open(self, when: Instant) -> bool:
+        """Whether `when` falls inside a trading session."""
+        ns = to_ns(when)
+        i = np.searchsorted(self.opens, ns, side="right") - 1
+        return i >= 0 and ns < self.closes[i]
+
+
+    def _next(self, times: np.ndarray, ns: int) -> int:
+        i = np.searchsorted(times, ns, side="right")
+        if i == len(times):
+            raise ValueError("{} is past the last session of the {} calendar".format(from_ns(ns), self.exchange))
+        return int(times[i])
+
+
+    def _next_many(self, times: np.ndarray, when: np.ndarray) -> np.ndarray:
+        when = np.asarray(when, dtype=np.int64)
+        i = np.searchsorted(times, when, side="right")
+        past = i == len(times)
+        if past.any():
+            raise ValueError("{} is past the last session of the {} calendar".format(
+                from_ns(when[past].min()), self.exchange))
+        return times[i]
+
+
+    @staticmethod
+    def _as_ns(times) -> np.ndarray:
+        if times.dt.tz is not None:
+            times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+        return np.asarray(times, dtype="datetime64[ns]").view(np.int64)
+
+
+""" Session indexes loaded in this process, keyed by exchange. """
+session_indexes: Dict[str, SessionIndex] = {}
+
+
+def get_session_index(exchange: str, cache_dir: Optional[str] = None) -> SessionIndex:
+    """Get the session index of an exchange, loading it from disk or building it on first use.
+    :param exchange: str - the exchange calendar name, e.g. `XNYS`.
+    :param cache_dir: Optional[str] - where indexes are cached. Defaults to `app_dir/cache/calendars`.
+    :return: The session index.
+    """
+    index = session_indexes.get(exchange)
+    if index is not None:
+        return index
+
+    if cache_dir is None:
+        cache_dir = os.path.join(quantrt.common.config.app_dir, "cache", "calendars")
+    path = os.path.join(cache_dir, "{}.npz".format(exchange))
+
+    if os.path.exists(path):
+        index = SessionIndex.load(exchange, path)
+        if time.time_ns() - index.built > MAX_AGE // datetime.timedelta(microseconds=1) * 1000:
+            index = None
+    if index is None:
+        index = SessionIndex.build(exchange)
+        index.save(path)
+
+    session_indexes[exchange] = index
+    return index
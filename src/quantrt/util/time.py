@@ -1,41 +1,36 @@
+import numpy as np
+
 import quantrt.common.config
 
 from datetime import datetime, timedelta
+from quantrt.common.clock import SimulatedClock
 from quantrt.common.timescale import Timescale
-from typing import List
+from typing import List, Union
+
+
+__all__ = ["datetime_floor", "now", "tick", "timestamps", "to_epoch_array",
+           "floor_array", "bucket_grid", "timestamps_array"]
 
 
-__all__ = ["datetime_floor", "now"]
+Instant = Union[datetime, int, np.integer]
 
 
 def datetime_floor(dt: datetime, scale: Timescale) -> datetime:
-    if scale == Timescale.Minute:
-        return dt.replace(second = 0, microsecond = 0)
-    if scale == Timescale.FiveMinute:
-        return dt.replace(minute = (dt.minute // 5) * 5, second = 0, microsecond = 0)
-    if scale == Timescale.FifteenMinute:
-        return dt.replace(minute = (dt.minute // 15) * 15, second = 0, microsecond = 0)
-    if scale == Timescale.ThirtyMinute:
-        return dt.replace(minute = (dt.minute // 30) * 30, second = 0, microsecond = 0)
-    if scale == Timescale.Hour:
-        return dt.replace(minute = 0, second = 0, microsecond = 0)
-    if scale == Timescale.SixHour:
-        return dt.replace(hour = (dt.hour // 6) * 6, minute = 0, second = 0, microsecond = 0)
-    if scale == Timescale.Day:
-        return dt.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
-    # Fall through for unknown
-    return dt
+    # Every timescale evenly divides a day, so flooring is the seconds since midnight modulo the width.
+    width = scale.seconds
+    offset = (dt.hour * 3600 + dt.minute * 60 + dt.second) % width
+    return dt.replace(microsecond = 0) - timedelta(seconds = offset)
 
 
 def now() -> datetime:
-    if quantrt.common.config.build_label == "live":
-        return datetime.now()
-    return quantrt.common.config.curtime
+    return quantrt.common.config.clock.now()
 
 
 def tick(secs: int):
-     if quantrt.common.config.build_label == "backtest":
-        quantrt.common.config.curtime += timedelta(seconds=secs)
+    clock = quantrt.common.config.clock
+    if isinstance(clock, SimulatedClock):
+        clock.advance(timedelta(seconds=secs))
+        quantrt.common.config.curtime = clock.now()
 
 
 def timestamps(start: datetime, stop: datetime, interval: timedelta) -> List[datetime]:
@@ -44,3 +39,36 @@ def timestamps(start: datetime, stop: datetime, interval: timedelta) -> List[dat
         times.append(times[-1] + interval)
     times.append(stop)
     return times
+
+
+def to_epoch_array(tstamps) -> np.ndarray:
+    """Convert datetimes, a datetime64 array, or epoch nanoseconds to an int64 array of epoch nanoseconds.
+    Naive datetimes are taken to be UTC.
+    """
+    array = np.asarray(tstamps)
+    if array.dtype.kind in "iu":
+        return array.astype(np.int64, copy=False)
+    return array.astype("datetime64[ns]").view(np.int64)
+
+
+def floor_array(tstamps: np.ndarray, scale: Timescale) -> np.ndarray:
+    """Vectorized `datetime_floor` of an int64 array of epoch nanoseconds."""
+    tstamps = to_epoch_array(tstamps)
+    return tstamps - tstamps % scale.nanoseconds
+
+
+def bucket_grid(start: Instant, stop: Instant, scale: Timescale) -> np.ndarray:
+    """Every bucket of `scale` in [floor(start), stop) as an int64 array of epoch nanoseconds."""
+    width = scale.nanoseconds
+    start, stop = to_epoch_array([start, stop])
+    return np.arange(start - start % width, stop, width, dtype=np.int64)
+
+
+def timestamps_array(start: Instant, stop: Instant, interval: Union[timedelta, int]) -> np.ndarray:
+    """Vectorized `timestamps` over epoch nanoseconds. `interval` is a timedelta or nanoseconds."""
+    if isinstance(interval, timedelta):
+        interval = (interval // timedelta(microseconds = 1)) * 1000
+    start, stop = to_epoch_array([start, stop])
+    if start >= stop:
+        return np.array([start, stop], dtype=np.int64)
+    return np.append(np.arange(start, stop, interval, dtype=np.int64), stop)
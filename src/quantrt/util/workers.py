@@ -0,0 +1,47 @@
+import importlib.util
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+
+__all__ = ["load_script", "run_script", "script_executor"]
+
+
+def load_script(path: str) -> Any:
+    """Load a script file and return its `main` function.
+    :param path: The script file.
+    """
+    spec = importlib.util.spec_from_file_location("quantrt_script", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    main_func = getattr(module, "main", None)
+    if not callable(main_func):
+        raise ValueError("The `main` function of the script {} is not callable.".format(path))
+    return main_func
+
+
+def run_script(path: str) -> Any:
+    """Run the `main` function of a script file in a worker process.
+    Scripts are sent to workers by path, since functions of modules loaded from a file cannot be pickled.
+    :param path: The script file.
+    """
+    return load_script(path)()
+
+
+def script_executor(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """A process pool for scripts whose workers start from a fresh interpreter rather than a fork of the app.
+
+    Forking the app would copy its event loop, its log writer and executor threads and the locks
+    they hold, so workers are forked from a forkserver that preloads this module, or spawned where
+    there is no forkserver. Either way multiprocessing imports the main script in every worker as
+    `__mp_main__`, so workers of `app.py` import its modules, which load their heavy dependencies
+    lazily, but never run `initialize`.
+    :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
@@ -0,0 +1,34 @@
+import datetime
+import pytest
+
+from quantrt.common.clock import SimulatedClock
+from quantrt.util.schedule import Scheduler
+
+
+START = datetime.datetime(2021, 1, 4, 12, 0)
+
+
+def test_raising_job_stays_scheduled():
+    clock = SimulatedClock(START)
+    scheduler = Scheduler(clock=clock)
+    calls = []
+
+    def fail():
+        calls.append("fail")
+        raise RuntimeError("boom")
+
+    scheduler.every(1).minutes.do(fail)
+    scheduler.every(1).minutes.do(lambda: calls.append("ok"))
+
+    clock.advance(datetime.timedelta(minutes=1))
+    with pytest.raises(RuntimeError):
+        scheduler.run_pending()
+    # the job after the failing one still ran in the same tick
+    assert calls == ["fail", "ok"]
+    assert len(scheduler.get_jobs()) == 2
+    assert scheduler.next_run is not None
+
+    clock.advance(datetime.timedelta(minutes=1))
+    with pytest.raises(RuntimeError):
+        scheduler.run_pending()
+    assert calls == ["fail", "ok", "fail", "ok"]